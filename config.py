@@ -1,7 +1,7 @@
 import os
 import logging
 
-from pili.filters import to_bool
+from pili.filters import to_bool, to_floats
 
 basedir = os.path.abspath(os.path.dirname(__file__))
 
@@ -11,6 +11,17 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16 Mb
     METRICS_URL = '/metrics'
+    # Prometheus histograms' buckets: request latency (seconds), response size (bytes)
+    METRICS_LATENCY_BUCKETS = to_floats(
+        os.environ.get(
+            'METRICS_LATENCY_BUCKETS', '0.01,0.025,0.05,0.1,0.25,0.5,1,2.5,5,10'
+        )
+    )
+    METRICS_RESPONSE_SIZE_BUCKETS = to_floats(
+        os.environ.get(
+            'METRICS_RESPONSE_SIZE_BUCKETS', '256,1024,4096,16384,65536,262144,1048576'
+        )
+    )
 
     # Logging
     LOG_LEVEL = logging.DEBUG
@@ -28,12 +39,35 @@ class Config:
     REDIS_PASSWORD = os.environ.get('REDIS_PASSWORD', None)
     REDIS_TIMEOUT = int(os.environ.get('REDIS_TIMEOUT', 3))
     REDIS_CONNECT_TIMEOUT = int(os.environ.get('REDIS_CONNECT_TIMEOUT', 3))
+    # process-wide pool: max connections per worker process, seconds to wait
+    # for a free connection, seconds of idling before a connection is PINGed
+    REDIS_MAX_CONNECTIONS = int(os.environ.get('REDIS_MAX_CONNECTIONS', 50))
+    REDIS_POOL_TIMEOUT = int(os.environ.get('REDIS_POOL_TIMEOUT', 3))
+    REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get('REDIS_HEALTH_CHECK_INTERVAL', 30))
+    # circuit breaker: consecutive failures to open, seconds before a probe
+    REDIS_BREAKER_FAILURES = int(os.environ.get('REDIS_BREAKER_FAILURES', 5))
+    REDIS_BREAKER_RECOVERY_TIMEOUT = int(os.environ.get('REDIS_BREAKER_RECOVERY_TIMEOUT', 30))
+    # seconds a request may spend on Redis before skipping it, 0 means no limit
+    REDIS_REQUEST_BUDGET = float(os.environ.get('REDIS_REQUEST_BUDGET', 0.25))
+    # in-process cache tier in front of Redis, per worker process
+    CACHE_LOCAL_ENABLE = to_bool(os.environ.get('CACHE_LOCAL_ENABLE'))
+    CACHE_LOCAL_MAX_ENTRIES = int(os.environ.get('CACHE_LOCAL_MAX_ENTRIES', 1024))
+    CACHE_LOCAL_MAX_BYTES = int(os.environ.get('CACHE_LOCAL_MAX_BYTES', 32 * 1024 * 1024))
+    CACHE_LOCAL_TTL = int(os.environ.get('CACHE_LOCAL_TTL', 60))  # seconds
+    # lifetime of cache tags' key sets, should exceed cached keys' lifetime
+    CACHE_TAG_EXPIRE = int(os.environ.get('CACHE_TAG_EXPIRE', 24 * 60 * 60))
+    # json, pickle or msgpack (if installed); values larger than the threshold
+    # (bytes) are compressed with zlib or lz4 (if installed), None to disable
+    CACHE_SERIALIZER = os.environ.get('CACHE_SERIALIZER', 'json')
+    CACHE_COMPRESSION = os.environ.get('CACHE_COMPRESSION', None)
+    CACHE_COMPRESS_THRESHOLD = int(os.environ.get('CACHE_COMPRESS_THRESHOLD', 1024))
 
     # SQLAlchemy
     # TODO commit on teardown considered dangerous and deprecated
     # Remove the option and add explicit db.session.commit() throughout the code
     SQLALCHEMY_COMMIT_ON_TEARDOWN = True
-    SQLALCHEMY_RECORD_QUERIES = True
+    # queries are counted and timed by pili.instrumentation instead
+    SQLALCHEMY_RECORD_QUERIES = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
     # MAIL
@@ -83,7 +117,23 @@ class Config:
     PILI_COMMENTS_SCREENING = True    # comment screened by default
     PILI_REGISTRATION_OPEN = True    # can new user register by themselves? 
     PILI_FOLLOWERS_PER_PAGE = int(os.environ.get('PILI_FOLLOWERS_PER_PAGE', 100))
-    PILI_SLOW_DB_QUERY_TIME = 0.5
+    # keyset pagination for all listings supporting it, not only on ?cursor=
+    PILI_CURSOR_PAGINATION = to_bool(os.environ.get('PILI_CURSOR_PAGINATION'))
+    PILI_LAST_SEEN_INTERVAL = int(os.environ.get('PILI_LAST_SEEN_INTERVAL', 60))  # seconds
+    # add body-based ETag to all GET responses, answer If-None-Match with 304
+    PILI_AUTO_ETAG = to_bool(os.environ.get('PILI_AUTO_ETAG', 'True'))
+    # seconds proxies and browsers may keep anonymous pages cached for
+    PILI_PAGE_CACHE_MAX_AGE = int(os.environ.get('PILI_PAGE_CACHE_MAX_AGE', 60))
+    # Rate limit policies overriding decorators' defaults by endpoint, e.g.
+    # {'api.get_token': {'algorithm': 'token_bucket', 'limit': 10, 'period': 60,
+    #                    'burst': 3, 'per': 'user'}}
+    # algorithms: fixed_window, sliding_window, token_bucket; per: ip, user
+    PILI_RATE_LIMITS = {}
+    PILI_SLOW_DB_QUERY_TIME = 0.5  # seconds, slower queries are logged
+    # count queries by shape per request and log the ones repeated at least
+    # PILI_REPEATED_QUERY_THRESHOLD times (N+1 queries), costs some CPU and memory
+    PILI_QUERY_FINGERPRINTS = False
+    PILI_REPEATED_QUERY_THRESHOLD = 5
     PILI_ROLES_EDIT_OTHERS_POSTS = ['Editor', 'Administrator']
     PILI_SHOW_ALL_FOLLOWED = ['index', 'tag', 'category']
     PILI_STATIC_DIR = os.path.join(basedir, 'pili/static')
@@ -105,6 +155,22 @@ class Config:
                                'img': ['src', 'alt']}
     PILI_ALLOWED_COMMENT_TAGS = ['a', 'abbr', 'acronym', 'b', 'code', 'em',
                                  'i', 'strong']
+    # Rendered Markdown cache: in-process LRU size and Redis TTL in seconds
+    PILI_RENDER_CACHE_SIZE = int(os.environ.get('PILI_RENDER_CACHE_SIZE', 1024))
+    PILI_RENDER_CACHE_EXPIRE = int(os.environ.get('PILI_RENDER_CACHE_EXPIRE', 24 * 60 * 60))
+    # Lifetime of cached template fragments in seconds, up to CACHE_TAG_EXPIRE
+    PILI_FRAGMENT_CACHE_EXPIRE = int(os.environ.get('PILI_FRAGMENT_CACHE_EXPIRE', 60 * 60))
+    # Render post bodies longer than the threshold (in characters) with Celery
+    PILI_RENDER_ASYNC = to_bool(os.environ.get('PILI_RENDER_ASYNC'))
+    PILI_RENDER_ASYNC_THRESHOLD = int(os.environ.get('PILI_RENDER_ASYNC_THRESHOLD', 64 * 1024))
+    # Keep followed posts' timelines in Redis, fanned out on write (run
+    # `pili timeline` to backfill them), the latest posts kept per user and
+    # lifetime of the timelines in seconds since they were read last time
+    PILI_TIMELINE = to_bool(os.environ.get('PILI_TIMELINE'))
+    PILI_TIMELINE_LENGTH = int(os.environ.get('PILI_TIMELINE_LENGTH', 800))
+    PILI_TIMELINE_EXPIRE = int(os.environ.get('PILI_TIMELINE_EXPIRE', 7 * 24 * 60 * 60))
+    # Seconds a cold user's timeline rebuild is not enqueued again for
+    PILI_TIMELINE_REBUILD_TIMEOUT = int(os.environ.get('PILI_TIMELINE_REBUILD_TIMEOUT', 60))
     # Truncate text in a template
     PILI_BODY_TRUNCATE = {'length': 128, 'killwords': True, 'end': '...'}
 
@@ -117,6 +183,7 @@ class DevelopmentConfig(Config):
     DEBUG = True
     SQLALCHEMY_DATABASE_URI = os.environ.get('DEV_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-dev.sqlite')
+    PILI_QUERY_FINGERPRINTS = True
     SENTRY_DISABLE = False
 
     @staticmethod
@@ -130,6 +197,7 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = os.environ.get('TEST_DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'data-test.sqlite')
     WTF_CSRF_ENABLED = False
+    PILI_QUERY_FINGERPRINTS = True
     SENTRY_DISABLE = False
 
 
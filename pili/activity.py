@@ -0,0 +1,144 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import redis
+from flask import current_app
+from sqlalchemy import bindparam, or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from pili.app import db, redis as redis_connector
+from pili.models import User
+
+#
+# Constants
+#
+
+LAST_SEEN_KEY = 'last_seen'
+LAST_SEEN_FLUSH_KEY = 'last_seen:flush'
+
+
+#
+# Buffers
+#
+
+
+class LastSeenBuffer:
+    """
+    Thread-safe in-process buffer of users' last activity times
+    """
+
+    def __init__(self) -> None:
+        self._data = {}  # type: Dict[int, datetime]
+        self._lock = threading.Lock()
+        self._flushed_at = time.monotonic()
+
+    def add(self, user_id: int, timestamp: datetime) -> None:
+        with self._lock:
+            self._data[user_id] = timestamp
+
+    def pop_due(self, interval: int) -> Dict[int, datetime]:
+        """
+        Return buffered times and empty the buffer, if interval has passed
+        """
+        with self._lock:
+            now = time.monotonic()
+            if now - self._flushed_at < interval:
+                return {}
+            self._flushed_at = now
+            data, self._data = self._data, {}
+            return data
+
+
+buffer = LastSeenBuffer()
+
+
+def _redis_add_pop_due(
+    user_id: int, timestamp: datetime, interval: int
+) -> Dict[int, datetime]:
+    """Buffer user's activity in the Redis hash shared by all the workers.
+
+    Return buffered times and empty the hash, if the current worker is the
+    first one to acquire the flush lock for the interval.
+    """
+    pipe = redis_connector.connection.pipeline()
+    pipe.hset(
+        LAST_SEEN_KEY, user_id, timestamp.replace(tzinfo=timezone.utc).timestamp()
+    )
+    pipe.set(LAST_SEEN_FLUSH_KEY, 1, nx=True, ex=interval)
+    with redis_connector.guard():
+        _, acquired = pipe.execute()
+    if not acquired:
+        return {}
+
+    pipe = redis_connector.connection.pipeline()
+    pipe.hgetall(LAST_SEEN_KEY)
+    pipe.delete(LAST_SEEN_KEY)
+    with redis_connector.guard():
+        data, _ = pipe.execute()
+    return {
+        int(user_id): datetime.utcfromtimestamp(float(seen))
+        for user_id, seen in data.items()
+    }
+
+
+#
+# Public API
+#
+
+
+def write_last_seen(last_seen: Dict[int, datetime], connection=None) -> None:
+    """Update users' last seen times in a single executemany statement.
+
+    Times never go backwards, so that flushes of the buffers of different
+    workers can be done in any order.
+    """
+    if not last_seen:
+        return
+    users = User.__table__
+    statement = (
+        users.update()
+        .where(users.c.id == bindparam('user_id'))
+        .where(or_(users.c.last_seen.is_(None), users.c.last_seen < bindparam('seen')))
+        .values(last_seen=bindparam('seen'))
+    )
+    params = [{'user_id': id, 'seen': seen} for id, seen in last_seen.items()]
+    if connection is not None:
+        connection.execute(statement, params)
+        return
+    with db.engine.begin() as connection:
+        connection.execute(statement, params)
+
+
+def record_last_seen(user: User, now: Optional[datetime] = None) -> None:
+    """Record user's activity instead of writing User.last_seen on each request.
+
+    Activity is ignored if the stored last seen time is fresher than
+    PILI_LAST_SEEN_INTERVAL seconds; otherwise it's buffered either in Redis,
+    or in process, if caching is disabled or Redis is unavailable. Buffers
+    are flushed to the database at most once per the interval.
+    """
+    interval = current_app.config['PILI_LAST_SEEN_INTERVAL']
+    now = now or datetime.utcnow()
+    if user.last_seen is not None and now - user.last_seen < timedelta(
+        seconds=interval
+    ):
+        return
+
+    due = None  # type: Optional[Dict[int, datetime]]
+    if not current_app.config.get('CACHE_DISABLE') and redis_connector.available():
+        try:
+            due = _redis_add_pop_due(user.id, now, interval)
+        except redis.RedisError:
+            current_app.logger.exception(
+                'Redis connection failed while recording last seen time'
+            )
+    if due is None:
+        buffer.add(user.id, now)
+        due = buffer.pop_due(interval)
+
+    try:
+        write_last_seen(due)
+    except SQLAlchemyError:
+        current_app.logger.exception('Failed to write last seen times')
@@ -2,23 +2,22 @@ from flask import current_app, g, jsonify, request, url_for
 
 from pili.api_1_0 import api
 from pili.api_1_0.decorators import permission_required
-from pili.app import db
+from pili.app import db, vary
+from pili.conditional import conditional
 from pili.models import Comment, Permission, Post
+from pili.pagination import paginate, pagination_urls
 
 
 @api.route('/comments/')
 def get_comments():
-    page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['PILI_COMMENTS_PER_PAGE'], error_out=False
+    pagination = paginate(
+        Comment.query,
+        Comment.timestamp,
+        Comment.id,
+        current_app.config['PILI_COMMENTS_PER_PAGE'],
     )
     comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page - 1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_comments', page=page + 1, _external=True)
+    prev, next = pagination_urls(pagination, 'api.get_comments')
     return jsonify(
         {
             'posts': [comment.to_json() for comment in comments],
@@ -36,19 +35,21 @@ def get_comment(id):
 
 
 @api.route('/posts/<int:id>/comments/')
+@conditional(
+    tags=lambda id: ['post:{}'.format(id)],
+    key_func=vary(query=['page', 'cursor', 'count'], headers=['Host']),
+)
 def get_post_comments(id):
     post = Post.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = post.comments.order_by(Comment.timestamp.asc()).paginate(
-        page, per_page=current_app.config['PILI_COMMENTS_PER_PAGE'], error_out=False
+    pagination = paginate(
+        post.comments,
+        Comment.timestamp,
+        Comment.id,
+        current_app.config['PILI_COMMENTS_PER_PAGE'],
+        descending=False,
     )
     comments = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_comments', page=page - 1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_comments', page=page + 1, _external=True)
+    prev, next = pagination_urls(pagination, 'api.get_post_comments', id=id)
     return jsonify(
         {
             'posts': [comment.to_json() for comment in comments],
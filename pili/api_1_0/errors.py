@@ -85,9 +85,17 @@ def page_not_found(exc: Optional[Exception]):
     return json_error_handler(error)
 
 
-def rate_limit_error(exc: Optional[Exception]):
-    error = RequestError(message='Too Many Requests', status_code=429, origin=exc)
-    return json_error_handler(error)
+def rate_limit_error(exc: RateLimitExceededError):
+    retry_after = getattr(exc, 'retry_after', 1)
+    error = RequestError(
+        message='Too Many Requests',
+        status_code=429,
+        origin=exc,
+        extra={'retry_after': retry_after},
+    )
+    response = json_error_handler(error)
+    response.headers['Retry-After'] = str(retry_after)
+    return response
 
 
 def generic_error(exc: Optional[Exception]):
@@ -3,24 +3,31 @@ from flask import current_app, g, jsonify, request, url_for
 from pili import exceptions
 from pili.api_1_0 import api
 from pili.api_1_0.decorators import permission_required
-from pili.app import cache_flask_view, db
+from pili.app import cache_flask_view, db, vary
+from pili.conditional import conditional
 from pili.models import Permission, Post
+from pili.pagination import paginate, pagination_urls
+
+POSTS_KEY = vary(query=['page', 'cursor', 'count'], headers=['Host'])
 
 
 @api.route('/posts/')
-@cache_flask_view(expire_seconds=15 * 60)
+# invalidated on posts' and comments' changes (comment_count is in the list);
+# shared by all the clients, but varies on Host as the list has absolute URLs
+@conditional(tags=['posts', 'comments'], key_func=POSTS_KEY)
+@cache_flask_view(
+    key_func=POSTS_KEY,
+    expire_seconds=6 * 60 * 60,
+    soft_ttl=5 * 60 * 60,
+    single_flight=True,
+    tags=['posts', 'comments'],
+)
 def get_posts():
-    page = request.args.get('page', 1, type=int)
-    pagination = Post.query.paginate(
-        page, per_page=current_app.config['PILI_POSTS_PER_PAGE'], error_out=False
+    pagination = paginate(
+        Post.query, Post.timestamp, Post.id, current_app.config['PILI_POSTS_PER_PAGE']
     )
     posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page - 1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_posts', page=page + 1, _external=True)
+    prev, next = pagination_urls(pagination, 'api.get_posts')
     return jsonify(
         {
             'posts': [post.to_json() for post in posts],
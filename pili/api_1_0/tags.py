@@ -3,10 +3,13 @@ import json
 from flask import current_app, jsonify, request, url_for
 
 from pili.api_1_0 import api
+from pili.app import vary
+from pili.conditional import conditional
 from pili.models import Post, Tag
 
 
 @api.route('/tags/')
+@conditional(tags=['tags'], key_func=vary(query=['page'], headers=['Host']))
 def get_tags():
     page = request.args.get('page', 1, type=int)
     pagination = Tag.query.paginate(
@@ -2,6 +2,8 @@ from flask import current_app, jsonify, request, url_for
 
 from pili.api_1_0 import api
 from pili.models import Post, User
+from pili.pagination import pagination_urls
+from pili.timeline import paginate_followed
 
 
 @api.route('/users/<int:id>')
@@ -37,17 +39,9 @@ def get_user_posts(id):
 @api.route('/users/<int:id>/timeline/')
 def get_user_followed_posts(id):
     user = User.query.get_or_404(id)
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed_posts.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['PILI_POSTS_PER_PAGE'], error_out=False
-    )
+    pagination = paginate_followed(user, current_app.config['PILI_POSTS_PER_PAGE'])
     posts = pagination.items
-    prev = None
-    if pagination.has_prev:
-        prev = url_for('api.get_posts', page=page - 1, _external=True)
-    next = None
-    if pagination.has_next:
-        next = url_for('api.get_posts', page=page + 1, _external=True)
+    prev, next = pagination_urls(pagination, 'api.get_user_followed_posts', id=id)
     return jsonify(
         {
             'posts': [post.to_json() for post in posts],
@@ -5,22 +5,37 @@ from inspect import getmembers, isfunction
 from typing import Any
 
 from celery import Celery
-from flask import Flask, request
+from flask import Flask, g, request
 from flask.logging import default_handler
 from flask_bootstrap import Bootstrap, WebCDN
-from flask_login import LoginManager
+from flask_login import LoginManager, current_user
 from flask_mail import Mail
 from flask_moment import Moment
 from flask_pagedown import PageDown
 from flask_sqlalchemy import SQLAlchemy
 from flask_thumbnails import Thumbnail
 from flask_wtf.csrf import CSRFProtect
-from prometheus_client import Counter, Histogram, Info
+from prometheus_client import Counter, Gauge, Histogram, Info
 from raven.contrib.flask import Sentry
 
 from config import Config, config
 from pili import jinja_filters
-from pili.connectors.redis import RedisConnector, cache, cache_flask_view, rate_limit
+from pili.conditional import conditional_response
+from pili.connectors.breaker import CLOSED, HALF_OPEN, OPEN
+from pili.connectors.keys import Vary
+from pili.connectors.redis import (
+    RedisConnector,
+    cache,
+    cache_flask_view,
+    cache_many,
+    rate_limit,
+)
+from pili.fragments import FragmentCacheExtension
+from pili.instrumentation import (
+    get_query_stats,
+    register_query_listeners,
+    report_repeated_queries,
+)
 from pili.version import get_version
 
 
@@ -33,6 +48,26 @@ def get_client_remote_addr(*args, **kwargs):
     )
 
 
+def get_current_user_key(*args, **kwargs):
+    """
+    Get authenticated user's key, either API's or web session's one
+    """
+    user = getattr(g, 'current_user', None) or current_user
+    if user is None or not user.is_authenticated:
+        return None
+    return 'user:{}'.format(user.id)
+
+
+def get_current_role_key(*args, **kwargs):
+    """
+    Get authenticated user's role key
+    """
+    user = getattr(g, 'current_user', None) or current_user
+    if user is None or not user.is_authenticated or user.role is None:
+        return None
+    return 'role:{}'.format(user.role.name)
+
+
 # Initialize extensions
 bootstrap = Bootstrap()
 mail = Mail()
@@ -48,10 +83,19 @@ sentry = Sentry()
 
 redis = RedisConnector()
 cache = partial(cache, connector=redis, key_func=get_client_remote_addr)
+cache_many = partial(cache_many, connector=redis)
 cache_flask_view = partial(
     cache_flask_view, connector=redis, key_func=get_client_remote_addr
 )
-rate_limit = partial(rate_limit, connector=redis, key_func=get_client_remote_addr)
+vary = partial(
+    Vary, user_key_func=get_current_user_key, role_key_func=get_current_role_key
+)
+rate_limit = partial(
+    rate_limit,
+    connector=redis,
+    key_func=get_client_remote_addr,
+    user_key_func=get_current_user_key,
+)
 
 login_manager = LoginManager()
 login_manager.session_protection = 'strong'
@@ -59,45 +103,109 @@ login_manager.login_view = 'auth.login'
 login_manager.login_message_category = 'warning'
 
 
+# endpoint label is the URL rule (e.g. /post/<int:id>), not the path, so that
+# the number of time series is bounded
 METRICS_REQUEST_LATENCY = Histogram(
-    'app_request_latency_seconds', 'Application Request Latency', ['method', 'endpoint']
+    'app_request_latency_seconds',
+    'Application Request Latency',
+    ['method', 'endpoint'],
+    buckets=Config.METRICS_LATENCY_BUCKETS,
 )
 METRICS_REQUEST_COUNT = Counter(
     'app_request_count',
     'Application Request Count',
     ['method', 'endpoint', 'http_status'],
 )
+METRICS_RESPONSE_SIZE = Histogram(
+    'app_response_size_bytes',
+    'Application Response Size',
+    ['method', 'endpoint'],
+    buckets=Config.METRICS_RESPONSE_SIZE_BUCKETS,
+)
+METRICS_REQUESTS_IN_FLIGHT = Gauge(
+    'app_requests_in_flight', 'Application Requests Being Processed'
+)
+
+METRICS_DB_QUERY_COUNT = Histogram(
+    'app_db_query_count',
+    'Database Queries per Request',
+    ['endpoint'],
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200),
+)
+METRICS_DB_QUERY_TIME = Histogram(
+    'app_db_query_time_seconds',
+    'Time Spent on Database Queries per Request',
+    ['endpoint'],
+    buckets=Config.METRICS_LATENCY_BUCKETS,
+)
+
+METRICS_REDIS_CIRCUIT_STATE = Gauge(
+    'app_redis_circuit_state', 'Redis Circuit Breaker State', ['state']
+)
+METRICS_REDIS_REQUEST_TIME = Histogram(
+    'app_redis_request_time_seconds', 'Time Spent on Redis per Request'
+)
 
 METRICS_INFO = Info('app_version', 'Application Version')
 
 
+def get_request_rule() -> str:
+    """
+    Get URL rule matched by the request, a low cardinality metrics label
+    """
+    rule = request.url_rule
+    return rule.rule if rule is not None else '<unmatched>'
+
+
 def before_request():
     """
     Get start time of a request
     """
     request._prometheus_metrics_request_start_time = time.time()
+    request._prometheus_metrics_in_flight = True
+    METRICS_REQUESTS_IN_FLIGHT.inc()
 
 
 def after_request(response):
     """
     Register Prometheus metrics after each request
     """
+    rule = get_request_rule()
     request_latency = time.time() - request._prometheus_metrics_request_start_time
-    METRICS_REQUEST_LATENCY.labels(request.method, request.path).observe(
-        request_latency
-    )
-    METRICS_REQUEST_COUNT.labels(
-        request.method, request.path, response.status_code
-    ).inc()
+    METRICS_REQUEST_LATENCY.labels(request.method, rule).observe(request_latency)
+    METRICS_REQUEST_COUNT.labels(request.method, rule, response.status_code).inc()
+    content_length = response.calculate_content_length()
+    if content_length is not None:
+        METRICS_RESPONSE_SIZE.labels(request.method, rule).observe(content_length)
+    query_stats = get_query_stats()
+    METRICS_DB_QUERY_COUNT.labels(rule).observe(query_stats.count)
+    METRICS_DB_QUERY_TIME.labels(rule).observe(query_stats.duration)
+    METRICS_REDIS_REQUEST_TIME.observe(redis.time_spent)
+    for state in (CLOSED, HALF_OPEN, OPEN):
+        METRICS_REDIS_CIRCUIT_STATE.labels(state).set(int(redis.breaker.state == state))
     return response
 
 
+def teardown_request(exception=None):
+    """
+    Count the request out of the in-flight ones, whatever its outcome
+    """
+    if getattr(request, '_prometheus_metrics_in_flight', False):
+        request._prometheus_metrics_in_flight = False
+        METRICS_REQUESTS_IN_FLIGHT.dec()
+
+
 def register_middlewares(app):
     """
     Register middlewares
     """
     app.before_request(before_request)
+    # after-request functions run in reverse order: metrics see the final response
     app.after_request(after_request)
+    app.after_request(conditional_response)
+    if app.config['PILI_QUERY_FINGERPRINTS']:
+        app.after_request(report_repeated_queries)
+    app.teardown_request(teardown_request)
     METRICS_INFO.info(
         {'version': get_version(), 'config': app.config.get('ENVIRONMENT', 'undefined')}
     )
@@ -122,6 +230,7 @@ def register_extensions(app):
 
     db.init_app(app)
     connectors.db = db
+    register_query_listeners()
 
     login_manager.init_app(app)
     pagedown.init_app(app)
@@ -151,6 +260,7 @@ def register_extensions(app):
         if isfunction(function)
     }
     app.jinja_env.filters.update(template_filters)
+    app.jinja_env.add_extension(FragmentCacheExtension)
 
     # Specify jQuery version
     app.extensions['bootstrap']['cdns']['jquery'] = WebCDN(
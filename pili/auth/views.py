@@ -1,6 +1,7 @@
 from flask import current_app, flash, redirect, render_template, request, url_for
 from flask_login import current_user, login_required, login_user, logout_user
 
+from pili.activity import record_last_seen
 from pili.app import db
 from pili.auth import auth
 from pili.auth.forms import (
@@ -22,7 +23,7 @@ from pili.models import Permission, Post, Role, User
 @auth.before_app_request
 def before_request():
     if current_user.is_authenticated:
-        current_user.ping()
+        record_last_seen(current_user._get_current_object())
         if (
             not current_user.confirmed
             and request.endpoint[:5] != 'auth.'  # type: ignore
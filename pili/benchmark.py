@@ -0,0 +1,197 @@
+import math
+import resource
+import time
+import tracemalloc
+from typing import Any, List, NamedTuple, Sequence, Tuple
+
+from flask import request, request_finished, url_for
+
+from pili.instrumentation import QueryStats, get_query_stats
+from pili.models import Category, Post, Tag, User
+
+#
+# Results
+#
+
+
+class Result(NamedTuple):
+    name: str
+    requests: int
+    errors: int
+    p50: float
+    p95: float
+    p99: float
+    queries: float
+    memory: int
+
+
+def percentile(values: Sequence[float], percent: float) -> float:
+    """
+    Return the nearest-rank percentile of the values
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(math.ceil(percent / 100 * len(ordered)), 1)
+    return ordered[rank - 1]
+
+
+def format_table(header: Sequence[str], rows: Sequence[Sequence[str]]) -> str:
+    """
+    Return rows as a plain text table, the first column is left-aligned
+    """
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    lines = [
+        '  '.join(
+            cell.ljust(width) if i == 0 else cell.rjust(width)
+            for i, (cell, width) in enumerate(zip(row, widths))
+        )
+        for row in [header] + rows
+    ]
+    lines.insert(1, '  '.join('-' * width for width in widths))
+    return '\n'.join(lines)
+
+
+def format_results(results: Sequence[Result]) -> str:
+    """
+    Return results as a plain text table, latencies in milliseconds
+    """
+    header = ('endpoint', 'reqs', 'errors', 'p50', 'p95', 'p99', 'queries', 'mem KiB')
+    rows = [
+        (
+            r.name,
+            str(r.requests),
+            str(r.errors),
+            '{:.1f}'.format(r.p50 * 1000),
+            '{:.1f}'.format(r.p95 * 1000),
+            '{:.1f}'.format(r.p99 * 1000),
+            '{:.1f}'.format(r.queries),
+            str(r.memory // 1024),
+        )
+        for r in results
+    ]
+    return format_table(header, rows)
+
+
+#
+# Targets
+#
+
+
+def get_targets() -> List[Tuple[str, str]]:
+    """
+    Return names and URLs of the main HTML and API endpoints to benchmark
+
+    Posts, tags, categories and users are sampled from the database, the
+    most popular ones first, as they are the most requested.
+    """
+    targets = [
+        ('main.index', url_for('main.index')),
+        ('main.index?page=10', url_for('main.index', page=10)),
+        ('api.get_posts', url_for('api.get_posts')),
+        ('api.get_tags', url_for('api.get_tags')),
+    ]
+    post = (
+        Post.query.filter(Post.category_id.isnot(None))
+        .order_by(Post.comment_count.desc())
+        .first()
+    )
+    if post is not None:
+        targets.extend(
+            [
+                (
+                    'main.post',
+                    url_for(
+                        'main.post',
+                        category=post.category.alias,
+                        id=post.id,
+                        alias=post.alias,
+                    ),
+                ),
+                ('api.get_post', url_for('api.get_post', id=post.id)),
+                ('api.get_post_comments', url_for('api.get_post_comments', id=post.id)),
+            ]
+        )
+    tag = Tag.query.order_by(Tag.post_count.desc()).first()
+    if tag is not None:
+        targets.append(('main.tag', url_for('main.tag', alias=tag.alias)))
+    category = Category.query.order_by(Category.post_count.desc()).first()
+    if category is not None:
+        targets.append(
+            ('main.category', url_for('main.category', alias=category.alias))
+        )
+    user = User.query.order_by(User.post_count.desc()).first()
+    if user is not None:
+        targets.append(('main.user', url_for('main.user', username=user.username)))
+    return targets
+
+
+#
+# Runner
+#
+
+
+def run(
+    app: Any,
+    targets: Sequence[Tuple[str, str]],
+    requests: int = 100,
+    warmup: int = 5,
+    trace_memory: bool = False,
+) -> List[Result]:
+    """Request each target with the test client, measure its performance.
+
+    Latency covers the whole WSGI round trip within the process, queries
+    are counted with the engine events of pili.instrumentation. Memory is
+    the peak of Python allocations per request with `trace_memory` (slows
+    the requests down, so that latencies are not comparable then), or the
+    growth of the process's max RSS otherwise.
+
+    Run outside of an application context: requests would share it and
+    whatever is kept on it otherwise.
+    """
+    client = app.test_client()
+    query_stats = []  # type: List[QueryStats]
+
+    def record(sender, response, **extra):
+        if request.endpoint is not None:
+            query_stats.append(get_query_stats())
+
+    results = []
+    with request_finished.connected_to(record, app):
+        for name, url in targets:
+            for _ in range(warmup):
+                client.get(url)
+            query_stats.clear()
+            latencies = []
+            errors = 0
+            memory = 0
+            rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            for _ in range(requests):
+                if trace_memory:
+                    tracemalloc.start()
+                start = time.perf_counter()
+                response = client.get(url)
+                latencies.append(time.perf_counter() - start)
+                if trace_memory:
+                    memory = max(memory, tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+                if response.status_code >= 400:
+                    errors += 1
+            if not trace_memory:
+                rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                # KiB on Linux
+                memory = (rss_after - rss_before) * 1024
+            counts = [stats.count for stats in query_stats]
+            results.append(
+                Result(
+                    name=name,
+                    requests=requests,
+                    errors=errors,
+                    p50=percentile(latencies, 50),
+                    p95=percentile(latencies, 95),
+                    p99=percentile(latencies, 99),
+                    queries=sum(counts) / len(counts) if counts else 0.0,
+                    memory=memory,
+                )
+            )
+    return results
@@ -0,0 +1,88 @@
+import hashlib
+from functools import wraps
+from typing import Any, Callable, Iterable, Optional, Union
+
+import redis
+from flask import current_app, request, session
+
+from pili.fragments import get_versions
+
+
+def versions_etag(tags: Iterable[str], *parts: Any) -> Optional[str]:
+    """Return ETag derived from version stamps of the cache tags and parts.
+
+    None if the stamps are not maintained, i.e. caching is disabled, or
+    Redis is unavailable.
+    """
+    connector = current_app.connectors.redis
+    if current_app.config.get('CACHE_DISABLE') or not connector.available():
+        return None
+    tags = sorted(tags)
+    try:
+        versions = get_versions(tags)
+    except redis.RedisError:
+        current_app.logger.exception(
+            'Redis connection failed while getting versions: {}'.format(tags)
+        )
+        return None
+    payload = '|'.join(map(str, list(parts) + tags + versions))  # type: ignore
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def conditional(
+    tags: Union[Iterable[str], Callable[..., Iterable[str]]],
+    key_func: Optional[Callable[..., Any]] = None,
+):
+    """Answer conditional GET requests before calling the view.
+
+    ETag is derived from version stamps of the cache tags (or a function of
+    view arguments returning them) the response depends on, and the key
+    function's result, e.g. pili.connectors.keys.Vary, so that the stamps
+    are fetched with a single MGET. Requests with a matching If-None-Match
+    header get 304 Not Modified without running queries or rendering
+    templates.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # flashed messages are consumed by rendering the page
+            if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+                return f(*args, **kwargs)
+            view_tags = tags(*args, **kwargs) if callable(tags) else tags
+            key = key_func(*args, **kwargs) if key_func is not None else ''
+            etag = versions_etag(view_tags, request.endpoint, key)
+            if etag is None:
+                return f(*args, **kwargs)
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+                response.set_etag(etag)
+                return response
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+
+        return decorated_function
+
+    return decorator
+
+
+def conditional_response(response):
+    """
+    Add body-based ETag to GET responses and answer If-None-Match with 304
+
+    Saves the bandwidth only, views decorated with conditional() save
+    the rendering too.
+    """
+    if (
+        not current_app.config['PILI_AUTO_ETAG']
+        or request.method not in ('GET', 'HEAD')
+        or response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+    ):
+        return response
+    if 'ETag' not in response.headers:
+        response.add_etag()
+    return response.make_conditional(request)
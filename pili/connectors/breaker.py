@@ -0,0 +1,72 @@
+import threading
+import time
+
+#
+# Constants
+#
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+    """
+    Thread-safe circuit breaker
+
+    Opens after `failure_threshold` consecutive failures, so that callers
+    skip the remote service entirely. After `recovery_timeout` seconds a
+    single probe call is let through (half-open state): its success closes
+    the circuit, its failure opens it for another `recovery_timeout`.
+
+    Usage:
+      breaker = CircuitBreaker(failure_threshold=5, recovery_timeout=30)
+      if breaker.allow():
+          try:
+              call_remote_service()
+          except ServiceError:
+              breaker.failure()
+          else:
+              breaker.success()
+    """
+
+    def __init__(
+        self, failure_threshold: int = 5, recovery_timeout: float = 30
+    ) -> None:
+        self.failure_threshold = failure_threshold
+        self.recovery_timeout = recovery_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """
+        Return True if a call to the remote service may be made
+        """
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            now = time.monotonic()
+            # open, or half-open with the probe still in flight
+            if now - self._opened_at < self.recovery_timeout:
+                return False
+            # let a single probe through per recovery timeout
+            self.state = HALF_OPEN
+            self._opened_at = now
+            return True
+
+    def success(self) -> None:
+        with self._lock:
+            self.state = CLOSED
+            self.failures = 0
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def reset(self) -> None:
+        self.success()
@@ -0,0 +1,91 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class MemoryCache:
+    """
+    Thread-safe in-process LRU cache
+
+    Bounded by the number of entries and, optionally, by total size of the
+    values in bytes. Entries may have their own time to live.
+
+    Usage:
+      from pili.connectors.memory import MemoryCache
+
+      cache = MemoryCache(max_entries=1024, max_bytes=16 * 1024 * 1024)
+      cache.set('mykey', b'value', expire_seconds=60)
+      cache.get('mykey')
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 0) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (value, expires at monotonic time or None, size in bytes)
+        self._data = OrderedDict()  # type: OrderedDict
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @staticmethod
+    def sizeof(value: Any) -> int:
+        if isinstance(value, (bytes, bytearray, str)):
+            return len(value)
+        return sys.getsizeof(value)
+
+    def get(self, key: Any) -> Any:
+        """
+        Return value for the key, or None if it's missing or expired
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if (
+                entry is not None
+                and entry[1] is not None
+                and entry[1] <= time.monotonic()
+            ):
+                self._pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Any, value: Any, expire_seconds: Optional[float] = None) -> None:
+        size = self.sizeof(value)
+        with self._lock:
+            self._pop(key)
+            if self.max_bytes and size > self.max_bytes:
+                return
+            expires_at = None
+            if expire_seconds is not None:
+                expires_at = time.monotonic() + expire_seconds
+            self._data[key] = (value, expires_at, size)
+            self.size += size
+            while len(self._data) > self.max_entries or (
+                self.max_bytes and self.size > self.max_bytes
+            ):
+                _, (_, _, evicted_size) = self._data.popitem(last=False)
+                self.size -= evicted_size
+
+    def delete(self, key: Any) -> None:
+        with self._lock:
+            self._pop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def _pop(self, key: Any) -> None:
+        entry = self._data.pop(key, None)
+        if entry is not None:
+            self.size -= entry[2]
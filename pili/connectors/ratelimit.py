@@ -0,0 +1,200 @@
+import threading
+import time
+import uuid
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from pili.connectors.memory import MemoryCache
+
+#
+# Constants
+#
+
+FIXED_WINDOW = 'fixed_window'
+SLIDING_WINDOW = 'sliding_window'
+TOKEN_BUCKET = 'token_bucket'
+
+PER_IP = 'ip'
+PER_USER = 'user'
+
+# Each script is a single atomic check-and-update returning
+# {allowed (1 or 0), milliseconds to wait before the next attempt}.
+# TIME is used rather than client's clock, so that all the workers agree on
+# the current time. Redis < 5 needs script effects replication for that.
+
+FIXED_WINDOW_SCRIPT = """
+-- KEYS[1]: counter, ARGV[1]: limit, ARGV[2]: window (ms)
+local count = redis.call('INCR', KEYS[1])
+if count == 1 then
+  redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+if count > tonumber(ARGV[1]) then
+  return {0, redis.call('PTTL', KEYS[1])}
+end
+return {1, 0}
+"""
+
+SLIDING_WINDOW_SCRIPT = """
+-- KEYS[1]: sorted set of hits, ARGV[1]: limit, ARGV[2]: window (ms),
+-- ARGV[3]: unique hit id
+redis.replicate_commands()
+local limit = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - window)
+if redis.call('ZCARD', KEYS[1]) >= limit then
+  local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+  return {0, tonumber(oldest[2]) + window - now}
+end
+redis.call('ZADD', KEYS[1], now, ARGV[3])
+redis.call('PEXPIRE', KEYS[1], window)
+return {1, 0}
+"""
+
+TOKEN_BUCKET_SCRIPT = """
+-- KEYS[1]: hash with tokens and last refill time, ARGV[1]: tokens per
+-- period, ARGV[2]: period (ms), ARGV[3]: bucket capacity
+redis.replicate_commands()
+local rate = tonumber(ARGV[1]) / tonumber(ARGV[2])
+local capacity = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) * 1000 + math.floor(tonumber(time[2]) / 1000)
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed, wait = 0, 0
+if tokens >= 1 then
+  tokens = tokens - 1
+  allowed = 1
+else
+  wait = math.ceil((1 - tokens) / rate)
+end
+redis.call('HMSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(capacity / rate))
+return {allowed, wait}
+"""
+
+SCRIPTS = {
+    FIXED_WINDOW: FIXED_WINDOW_SCRIPT,
+    SLIDING_WINDOW: SLIDING_WINDOW_SCRIPT,
+    TOKEN_BUCKET: TOKEN_BUCKET_SCRIPT,
+}
+
+
+#
+# Policies
+#
+
+
+class RateLimitPolicy(NamedTuple):
+    """
+    Allow `limit` requests per `period` seconds per client IP or user
+
+    Token bucket allows bursts of up to `burst` requests (`limit` if omitted).
+    """
+
+    limit: int
+    period: float = 1
+    algorithm: str = FIXED_WINDOW
+    burst: Optional[int] = None
+    per: str = PER_IP
+
+    @classmethod
+    def from_config(cls, options: Dict[str, Any]) -> 'RateLimitPolicy':
+        policy = cls(**options)
+        if policy.algorithm not in SCRIPTS:
+            raise ValueError(
+                'Unknown rate limit algorithm: {}'.format(policy.algorithm)
+            )
+        if policy.per not in (PER_IP, PER_USER):
+            raise ValueError('Unknown rate limit subject: {}'.format(policy.per))
+        return policy
+
+    def script_args(self) -> Tuple[Any, ...]:
+        period_ms = int(self.period * 1000)
+        if self.algorithm == SLIDING_WINDOW:
+            return self.limit, period_ms, uuid.uuid4().hex
+        if self.algorithm == TOKEN_BUCKET:
+            return self.limit, period_ms, self.burst or self.limit
+        return self.limit, period_ms
+
+
+#
+# Limiter
+#
+
+
+class RateLimiter:
+    """
+    Rate limiter checking and counting a hit in a single EVALSHA call
+
+    Usage:
+      limiter = RateLimiter(connector)
+      allowed, retry_after = limiter.hit('rate-limit:key', policy)
+    """
+
+    def __init__(self, connector) -> None:
+        self.connector = connector
+        self._scripts = {}  # type: Dict[str, Any]
+
+    def script(self, algorithm: str):
+        """
+        Return registered script object, the SHA1 is computed locally once
+        """
+        if algorithm not in self._scripts:
+            self._scripts[algorithm] = self.connector.connection.register_script(
+                SCRIPTS[algorithm]
+            )
+        return self._scripts[algorithm]
+
+    def hit(self, key: str, policy: RateLimitPolicy) -> Tuple[bool, float]:
+        """
+        Return whether the hit is allowed and seconds to wait otherwise
+        """
+        allowed, wait_ms = self.script(policy.algorithm)(
+            keys=[key], args=policy.script_args(), client=self.connector.connection
+        )
+        return bool(allowed), max(int(wait_ms), 0) / 1000
+
+
+class LocalRateLimiter:
+    """In-process token bucket limiter, a fallback for unavailable Redis.
+
+    Every algorithm is approximated with a token bucket. Buckets are not
+    shared between worker processes, so each of them gets its share of the
+    limit, e.g. limit / 4 for uWSGI's 4 workers.
+    """
+
+    def __init__(self, workers: int = 1, max_keys: int = 10000) -> None:
+        self.workers = max(workers, 1)
+        self._buckets = MemoryCache(max_entries=max_keys)
+        self._lock = threading.Lock()
+
+    def hit(self, key: str, policy: RateLimitPolicy) -> Tuple[bool, float]:
+        """
+        Return whether the hit is allowed and seconds to wait otherwise
+        """
+        rate = policy.limit / policy.period / self.workers
+        capacity = max((policy.burst or policy.limit) / self.workers, 1)
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key) or (capacity, now)
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed, wait = False, (1 - tokens) / rate
+            if tokens >= 1:
+                tokens -= 1
+                allowed, wait = True, 0.0
+            self._buckets.set(key, (tokens, now), expire_seconds=capacity / rate)
+        return allowed, wait
+
+
+def get_workers_count() -> int:
+    """
+    Return the number of uWSGI worker processes, 1 outside of uWSGI
+    """
+    try:
+        import uwsgi  # type: ignore
+    except ImportError:
+        return 1
+    return uwsgi.numproc
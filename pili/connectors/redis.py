@@ -1,23 +1,75 @@
 import logging
+import math
+import os
 import pickle
 import sys
+import threading
 import time
+from contextlib import contextmanager
 from functools import wraps
-from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple, Union
 
 import redis
-from flask import _app_ctx_stack, current_app  # type: ignore
+from flask import (  # type: ignore
+    _request_ctx_stack,
+    copy_current_request_context,
+    current_app,
+    has_request_context,
+    request,
+    session,
+)
+from prometheus_client import Counter, Histogram
+from redis.exceptions import LockError
 
 from pili.connectors import BaseConnector
+from pili.connectors.breaker import CircuitBreaker
+from pili.connectors.memory import MemoryCache
+from pili.connectors.ratelimit import (
+    PER_USER,
+    LocalRateLimiter,
+    RateLimiter,
+    RateLimitPolicy,
+    get_workers_count,
+)
+from pili.connectors.serializers import CachedResponse, Codec, get_codec
 
 #
 # Constants
 #
 
-try:
-    import ujson as json
-except ImportError:
-    import json  # type: ignore
+# Redis set of the cache keys depending on a tag
+TAG_KEY = 'cache-tag:{}'
+# Redis counter incremented on each invalidation of a tag
+VERSION_KEY = 'cache-version:{}'
+
+# headers stored and replayed by the view cache, lowercase; never cookies
+CACHED_RESPONSE_HEADERS = frozenset(
+    (
+        'cache-control',
+        'content-encoding',
+        'content-language',
+        'content-type',
+        'etag',
+        'expires',
+        'last-modified',
+        'vary',
+    )
+)
+
+METRICS_CACHE_REQUEST_COUNT = Counter(
+    'app_cache_request_count', 'Cache Request Count', ['tier', 'result']
+)
+METRICS_CACHE_VALUE_SIZE = Histogram(
+    'app_cache_value_size_bytes',
+    'Serialized Cache Value Size',
+    ['prefix'],
+    buckets=(256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304),
+)
+METRICS_REDIS_SKIPPED_COUNT = Counter(
+    'app_redis_skipped_count',
+    'Redis calls skipped either by open circuit or exceeded budget',
+    ['reason'],
+)
 
 
 #
@@ -39,7 +91,23 @@ class RedisConnector(BaseConnector):
       redis.connection.get('mykey')
     """
 
-    def startup(self):
+    def __init__(self, app=None) -> None:
+        self._pool = None  # type: Optional[redis.ConnectionPool]
+        self._pool_pid = None  # type: Optional[int]
+        self._pool_lock = threading.Lock()
+        self._local = None  # type: Optional[MemoryCache]
+        self._local_pid = None  # type: Optional[int]
+        self.breaker = CircuitBreaker()
+        super().__init__(app)
+
+    def init_app(self, app) -> None:
+        super().init_app(app)
+        self.breaker = CircuitBreaker(
+            failure_threshold=app.config.get('REDIS_BREAKER_FAILURES', 5),
+            recovery_timeout=app.config.get('REDIS_BREAKER_RECOVERY_TIMEOUT', 30),
+        )
+
+    def create_pool(self) -> redis.ConnectionPool:
         connection_kwargs = {
             'host': current_app.config.get('REDIS_HOST', 'localhost'),
             'port': current_app.config.get('REDIS_PORT', 6379),
@@ -63,15 +131,145 @@ class RedisConnector(BaseConnector):
             'socket_read_size': current_app.config.get('REDIS_READ_SIZE', 65536),
         }
 
-        pool = redis.ConnectionPool(**connection_kwargs)
-        return redis.Redis(connection_pool=pool)
+        return HealthCheckedConnectionPool(
+            max_connections=current_app.config.get('REDIS_MAX_CONNECTIONS', 50),
+            timeout=current_app.config.get('REDIS_POOL_TIMEOUT', 20),
+            health_check_interval=current_app.config.get(
+                'REDIS_HEALTH_CHECK_INTERVAL', 0
+            ),
+            **connection_kwargs,
+        )
+
+    @property
+    def pool(self) -> redis.ConnectionPool:
+        """Process-wide connection pool
+
+        The pool is created lazily on the first use in the process, i.e. after
+        uWSGI forks its workers, and gets recreated if the process is forked
+        afterwards, so that the workers never share sockets.
+        """
+        pid = os.getpid()
+        if self._pool is None or self._pool_pid != pid:
+            with self._pool_lock:
+                if self._pool is None or self._pool_pid != pid:
+                    self._pool = self.create_pool()
+                    self._pool_pid = pid
+        return self._pool  # type: ignore
+
+    def codec(self, serializer: Optional[str] = None) -> Codec:
+        """Return codec for cached values
+
+        Serializer defaults to CACHE_SERIALIZER setting; values larger than
+        CACHE_COMPRESS_THRESHOLD bytes are compressed with CACHE_COMPRESSION.
+        """
+        config = current_app.config
+        return get_codec(
+            serializer or config.get('CACHE_SERIALIZER', 'json'),
+            compression=config.get('CACHE_COMPRESSION'),
+            threshold=config.get('CACHE_COMPRESS_THRESHOLD', 1024),
+        )
+
+    @property
+    def local(self) -> Optional[MemoryCache]:
+        """Process-wide in-process cache tier in front of Redis
+
+        None unless enabled with CACHE_LOCAL_ENABLE setting.
+        """
+        if not current_app.config.get('CACHE_LOCAL_ENABLE', False):
+            return None
+        pid = os.getpid()
+        if self._local is None or self._local_pid != pid:
+            with self._pool_lock:
+                if self._local is None or self._local_pid != pid:
+                    self._local = MemoryCache(
+                        max_entries=current_app.config.get(
+                            'CACHE_LOCAL_MAX_ENTRIES', 1024
+                        ),
+                        max_bytes=current_app.config.get('CACHE_LOCAL_MAX_BYTES', 0),
+                    )
+                    self._local_pid = pid
+        return self._local
+
+    def startup(self):
+        return redis.Redis(connection_pool=self.pool)
 
     def teardown(self, exception):
-        context = _app_ctx_stack.top
-        connector_name = self.__class__.__name__
-        if hasattr(context, connector_name):
-            client = getattr(context, connector_name)
-            client.connection_pool.disconnect()
+        """
+        Keep the pool's connections open
+
+        Connections are borrowed from the pool per command and released right
+        after it, so that there is nothing to clean up per app context.
+        """
+        pass
+
+    def disconnect(self) -> None:
+        """
+        Close all the connections of the pool, e.g. on the worker's shutdown
+        """
+        if self._pool is not None:
+            self._pool.disconnect()
+
+    #
+    # Circuit breaker and latency budget
+    #
+
+    @property
+    def time_spent(self) -> float:
+        """
+        Seconds spent on Redis calls within the current request
+        """
+        return getattr(_request_ctx_stack.top, 'redis_time_spent', 0.0)
+
+    def budget_exceeded(self) -> bool:
+        """
+        Return True once the request has spent its REDIS_REQUEST_BUDGET
+
+        Code running outside of requests, e.g. Celery tasks and CLI commands
+        sharing a single app context, has no budget.
+        """
+        if not has_request_context():
+            return False
+        budget = current_app.config.get('REDIS_REQUEST_BUDGET', 0)
+        return bool(budget) and self.time_spent >= budget
+
+    def available(self) -> bool:
+        """Return True if Redis may be called right now.
+
+        Redis is skipped while the circuit breaker is open, or once the
+        current request has spent its REDIS_REQUEST_BUDGET on Redis calls,
+        so that callers fall back to their uncached paths immediately.
+        """
+        if self.budget_exceeded():
+            METRICS_REDIS_SKIPPED_COUNT.labels('budget').inc()
+            return False
+        if not self.breaker.allow():
+            METRICS_REDIS_SKIPPED_COUNT.labels('circuit').inc()
+            return False
+        return True
+
+    @contextmanager
+    def guard(self):
+        """
+        Report Redis calls' outcome to the circuit breaker and time to budget
+
+        Only connection errors and timeouts count as failures, any other
+        Redis error is a sign of the server being reachable.
+        """
+        start = time.monotonic()
+        try:
+            yield
+        except (redis.ConnectionError, redis.TimeoutError):
+            self.breaker.failure()
+            raise
+        except redis.RedisError:
+            self.breaker.success()
+            raise
+        else:
+            self.breaker.success()
+        finally:
+            context = _request_ctx_stack.top
+            if context is not None:
+                context.redis_time_spent = self.time_spent + (time.monotonic() - start)
 
     def get_key(self, key: str):
         """
@@ -81,13 +279,154 @@ class RedisConnector(BaseConnector):
         e.g. Redis Sentinel with `get_key` looking for a key in a slave node and
         `set_key` setting a key in master.
         """
-        return self.connection.get(key)
+        with self.guard():
+            return self.connection.get(key)
+
+    def get_key_with_ttl(self, key: str) -> Tuple[Any, Optional[float]]:
+        """
+        Helper function to get key and its remaining time to live in seconds
+        in a single round trip
+        """
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.get(key)
+        pipe.pttl(key)
+        with self.guard():
+            value, ttl_ms = pipe.execute()
+        return value, (ttl_ms / 1000 if ttl_ms is not None and ttl_ms >= 0 else None)
 
     def set_key(self, key: str, value: str, expire_seconds: int = 15 * 60):
         """
         Helper function to set key with expiration time
         """
-        return self.connection.set(key, value, ex=expire_seconds)
+        with self.guard():
+            return self.connection.set(key, value, ex=expire_seconds)
+
+    def get_many(self, keys: List[str]) -> List[Any]:
+        """
+        Helper function to get many keys in a single round trip (MGET)
+        """
+        if not keys:
+            return []
+        with self.guard():
+            return self.connection.mget(keys)
+
+    def set_many(
+        self, mapping: Mapping[str, Any], expire_seconds: Union[int, Mapping[str, int]]
+    ):
+        """
+        Helper function to set many keys in a single round trip (pipeline)
+
+        Expiration time is either the same for all the keys, or given per key.
+        """
+        if not mapping:
+            return []
+        pipe = self.connection.pipeline(transaction=False)
+        for key, value in mapping.items():
+            expire = (
+                expire_seconds[key]
+                if isinstance(expire_seconds, Mapping)
+                else expire_seconds
+            )
+            pipe.set(key, value, ex=expire)
+        with self.guard():
+            return pipe.execute()
+
+    def set_key_with_tags(
+        self, key: str, value: str, expire_seconds: int, tags: Iterable[str]
+    ):
+        """
+        Helper function to set key and add it to the sets of its tags
+
+        Tag sets live for CACHE_TAG_EXPIRE seconds since the last key added,
+        which should exceed the longest expiration time of tagged keys.
+        """
+        tag_expire = max(
+            expire_seconds, current_app.config.get('CACHE_TAG_EXPIRE', 24 * 60 * 60)
+        )
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.set(key, value, ex=expire_seconds)
+        for tag in tags:
+            pipe.sadd(TAG_KEY.format(tag), key)
+            pipe.expire(TAG_KEY.format(tag), tag_expire)
+        with self.guard():
+            return pipe.execute()
+
+    def get_versions(self, tags: List[str]) -> List[int]:
+        """
+        Return version stamps of the tags, 0 for never invalidated ones
+        """
+        values = self.get_many([VERSION_KEY.format(tag) for tag in tags])
+        return [int(value or 0) for value in values]
+
+    def invalidate_tags(self, tags: Iterable[str]) -> List[str]:
+        """
+        Delete all the keys tagged with any of the tags, return deleted keys
+
+        Tag sets are read and dropped atomically, so that a key cached
+        concurrently is either deleted or tagged anew. Keys are evicted from
+        this process' local tier too, other processes' local entries expire
+        within CACHE_LOCAL_TTL.
+
+        Tags' version stamps are incremented as well, so that the keys built
+        from them (see pili.fragments) are never read again. Stamps never
+        expire, as restarting them would bring the old keys and ETags back.
+        """
+        tags = list(tags)
+        tag_keys = [TAG_KEY.format(tag) for tag in tags]
+        if not tag_keys:
+            return []
+        pipe = self.connection.pipeline(transaction=True)
+        pipe.sunion(*tag_keys)
+        pipe.delete(*tag_keys)
+        for tag in tags:
+            pipe.incr(VERSION_KEY.format(tag))
+        with self.guard():
+            members = pipe.execute()[0]
+        keys = sorted(
+            member.decode('utf-8') if isinstance(member, bytes) else member
+            for member in members
+        )
+        if keys:
+            with self.guard():
+                self.connection.delete(*keys)
+        if self._local is not None:
+            for key in keys:
+                self._local.delete(key)
+        return keys
+
+
+class HealthCheckedConnectionPool(redis.BlockingConnectionPool):
+    """
+    Blocking pool checking connections idle longer than health_check_interval
+
+    A borrowed connection that has been idle for too long is PINGed first
+    and reconnected if the server has gone away, rather than failing the
+    actual command. redis-py 3.3+ provides the same with its own
+    health_check_interval option.
+    """
+
+    def __init__(self, health_check_interval: int = 0, **kwargs) -> None:
+        self.health_check_interval = health_check_interval
+        super().__init__(**kwargs)
+
+    def get_connection(self, command_name, *keys, **options):
+        connection = super().get_connection(command_name, *keys, **options)
+        idle = time.monotonic() - getattr(connection, 'pili_released_at', 0)
+        if (
+            self.health_check_interval
+            and connection._sock is not None
+            and idle > self.health_check_interval
+        ):
+            try:
+                connection.send_command('PING')
+                connection.read_response()
+            except (redis.ConnectionError, redis.TimeoutError):
+                connection.disconnect()
+        return connection
+
+    def release(self, connection) -> None:
+        connection.pili_released_at = time.monotonic()
+        super().release(connection)
 
 
 class RedisConnectorError(Exception):
@@ -104,7 +443,9 @@ class CacheError(Exception):
 
 
 class RateLimitExceededError(Exception):
-    pass
+    def __init__(self, message: str = 'Rate limit exceeded', retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
 
 
 def _get_function_full_name(func: Callable[..., Any], delimiter: str = ':') -> str:
@@ -179,25 +520,102 @@ def _generate_function_key(
     def _inner(*args, **kwargs):
         if postfix_func is None:
             return full_name
-        return "{name}:{postfix}".format(
-            name=full_name, postfix=postfix_func(*args, **kwargs)
-        )
+        postfix = postfix_func(*args, **kwargs)
+        if postfix in (None, ''):
+            return full_name
+        return "{name}:{postfix}".format(name=full_name, postfix=postfix)
 
     return _inner
 
 
+def _serialization(
+    connector: RedisConnector,
+    serializer: Optional[str],
+    load_func: Optional[Callable[..., Any]],
+    dump_func: Optional[Callable[..., Any]],
+) -> Tuple[Callable[..., Any], Callable[..., Any]]:
+    """
+    Return load and dump functions, the connector's codec ones by default
+    """
+    if load_func is not None and dump_func is not None:
+        return load_func, dump_func
+    codec = connector.codec(serializer)
+    return load_func or codec.loads, dump_func or codec.dumps
+
+
+def _local_expire_seconds(*ttls: Optional[float]) -> float:
+    """
+    Return the shortest of the given times to live, ignoring missing ones
+    """
+    return min(ttl for ttl in ttls if ttl is not None)
+
+
+def _release_lock(lock, logger: logging.Logger) -> None:
+    try:
+        lock.release()
+    except (LockError, redis.RedisError):
+        # the lock has expired or Redis is gone, either way it's not ours anymore
+        logger.info('Cache lock already released: {}'.format(lock.name))
+
+
+def _run_in_background(func: Callable[[], Any]) -> threading.Thread:
+    """
+    Run function in a daemon thread within a copy of the current context
+    """
+    if has_request_context():
+        target = copy_current_request_context(func)
+    else:
+        app = current_app._get_current_object()  # type: ignore
+
+        def target():
+            with app.app_context():
+                func()
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
 def cache(
     expire_seconds: int = 15 * 60,
     *,
     connector: Optional[RedisConnector] = None,
     silent: bool = True,
     key_func: Optional[Callable[..., Any]] = None,
-    load_func: Callable[..., Any] = json.loads,
-    dump_func: Callable[..., Any] = json.dumps,
+    load_func: Optional[Callable[..., Any]] = None,
+    dump_func: Optional[Callable[..., Any]] = None,
+    serializer: Optional[str] = None,
     logger: Optional[logging.Logger] = None,
+    local: bool = True,
+    single_flight: bool = False,
+    soft_ttl: Optional[int] = None,
+    lock_timeout: int = 30,
+    lock_wait: float = 3.0,
+    tags: Optional[Union[Iterable[str], Callable[..., Iterable[str]]]] = None,
 ) -> Callable[..., Any]:
     """
     Cache decorator
+
+    Serialized results are looked up in the connector's in-process tier
+    first (if enabled with CACHE_LOCAL_ENABLE setting, unless local=False),
+    then in Redis. Local entries never outlive the Redis ones.
+
+    With single_flight=True only the caller holding a Redis lock (expiring in
+    lock_timeout seconds) recomputes a missing key, while the others wait up
+    to lock_wait seconds for the result before computing it themselves. They
+    stop waiting once the lock is released with no result stored.
+
+    With soft_ttl (less than expire_seconds) the key gets stale after soft_ttl
+    seconds: stale value is still returned, while a single caller refreshes
+    it in the background, so that the key rarely expires under load.
+
+    tags (or a function of the decorated function's arguments returning them)
+    let the key be deleted with RedisConnector.invalidate_tags() as soon as
+    the data it depends on changes, e.g. tags=['posts'].
+
+    Results are serialized with the connector's codec (see
+    RedisConnector.codec()), unless load_func and dump_func are given.
+    Serialized sizes are reported per function in a histogram.
     """
     if connector is None:
         connector = current_app.connectors.redis
@@ -206,49 +624,343 @@ def cache(
     if logger is None:
         logger = connector.app.logger  # type: ignore
 
+    if soft_ttl is not None and soft_ttl >= expire_seconds:
+        raise ValueError('soft_ttl must be less than expire_seconds')
+
     def _decorator(func: Callable[..., Any]) -> Callable[..., Any]:
         key_generator = _generate_function_key(
             func=func, prefix='cache', postfix_func=key_func
         )
+        fresh_ttl = soft_ttl if soft_ttl is not None else expire_seconds
+        size_metric = METRICS_CACHE_VALUE_SIZE.labels(
+            'cache:{}'.format(_get_function_full_name(func))
+        )
+
+        def _get(cache_key: str) -> Tuple[Any, Optional[float]]:
+            """
+            Return serialized value and its remaining time to live in Redis
+            """
+            if connector.local is None and soft_ttl is None:  # type: ignore
+                getter = connector.get_key  # type: ignore
+                return timer(getter, func.__name__, logger)(cache_key), None
+            getter = connector.get_key_with_ttl  # type: ignore
+            return timer(getter, func.__name__, logger)(cache_key)
+
+        def _load(cache_key: str, value: Any) -> Tuple[bool, Any]:
+            try:
+                loads, _ = _serialization(connector, serializer, load_func, dump_func)
+                return True, loads(value)
+            except (ValueError, pickle.PickleError):
+                message = 'Cache cannot be loaded for key: {}'.format(cache_key)
+                logger.exception(message)  # type: ignore
+                if not silent:
+                    raise CacheError(message)
+                return False, None
+
+        def _compute(cache_key: str, local_cache, args, kwargs) -> Any:
+            result = func(*args, **kwargs)
+
+            try:
+                _, dumps = _serialization(connector, serializer, load_func, dump_func)
+                value = dumps(result)
+            except (ValueError, pickle.PickleError):
+                message = 'Function \'s `{}` result cannot be serialized'.format(
+                    func.__name__
+                )
+                logger.exception(message)  # type: ignore
+                if not silent:
+                    raise CacheError(message)
+                return result
+            size_metric.observe(len(value))
+
+            if local_cache is not None:
+                local_cache.set(
+                    cache_key,
+                    value,
+                    _local_expire_seconds(
+                        current_app.config.get('CACHE_LOCAL_TTL', 60), fresh_ttl
+                    ),
+                )
+            if not connector.available():  # type: ignore
+                return result
+            try:
+                key_tags = tags(*args, **kwargs) if callable(tags) else tags
+                if key_tags:
+                    connector.set_key_with_tags(  # type: ignore
+                        cache_key, value, expire_seconds, key_tags
+                    )
+                else:
+                    connector.set_key(cache_key, value, expire_seconds)  # type: ignore
+            except redis.RedisError:
+                message = 'Redis connection failed while setting key: {}'.format(
+                    cache_key
+                )
+                logger.info(message)  # type: ignore
+                if not silent:
+                    raise RedisConnectorError(message)
+            return result
+
+        def _lock(cache_key: str):
+            return connector.connection.lock(  # type: ignore
+                'lock:{}'.format(cache_key), timeout=lock_timeout, thread_local=False
+            )
+
+        def _wait(cache_key: str, lock) -> Tuple[bool, Any]:
+            """
+            Wait for the lock holder to store the key
+
+            Give up as soon as the lock is released without the key stored,
+            e.g. when the result cannot be cached.
+            """
+            deadline = time.monotonic() + lock_wait
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                if not connector.available():  # type: ignore
+                    break
+                # checked before the key, as the holder stores it first
+                released = not lock.locked()
+                value = connector.get_key(cache_key)  # type: ignore
+                if value is not None:
+                    return _load(cache_key, value)
+                if released:
+                    break
+            return False, None
 
         @wraps(func)
         def _inner(*args, **kwargs) -> Any:
-            cache_miss, result = True, None
+            if current_app.config.get('CACHE_DISABLE'):
+                return func(*args, **kwargs)
+
             cache_key = key_generator(*args, **kwargs)
+            local_cache = connector.local if local else None  # type: ignore
+
+            if local_cache is not None:
+                value = local_cache.get(cache_key)
+                METRICS_CACHE_REQUEST_COUNT.labels(
+                    'local', 'miss' if value is None else 'hit'
+                ).inc()
+                if value is not None:
+                    loaded, result = _load(cache_key, value)
+                    if loaded:
+                        return result
+
+            # short-circuit while Redis is down or the request is out of budget
+            if not connector.available():  # type: ignore
+                return func(*args, **kwargs)
+
+            try:
+                value, redis_ttl = _get(cache_key)
+            except redis.RedisError:
+                message = 'Redis connection failed while getting key: {}'.format(
+                    cache_key
+                )
+                logger.exception(message)  # type: ignore
+                if not silent:
+                    raise RedisConnectorError(message)
+                return _compute(cache_key, local_cache, args, kwargs)
 
-            if not current_app.config.get('CACHE_DISABLE'):
+            if value is None:
+                METRICS_CACHE_REQUEST_COUNT.labels('redis', 'miss').inc()
+                logger.info(  # type: ignore
+                    'No cache found for key: {}'.format(cache_key)
+                )
+            else:
+                loaded, result = _load(cache_key, value)
+                # time the value has left before getting stale
+                fresh_left = None  # type: Optional[float]
+                if soft_ttl is not None and redis_ttl is not None:
+                    fresh_left = redis_ttl - (expire_seconds - soft_ttl)
+                stale = fresh_left is not None and fresh_left <= 0
+
+                if loaded and not stale:
+                    METRICS_CACHE_REQUEST_COUNT.labels('redis', 'hit').inc()
+                    if local_cache is not None:
+                        local_cache.set(
+                            cache_key,
+                            value,
+                            _local_expire_seconds(
+                                current_app.config.get('CACHE_LOCAL_TTL', 60),
+                                expire_seconds,
+                                redis_ttl,
+                                fresh_left,
+                            ),
+                        )
+                    return result
+
+                if loaded and stale:
+                    METRICS_CACHE_REQUEST_COUNT.labels('redis', 'stale').inc()
+                    try:
+                        lock = _lock(cache_key)
+                        with connector.guard():  # type: ignore
+                            acquired = lock.acquire(blocking=False)
+                        if acquired:
+
+                            def _refresh():
+                                try:
+                                    _compute(cache_key, local_cache, args, kwargs)
+                                except Exception:
+                                    logger.exception(  # type: ignore
+                                        'Cache refresh failed for key: {}'.format(
+                                            cache_key
+                                        )
+                                    )
+                                finally:
+                                    _release_lock(lock, logger)  # type: ignore
+
+                            _run_in_background(_refresh)
+                    except redis.RedisError:
+                        logger.exception(  # type: ignore
+                            'Redis connection failed while locking key: {}'.format(
+                                cache_key
+                            )
+                        )
+                    return result
+
+            if single_flight or soft_ttl is not None:
                 try:
-                    connector.get_key = timer(  # type: ignore
-                        func=connector.get_key,  # type: ignore
-                        alternative_name=func.__name__,
-                        logger=logger,
-                    )
-                    result = load_func(connector.get_key(cache_key))  # type: ignore
-                    cache_miss = False
-                except TypeError:
-                    logger.info(  # type: ignore
-                        'No cache found for key: {}'.format(cache_key)
+                    lock = _lock(cache_key)
+                    with connector.guard():  # type: ignore
+                        acquired = lock.acquire(blocking=False)
+                    if not acquired:
+                        loaded, result = _wait(cache_key, lock)
+                        if loaded:
+                            return result
+                except redis.RedisError:
+                    logger.exception(  # type: ignore
+                        'Redis connection failed while locking key: {}'.format(
+                            cache_key
+                        )
                     )
-                except ValueError:
-                    message = 'Cache cannot be loaded for key: {}'.format(cache_key)
+                    acquired = False
+                if acquired:
+                    try:
+                        return _compute(cache_key, local_cache, args, kwargs)
+                    finally:
+                        _release_lock(lock, logger)  # type: ignore
+
+            return _compute(cache_key, local_cache, args, kwargs)
+
+        return _inner
+
+    return _decorator
+
+
+def cache_many(
+    expire_seconds: int = 15 * 60,
+    *,
+    connector: Optional[RedisConnector] = None,
+    silent: bool = True,
+    key_func: Optional[Callable[..., Any]] = None,
+    load_func: Optional[Callable[..., Any]] = None,
+    dump_func: Optional[Callable[..., Any]] = None,
+    serializer: Optional[str] = None,
+    logger: Optional[logging.Logger] = None,
+    local: bool = True,
+) -> Callable[..., Any]:
+    """
+    Cache decorator for batch functions
+
+    Decorated function takes a list of ids as its first argument and returns
+    a dict of values by id. Each id is cached under its own key: cached
+    values are fetched with a single MGET, then the function is called once
+    for the missing ids only, and the computed values are stored with a
+    single pipeline. Ids missing from the function's result are not cached.
+
+    Usage:
+      @cache_many(expire_seconds=60)
+      def render_cards(user_ids):
+          return {user.id: render_card(user) for user in load_users(user_ids)}
+    """
+    if connector is None:
+        connector = current_app.connectors.redis
+
+    # Get app's default logger if looger is omitted
+    if logger is None:
+        logger = connector.app.logger  # type: ignore
+
+    def _decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        key_generator = _generate_function_key(
+            func=func, prefix='cache', postfix_func=key_func
+        )
+        size_metric = METRICS_CACHE_VALUE_SIZE.labels(
+            'cache:{}'.format(_get_function_full_name(func))
+        )
+
+        @wraps(func)
+        def _inner(ids: Iterable[Any], *args, **kwargs) -> Dict[Any, Any]:
+            ids = list(dict.fromkeys(ids))
+            if current_app.config.get('CACHE_DISABLE') or not ids:
+                return func(ids, *args, **kwargs)
+
+            prefix = key_generator(*args, **kwargs)
+            keys = {id: '{}:{}'.format(prefix, id) for id in ids}
+            local_cache = connector.local if local else None  # type: ignore
+            values = {}  # type: Dict[Any, Any]
+            local_expire = _local_expire_seconds(
+                current_app.config.get('CACHE_LOCAL_TTL', 60), expire_seconds
+            )
+
+            loads, dumps = _serialization(connector, serializer, load_func, dump_func)
+
+            def _load(id, value) -> None:
+                try:
+                    values[id] = loads(value)
+                except (ValueError, pickle.PickleError):
+                    message = 'Cache cannot be loaded for key: {}'.format(keys[id])
                     logger.exception(message)  # type: ignore
                     if not silent:
                         raise CacheError(message)
+
+            if local_cache is not None:
+                for id in ids:
+                    value = local_cache.get(keys[id])
+                    if value is not None:
+                        _load(id, value)
+                METRICS_CACHE_REQUEST_COUNT.labels('local', 'hit').inc(len(values))
+                METRICS_CACHE_REQUEST_COUNT.labels('local', 'miss').inc(
+                    len(ids) - len(values)
+                )
+
+            missing = [id for id in ids if id not in values]
+            # don't spend the breaker's half-open probe without calling Redis
+            redis_available = bool(missing) and connector.available()  # type: ignore
+            if redis_available:
+                try:
+                    cached = connector.get_many(  # type: ignore
+                        [keys[id] for id in missing]
+                    )
                 except redis.RedisError:
-                    message = 'Redis connection failed while getting key: {}'.format(
-                        cache_key
+                    message = 'Redis connection failed while getting keys: {}'.format(
+                        prefix
                     )
                     logger.exception(message)  # type: ignore
                     if not silent:
                         raise RedisConnectorError(message)
+                    cached = [None] * len(missing)
+                    redis_available = False
+                for id, value in zip(missing, cached):
+                    if value is not None:
+                        _load(id, value)
+                        if local_cache is not None:
+                            local_cache.set(keys[id], value, local_expire)
+                hits = sum(1 for value in cached if value is not None)
+                METRICS_CACHE_REQUEST_COUNT.labels('redis', 'hit').inc(hits)
+                METRICS_CACHE_REQUEST_COUNT.labels('redis', 'miss').inc(
+                    len(missing) - hits
+                )
 
-            if cache_miss:
-                result = func(*args, **kwargs)
+            missing = [id for id in ids if id not in values]
+            if not missing:
+                return {id: values[id] for id in ids}
 
+            computed = func(missing, *args, **kwargs)
+            dumped = {}
+            for id in missing:
+                if id not in computed:
+                    continue
+                values[id] = computed[id]
                 try:
-                    connector.set_key(  # type: ignore
-                        cache_key, dump_func(result), expire_seconds
-                    )
+                    dumped[keys[id]] = dumps(computed[id])
                 except (ValueError, pickle.PickleError):
                     message = 'Function \'s `{}` result cannot be serialized'.format(
                         func.__name__
@@ -256,20 +968,45 @@ def cache(
                     logger.exception(message)  # type: ignore
                     if not silent:
                         raise CacheError(message)
+
+            for value in dumped.values():
+                size_metric.observe(len(value))
+            if local_cache is not None:
+                for key, value in dumped.items():
+                    local_cache.set(key, value, local_expire)
+            if dumped and redis_available and connector.available():  # type: ignore
+                try:
+                    connector.set_many(dumped, expire_seconds)  # type: ignore
                 except redis.RedisError:
-                    message = 'Redis connection failed while setting key: {}'.format(
-                        cache_key
+                    message = 'Redis connection failed while setting keys: {}'.format(
+                        prefix
                     )
                     logger.info(message)  # type: ignore
                     if not silent:
                         raise RedisConnectorError(message)
-            return result
+
+            return {id: values[id] for id in ids if id in values}
 
         return _inner
 
     return _decorator
 
 
+def _load_cached_response(data: bytes) -> CachedResponse:
+    # never unpickle Response objects stored by the former view cache
+    return get_codec('response').loads(data, strict=True)
+
+
+class _UncacheableResponse(Exception):
+    """
+    Raised to pass view's response through the cache without storing it
+    """
+
+    def __init__(self, response) -> None:
+        super().__init__(response.status)
+        self.response = response
+
+
 def cache_flask_view(
     expire_seconds: int = 15 * 60,
     *,
@@ -277,37 +1014,112 @@ def cache_flask_view(
     silent: bool = True,
     key_func: Optional[Callable[..., Any]] = None,
     logger: Optional[logging.Logger] = None,
+    local: bool = True,
+    single_flight: bool = False,
+    soft_ttl: Optional[int] = None,
+    lock_timeout: int = 30,
+    lock_wait: float = 3.0,
+    tags: Optional[Union[Iterable[str], Callable[..., Iterable[str]]]] = None,
 ) -> Callable[..., Any]:
     """
     Cache decorator for Flask function-based views
+
+    Successful (200 OK) responses are cached as the status code, the headers
+    listed in CACHED_RESPONSE_HEADERS and the body bytes, and replayed
+    without calling the view, unless the view has modified the session.
+    Responses get an ETag, so that requests with a matching If-None-Match
+    header are answered with 304 Not Modified.
     """
-    return cache(
-        expire_seconds=expire_seconds,
-        connector=connector,
-        silent=silent,
-        key_func=key_func,
-        load_func=pickle.loads,
-        dump_func=pickle.dumps,
-        logger=logger,
-    )
+
+    def _decorator(view: Callable[..., Any]) -> Callable[..., Any]:
+        @cache(
+            expire_seconds=expire_seconds,
+            connector=connector,
+            silent=silent,
+            key_func=key_func,
+            load_func=_load_cached_response,
+            serializer='response',
+            logger=logger,
+            local=local,
+            single_flight=single_flight,
+            soft_ttl=soft_ttl,
+            lock_timeout=lock_timeout,
+            lock_wait=lock_wait,
+            tags=tags,
+        )
+        @wraps(view)
+        def _cached(*args, **kwargs) -> CachedResponse:
+            response = current_app.make_response(view(*args, **kwargs))
+            # session changes, e.g. new CSRF token, make the page per client
+            if response.status_code != 200 or response.is_streamed or session.modified:
+                raise _UncacheableResponse(response)
+            response.add_etag()
+            headers = [
+                (name, value)
+                for name, value in response.headers
+                if name.lower() in CACHED_RESPONSE_HEADERS
+            ]
+            return CachedResponse(response.status_code, headers, response.get_data())
+
+        @wraps(view)
+        def _inner(*args, **kwargs) -> Any:
+            try:
+                cached = _cached(*args, **kwargs)
+            except _UncacheableResponse as e:
+                return e.response
+            response = current_app.response_class(
+                cached.body, status=cached.status, headers=cached.headers
+            )
+            return response.make_conditional(request)
+
+        return _inner
+
+    return _decorator
 
 
 def rate_limit(
-    rps: int,
+    rps: Optional[int] = None,
     *,
+    policy: Optional[RateLimitPolicy] = None,
     connector: Optional[RedisConnector] = None,
     silent: bool = True,
     key_func: Optional[Callable[..., Any]] = None,
-    load_func: Callable[..., Any] = json.loads,
+    user_key_func: Optional[Callable[..., Any]] = None,
     logger: Optional[logging.Logger] = None,
 ) -> Callable[..., Any]:
     """
     Rate limit decorator
+
+    Either `rps` (fixed one second window) or `policy` is the default, which
+    can be overridden per endpoint with PILI_RATE_LIMITS setting, e.g.:
+
+      PILI_RATE_LIMITS = {
+          'api.get_token': {'algorithm': 'token_bucket', 'limit': 10,
+                            'period': 60, 'burst': 3, 'per': 'user'},
+      }
+
+    Per-user policies use `user_key_func` returning the authenticated user's
+    key (None for anonymous users, limited per `key_func` then).
+
+    Each check is a single atomic EVALSHA call. Exceeding the limit raises
+    RateLimitExceededError with the seconds to wait before retrying.
+
+    While Redis fails, or the connector is unavailable (open circuit breaker or
+    exceeded request budget), limits are enforced by in-process token buckets,
+    each worker getting its share.
     """
+    if policy is None:
+        if rps is None:
+            raise ValueError('Either rps or policy should be given')
+        policy = RateLimitPolicy(limit=rps, period=1)
+
     # Get app's default logger if looger is omitted
     if logger is None:
         logger = connector.app.logger  # type: ignore
 
+    limiter = RateLimiter(connector)
+    local_limiter = LocalRateLimiter(workers=get_workers_count())
+
     def _decorator(func: Callable[..., Any]) -> Callable[..., Any]:
         # You may want to specify key_func to get user's ID or IP address
         # in order to set rate limit per user
@@ -315,46 +1127,51 @@ def rate_limit(
         # flask.request.environ['REMOTE_ADDR'] or
         # flask.request.environ['HTTP_X_FORWARDED_FOR']
         # Rate limit keys may look like:
-        # "rate-limit:fully-qualified-func-name:user-IP:timestamp-in-seconds"
+        # "rate-limit:fully-qualified-func-name:algorithm:user-IP"
         key_generator = _generate_function_key(
             func=func, prefix='rate-limit', postfix_func=key_func
         )
+        prefix = 'rate-limit:{}'.format(_get_function_full_name(func))
 
         @wraps(func)
         def _inner(*args, **kwargs) -> Any:
-            # attach seconds to a key
-            cache_key = key_generator(*args, **kwargs)
-            current_unix_time = round(time.time())
-            cache_key = '{0}:{1}'.format(cache_key, current_unix_time)
-
-            result = None
-
-            try:
-                result = load_func(connector.get_key(cache_key))  # type: ignore
-            except TypeError:
-                # key doesn't exist yet, keep result as is
-                pass
-            except ValueError:
-                message = 'Cache cannot be loaded for key: {}'.format(cache_key)
-                logger.exception(message)  # type: ignore
-                if not silent:
-                    raise CacheError(message)
-            except redis.RedisError:
-                message = 'Redis connection failed while getting key: {}'.format(
-                    cache_key
+            current_policy = policy
+            options = current_app.config.get('PILI_RATE_LIMITS', {}).get(
+                request.endpoint if has_request_context() else None
+            )
+            if options:
+                current_policy = RateLimitPolicy.from_config(options)
+
+            subject = None
+            if current_policy.per == PER_USER and user_key_func is not None:
+                subject = user_key_func(*args, **kwargs)
+            if subject is None:
+                cache_key = key_generator(*args, **kwargs)
+            else:
+                cache_key = '{}:{}'.format(prefix, subject)
+            cache_key = '{}:{}'.format(cache_key, current_policy.algorithm)
+
+            result = None  # type: Optional[Tuple[bool, float]]
+            if connector.available():  # type: ignore
+                try:
+                    with connector.guard():  # type: ignore
+                        result = limiter.hit(cache_key, current_policy)
+                except redis.RedisError:
+                    message = 'Redis connection failed while limiting key: {}'.format(
+                        cache_key
+                    )
+                    logger.exception(message)  # type: ignore
+                    if not silent:
+                        raise RedisConnectorError(message)
+            if result is None:
+                # degraded mode: Redis is unavailable or the circuit is open
+                result = local_limiter.hit(cache_key, current_policy)
+            allowed, retry_after = result
+
+            if not allowed:
+                raise RateLimitExceededError(
+                    'Rate limit exceeded', retry_after=math.ceil(retry_after)
                 )
-                logger.exception(message)  # type: ignore
-                if not silent:
-                    raise RedisConnectorError(message)
-
-            if result and result > rps:
-                raise RateLimitExceededError('Rate limit exceeded')
-
-            # increment key and set expiration atomically
-            pipe = connector.connection.pipeline()  # type: ignore
-            pipe.incr(cache_key, 1)  # increase RPS counter
-            pipe.expire(cache_key, 5)  # drop key in 5 seconds
-            pipe.execute()
 
             return func(*args, **kwargs)
 
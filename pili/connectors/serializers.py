@@ -0,0 +1,233 @@
+import pickle
+import zlib
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import ujson as json
+except ImportError:
+    import json  # type: ignore
+
+try:
+    import msgpack  # type: ignore
+except ImportError:
+    msgpack = None
+
+try:
+    import lz4.frame as lz4  # type: ignore
+except ImportError:
+    lz4 = None
+
+#
+# Constants
+#
+
+# Serialized values start with a header: the marker byte, then serializer's
+# and compressor's codes. Neither JSON text nor pickles (protocol 2 and
+# higher start with 0x80) start with the marker, so that values stored
+# before the header was introduced are still loaded.
+HEADER_MARKER = b'\xfe'
+HEADER_SIZE = 3
+NO_COMPRESSION = 0
+
+# Serializers able to run arbitrary code while loading. Codecs load their
+# values only when being such a serializer themselves, so that anyone able to
+# write to Redis cannot get them loaded by a JSON or msgpack codec.
+UNSAFE_SERIALIZERS = {'pickle'}
+
+
+#
+# Registry
+#
+
+
+class Serializer(NamedTuple):
+    name: str
+    code: int
+    dumps: Callable[[Any], bytes]
+    loads: Callable[[bytes], Any]
+
+
+class Compressor(NamedTuple):
+    name: str
+    code: int
+    compress: Callable[[bytes], bytes]
+    decompress: Callable[[bytes], bytes]
+
+
+SERIALIZERS = {}  # type: Dict[str, Serializer]
+COMPRESSORS = {}  # type: Dict[str, Compressor]
+
+
+def register_serializer(
+    name: str, code: int, dumps: Callable[[Any], bytes], loads: Callable[[bytes], Any]
+) -> None:
+    if not 0 < code < 256:
+        raise ValueError('Serializer code must be in range 1-255')
+    if any(s.code == code and s.name != name for s in SERIALIZERS.values()):
+        raise ValueError('Serializer code {} is already registered'.format(code))
+    SERIALIZERS[name] = Serializer(name, code, dumps, loads)
+
+
+def register_compressor(
+    name: str,
+    code: int,
+    compress: Callable[[bytes], bytes],
+    decompress: Callable[[bytes], bytes],
+) -> None:
+    if not 0 < code < 256:
+        raise ValueError('Compressor code must be in range 1-255')
+    if any(c.code == code and c.name != name for c in COMPRESSORS.values()):
+        raise ValueError('Compressor code {} is already registered'.format(code))
+    COMPRESSORS[name] = Compressor(name, code, compress, decompress)
+
+
+class CachedResponse(NamedTuple):
+    """
+    HTTP response as cached: status code, selected headers and body bytes
+    """
+
+    status: int
+    headers: List[Tuple[str, str]]
+    body: bytes
+
+
+def _json_dumps(value: Any) -> bytes:
+    return json.dumps(value).encode('utf-8')
+
+
+def _response_dumps(response: CachedResponse) -> bytes:
+    # JSON line with the status and headers followed by the raw body
+    meta = json.dumps([response.status, response.headers]).encode('utf-8')
+    return meta + b'\n' + response.body
+
+
+def _response_loads(data: bytes) -> CachedResponse:
+    meta, _, body = data.partition(b'\n')
+    status, headers = json.loads(meta)
+    return CachedResponse(status, [tuple(header) for header in headers], body)
+
+
+register_serializer('json', 1, _json_dumps, json.loads)
+register_serializer(
+    'pickle',
+    2,
+    lambda value: pickle.dumps(value, pickle.HIGHEST_PROTOCOL),
+    pickle.loads,
+)
+register_serializer('response', 4, _response_dumps, _response_loads)
+if msgpack is not None:
+    register_serializer(
+        'msgpack',
+        3,
+        lambda value: msgpack.packb(value, use_bin_type=True),
+        lambda data: msgpack.unpackb(data, raw=False),
+    )
+
+register_compressor('zlib', 1, zlib.compress, zlib.decompress)
+if lz4 is not None:
+    register_compressor('lz4', 2, lz4.compress, lz4.decompress)
+
+
+#
+# Codec
+#
+
+
+class Codec:
+    """
+    Serializer of cached values with optional compression
+
+    Values larger than `threshold` bytes after serialization are compressed.
+    Each value carries a header with the codes of its serializer and
+    compressor, so that any codec loads values stored by any other one, e.g.
+    while switching from JSON to msgpack. Pickles are the exception: only the
+    pickle codec loads them.
+
+    Usage:
+      codec = get_codec('msgpack', compression='zlib', threshold=1024)
+      data = codec.dumps({'posts': []})
+      codec.loads(data)
+    """
+
+    def __init__(
+        self, serializer: str, compression: Optional[str] = None, threshold: int = 0
+    ) -> None:
+        if serializer not in SERIALIZERS:
+            raise ValueError('Unknown or unavailable serializer: {}'.format(serializer))
+        if compression is not None and compression not in COMPRESSORS:
+            raise ValueError(
+                'Unknown or unavailable compression: {}'.format(compression)
+            )
+        self.serializer = SERIALIZERS[serializer]
+        self.compressor = COMPRESSORS[compression] if compression else None
+        self.threshold = threshold
+
+    def dumps(self, value: Any) -> bytes:
+        data = self.serializer.dumps(value)
+        compressor_code = NO_COMPRESSION
+        if self.compressor is not None and len(data) > self.threshold:
+            data = self.compressor.compress(data)
+            compressor_code = self.compressor.code
+        return HEADER_MARKER + bytes((self.serializer.code, compressor_code)) + data
+
+    def loads(self, data: Any, strict: bool = False) -> Any:
+        """
+        Load value, with strict=True only the one stored by the serializer
+        """
+        if strict and (data[:1] != HEADER_MARKER or data[1] != self.serializer.code):
+            raise ValueError(
+                'Value is not serialized with {}'.format(self.serializer.name)
+            )
+        if data[:1] != HEADER_MARKER:
+            allow_pickle = self.serializer.name == 'pickle'
+            return load_headerless(data, allow_pickle=allow_pickle)
+        serializer_code, compressor_code = data[1], data[2]
+        serializer = _by_code(SERIALIZERS, serializer_code)
+        if not self._allows(serializer):
+            raise ValueError(
+                'Codec {} does not load {} values'.format(
+                    self.serializer.name, serializer.name
+                )
+            )
+        body = data[HEADER_SIZE:]
+        if compressor_code != NO_COMPRESSION:
+            compressor = _by_code(COMPRESSORS, compressor_code)
+            try:
+                body = compressor.decompress(body)
+            except Exception as e:
+                raise ValueError(
+                    'Cannot decompress {} data: {}'.format(compressor.name, e)
+                )
+        return serializer.loads(body)
+
+    def _allows(self, serializer: Serializer) -> bool:
+        return (
+            serializer.name not in UNSAFE_SERIALIZERS
+            or serializer.name == self.serializer.name
+        )
+
+
+def _by_code(registry: Dict[str, Any], code: int) -> Any:
+    for entry in registry.values():
+        if entry.code == code:
+            return entry
+    raise ValueError('Unknown or unavailable format code: {}'.format(code))
+
+
+def load_headerless(data: bytes, allow_pickle: bool = False) -> Any:
+    """
+    Load a value stored without a header, JSON or, if allowed, a pickle
+    """
+    if data[:1] == b'\x80':
+        if not allow_pickle:
+            raise ValueError('Headerless pickles are not allowed')
+        return pickle.loads(data)
+    return json.loads(data)
+
+
+@lru_cache(maxsize=None)
+def get_codec(
+    serializer: str, compression: Optional[str] = None, threshold: int = 0
+) -> Codec:
+    return Codec(serializer, compression=compression, threshold=threshold)
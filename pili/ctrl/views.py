@@ -13,7 +13,6 @@ from flask import (
     url_for,
 )
 from flask_login import current_user, login_required
-from flask_sqlalchemy import get_debug_queries
 from werkzeug.utils import secure_filename
 
 from pili.app import db
@@ -26,6 +25,7 @@ from pili.filters import (
     sanitize_alias,
     sanitize_tags,
 )
+from pili.loaders import load_posts, load_users
 from pili.models import (
     Category,
     Comment,
@@ -39,6 +39,7 @@ from pili.models import (
     Upload,
     User,
 )
+from pili.pagination import paginate
 
 from .forms import (
     CategoryForm,
@@ -144,9 +145,11 @@ def remove_post():
         tags = post.tags.all()
         for t in tags:
             # remove entries from M2M tagification table
-            Tagification.query.filter_by(tag_id=t.id, post_id=post.id).delete(
-                synchronize_session='fetch'
-            )
+            # one by one, so that tags' post counters are kept in sync
+            for tagification in Tagification.query.filter_by(
+                tag_id=t.id, post_id=post.id
+            ):
+                db.session.delete(tagification)
             # if the tag is not in use in other post(s), remove it
             in_other_posts = Tagification.query.filter(
                 Tagification.tag_id == t.id, Tagification.post_id != post.id
@@ -184,7 +187,7 @@ def user(username):
     pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
         page, per_page=current_app.config['PILI_POSTS_PER_PAGE'], error_out=False
     )
-    posts = pagination.items
+    posts = load_posts(pagination.items, current_user)
     return render_template(
         'main/user.html', user=user, posts=posts, pagination=pagination
     )
@@ -432,17 +435,6 @@ def server_shutdown():
     return 'Shutting down...'
 
 
-@ctrl.after_app_request
-def after_request(response):
-    for query in get_debug_queries():
-        if query.duration >= current_app.config['PILI_SLOW_DB_QUERY_TIME']:
-            current_app.logger.warning(
-                'Slow query: %s\nParameters: %s\nDuration: %fs\nContext: %s\n'
-                % (query.statement, query.parameters, query.duration, query.context)
-            )
-    return response
-
-
 @ctrl.route('/categories', methods=['GET', 'POST'])
 @permission_required(Permission.STRUCTURE)
 def categories():
@@ -500,7 +492,7 @@ def remove_category():
         )
 
     category = Category.query.get_or_404(id)
-    if category.posts.count():
+    if category.post_count:
         status = 'warning'
         message = "Category '{0}' is not empty and cannot be removed".format(
             category.title
@@ -611,8 +603,11 @@ def view_upload(filename):
 def comments():
     csrf_form = CsrfTokenForm()
     page = request.args.get('page', 1, type=int)
-    pagination = Comment.query.order_by(Comment.timestamp.desc()).paginate(
-        page, per_page=current_app.config['PILI_COMMENTS_PER_PAGE'], error_out=False
+    pagination = paginate(
+        Comment.query,
+        Comment.timestamp,
+        Comment.id,
+        current_app.config['PILI_COMMENTS_PER_PAGE'],
     )
     comments = pagination.items
     return render_template(
@@ -830,7 +825,7 @@ def users():
             page, per_page=current_app.config['PILI_USERS_PER_PAGE'], error_out=False
         )
     )
-    users = pagination.items
+    users = load_users(pagination.items)
     return render_template(
         'ctrl/users.html',
         users=users,
@@ -1022,9 +1017,10 @@ class Ops:
             tags = post.tags.all()
             for t in tags:
                 # remove entries from M2M tagification table
-                Tagification.query.filter_by(tag_id=t.id, post_id=post.id).delete(
-                    synchronize_session='fetch'
-                )
+                for tagification in Tagification.query.filter_by(
+                    tag_id=t.id, post_id=post.id
+                ):
+                    db.session.delete(tagification)
                 # if the tag is not in use in other post(s), remove it
                 in_other_posts = Tagification.query.filter(
                     Tagification.tag_id == t.id, Tagification.post_id != post.id
@@ -1,8 +1,10 @@
 from functools import wraps
 
-from flask import abort
+from flask import abort, current_app, request, session
 from flask_login import current_user
 
+from pili.app import cache_flask_view, vary
+from pili.conditional import conditional
 from pili.models import Permission
 
 
@@ -21,3 +23,54 @@ def permission_required(permission):
 
 def admin_required(f):
     return permission_required(Permission.ADMINISTER)(f)
+
+
+def is_anonymous_request():
+    """
+    Return True for GET requests of visitors without session-bound cookies
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    cookies = (
+        current_app.session_cookie_name,
+        current_app.config.get('REMEMBER_COOKIE_NAME', 'remember_token'),
+        'show_followed',
+    )
+    return not any(name in request.cookies for name in cookies)
+
+
+def cache_anonymous_page(expire_seconds=60 * 60, *, tags, query=('page',)):
+    """Full-page cache for anonymous visitors.
+
+    Pages are cached by view arguments, selected query arguments and Host,
+    and invalidated by the cache tags (or a function of view arguments
+    returning them) on content writes. Other requests are served by the
+    view itself. Cached pages are marked public for PILI_PAGE_CACHE_MAX_AGE
+    seconds and get Surrogate-Key header with the tags, so that a caching
+    proxy in front of the app may store and purge them too. Revalidation
+    requests are answered with 304 by the tags' version stamps alone.
+    """
+
+    def decorator(f):
+        key_func = vary(query=query, headers=['Host'])
+        cached_function = conditional(tags, key_func=key_func)(
+            cache_flask_view(expire_seconds, key_func=key_func, tags=tags)(f)
+        )
+
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not is_anonymous_request():
+                return f(*args, **kwargs)
+            response = cached_function(*args, **kwargs)
+            if response.status_code in (200, 304) and not session.modified:
+                page_tags = tags(*args, **kwargs) if callable(tags) else tags
+                response.cache_control.public = True
+                response.cache_control.max_age = current_app.config[
+                    'PILI_PAGE_CACHE_MAX_AGE'
+                ]
+                response.headers['Surrogate-Key'] = ' '.join(page_tags)
+            return response
+
+        return decorated_function
+
+    return decorator
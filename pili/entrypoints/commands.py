@@ -1,22 +1,24 @@
 import os
 import sys
-from typing import Any, Dict
+from typing import Any, Dict, Tuple
 
 import click
 import flask_migrate
 import pytest
 from werkzeug.serving import run_simple
 
+from pili import benchmark, loadtest, seeding, timeline
 from pili.app import create_app, db
 from pili.entrypoints.dispatcher import create_dispatcher
-from pili.models import Role, User
+from pili.models import Role, User, recount_counters
 
 #
 # Constants
 #
 
 CONFIG_OPTS = {'testing', 'development', 'production'}
-UWSGI_OPTS = {'testing', 'development', 'production'}
+UWSGI_OPTS = {'testing', 'development', 'production'} | set(loadtest.PROFILES)
+UWSGI_INI = '/app/etc/uwsgi/pili.ini'
 
 
 #
@@ -117,6 +119,84 @@ def provision(
             click.echo('---> Following configured')
 
 
+@cli.command(help="Recompute denormalized counters")
+@click.pass_context
+def recount(ctx: Any) -> None:
+    app = create_app(ctx.obj['config'])
+
+    with app.app_context():
+        recount_counters()
+        click.echo('---> Counters recomputed')
+
+
+@cli.command(name='timeline', help="Backfill followed posts' timelines in Redis")
+@click.option(
+    '--user', 'user_ids', multiple=True, type=int, help='User id, all users if omitted'
+)
+@click.pass_context
+def backfill_timelines(ctx: Any, user_ids: Tuple[int, ...]) -> None:
+    app = create_app(ctx.obj['config'])
+
+    with app.app_context():
+        count = timeline.backfill(user_ids or None)
+        click.echo('---> {} timelines built'.format(count))
+        if not app.config['PILI_TIMELINE']:
+            click.echo('---> Set PILI_TIMELINE to read and update them')
+
+
+@cli.command(help="Generate synthetic dataset")
+@click.option('--users', default=1000, type=click.IntRange(min=1), help='Users')
+@click.option('--posts', default=10000, type=click.IntRange(min=0), help='Posts')
+@click.option('--comments', default=50000, type=click.IntRange(min=0), help='Comments')
+@click.option('--likes', default=100000, type=click.IntRange(min=0), help='Likes')
+@click.option(
+    '--follows', default=20, type=click.IntRange(min=0), help='Follows per user'
+)
+@click.option('--tags', default=200, type=click.IntRange(min=0), help='Tags')
+@click.option('--categories', default=10, type=click.IntRange(min=1), help='Categories')
+@click.option(
+    '--skew', default=1.0, type=click.FloatRange(min=0), help='Popularity skew'
+)
+@click.option('--batch_size', default=5000, help='Rows per insert batch')
+@click.option('--seed', default=None, type=int, help='Random seed')
+@click.pass_context
+def seed(ctx: Any, **options: Any) -> None:
+    app = create_app(ctx.obj['config'])
+
+    with app.app_context():
+        inserted = seeding.generate(**options)
+        for table, count in inserted.items():
+            click.echo('---> {0} {1} inserted'.format(count, table))
+
+
+@cli.command(help="Benchmark main HTML and API endpoints")
+@click.option('--requests', default=100, help='Requests per endpoint')
+@click.option('--warmup', default=5, help='Warm-up requests per endpoint')
+@click.option(
+    '--cache/--no-cache', default=False, help='Enable caches during benchmark'
+)
+@click.option(
+    '--trace_memory/--no-trace_memory',
+    default=False,
+    help='Measure peak allocations per request, slows requests down',
+)
+@click.pass_context
+def bench(
+    ctx: Any, requests: int, warmup: int, cache: bool, trace_memory: bool
+) -> None:
+    app = create_app(ctx.obj['config'])
+    app.config['CACHE_DISABLE'] = not cache
+
+    with app.test_request_context():
+        targets = benchmark.get_targets()
+    # no app context around the requests, so that each one pushes its own,
+    # as it does in production
+    results = benchmark.run(
+        app, targets, requests=requests, warmup=warmup, trace_memory=trace_memory
+    )
+    click.echo(benchmark.format_results(results))
+
+
 @cli.command(help="Run Flask Development Server")
 @click.option('--host', default='0.0.0.0', help='Flask Development Server Host')
 @click.option('--port', default=8080, help='Flask Development Server Port')
@@ -147,14 +227,61 @@ def server(
     callback=_validate_uwsgi,
     help='uWSGI config file section name',
 )
+@click.option('--ini', default=UWSGI_INI, help='uWSGI config file path')
 @click.pass_context
-def uwsgi(ctx: Any, section: str) -> None:
+def uwsgi(ctx: Any, section: str, ini: str) -> None:
     config_name = ctx.obj['config']
     os.system(
-        'exec uwsgi --ini /app/etc/uwsgi/pili.ini:{0} --pyargv "{1}"'.format(
-            section, config_name
-        )
+        'exec uwsgi --ini {0}:{1} --pyargv "{2}"'.format(ini, section, config_name)
+    )
+
+
+@cli.command(name='loadtest', help='Load test uWSGI worker profiles')
+@click.option(
+    '--sections',
+    default='solo,duet,quartet,octet',
+    help='Comma-separated uWSGI config file sections to sweep',
+)
+@click.option('--ini', default=UWSGI_INI, help='uWSGI config file path')
+@click.option('--url', default='http://127.0.0.1:8080', help='App URL')
+@click.option('--users', default=20, help='Concurrent virtual users')
+@click.option('--duration', default=60, help='Seconds per section')
+@click.option('--warmup', default=5, help='Warm-up seconds per section')
+@click.option('--seed', default=None, type=int, help='Random seed')
+@click.option(
+    '--boot/--no-boot',
+    default=True,
+    help='Boot uWSGI per section, otherwise test the running app once',
+)
+@click.pass_context
+def load_test(
+    ctx: Any,
+    sections: str,
+    ini: str,
+    url: str,
+    users: int,
+    duration: int,
+    warmup: int,
+    seed: int,
+    boot: bool,
+) -> None:
+    if not boot:
+        results = loadtest.run_load(url, users=users, duration=duration, seed=seed)
+        click.echo(loadtest.format_results(results))
+        return
+    names = [_validate_uwsgi(ctx, None, name) for name in sections.split(',')]
+    totals = loadtest.sweep(
+        ctx.obj['config'],
+        names,
+        ini,
+        base_url=url,
+        users=users,
+        duration=duration,
+        warmup=warmup,
+        seed=seed,
+        echo=click.echo,
     )
+    click.echo(loadtest.format_results(totals, first_column='section'))
 
 
 @cli.command(help="Run Python Shell")
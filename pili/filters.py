@@ -113,3 +113,8 @@ def to_bool(s: str) -> bool:
     bool() from the standard library convert all non-empty strings to True.
     """
     return s.lower() in ['true', 't', 'y', 'yes'] if s is not None else False
+
+
+def to_floats(s: str) -> tuple:
+    """Return tuple of floats converted from comma-separated string."""
+    return tuple(float(item) for item in s.split(',') if item.strip())
@@ -0,0 +1,134 @@
+from typing import Any, Callable, Dict, Iterable, List, Optional, Union
+
+import redis
+from flask import _request_ctx_stack, current_app
+from jinja2 import nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+#
+# Constants
+#
+
+FRAGMENT_KEY = 'fragment:{key}:{versions}'
+
+
+def _fragment_key(key: Union[str, Iterable[Any]], versions: List[int]) -> str:
+    if not isinstance(key, str):
+        key = ':'.join(str(part) for part in key)
+    return FRAGMENT_KEY.format(key=key, versions='.'.join(map(str, versions)))
+
+
+def get_versions(tags: List[str]) -> List[int]:
+    """
+    Return tags' version stamps, each one is fetched once per request
+
+    Outside of requests, e.g. in Celery tasks running within a single
+    application context, the stamps are fetched on each call.
+    """
+    # kept on the request context rather than g, which outlives the requests
+    # within an application context pushed beforehand
+    ctx = _request_ctx_stack.top
+    if ctx is None:
+        return current_app.connectors.redis.get_versions(tags)
+    if not hasattr(ctx, 'cache_versions'):
+        ctx.cache_versions = {}
+    versions = ctx.cache_versions  # type: Dict[str, int]
+    missing = [tag for tag in tags if tag not in versions]
+    if missing:
+        versions.update(
+            zip(missing, current_app.connectors.redis.get_versions(missing))
+        )
+    return [versions[tag] for tag in tags]
+
+
+#
+# Public API
+#
+
+
+def cached_fragment(
+    key: Union[str, Iterable[Any]],
+    tags: Iterable[str],
+    render: Callable[[], str],
+    expire_seconds: Optional[int] = None,
+) -> str:
+    """Return rendered fragment cached by the key and tags' version stamps.
+
+    Invalidation of any of the tags (see RedisConnector.invalidate_tags)
+    bumps its version, so that the next call looks the fragment up under a
+    new key and renders it again, while the stale one just expires. The
+    fragment is rendered as is if caching is disabled or Redis is down.
+    """
+    connector = current_app.connectors.redis
+    if current_app.config.get('CACHE_DISABLE') or not connector.available():
+        return render()
+    if expire_seconds is None:
+        expire_seconds = current_app.config['PILI_FRAGMENT_CACHE_EXPIRE']
+
+    local_cache = connector.local
+    try:
+        cache_key = _fragment_key(key, get_versions(sorted(tags)))
+        if local_cache is not None:
+            value = local_cache.get(cache_key)
+            if value is not None:
+                return value
+        value = connector.get_key(cache_key)
+    except redis.RedisError:
+        current_app.logger.exception(
+            'Redis connection failed while getting fragment: {}'.format(key)
+        )
+        return render()
+
+    if value is not None:
+        value = value.decode('utf-8')
+    else:
+        value = str(render())
+        if connector.available():
+            try:
+                connector.set_key(cache_key, value, expire_seconds)
+            except redis.RedisError:
+                current_app.logger.exception(
+                    'Redis connection failed while setting fragment: {}'.format(key)
+                )
+    if local_cache is not None:
+        local_cache.set(
+            cache_key,
+            value,
+            min(current_app.config.get('CACHE_LOCAL_TTL', 60), expire_seconds),
+        )
+    return value
+
+
+class FragmentCacheExtension(Extension):
+    """
+    Jinja extension caching template fragments with cached_fragment()
+
+    Usage:
+      {% cache ['post-card', post.id], ['post:' ~ post.id] %}
+        ...
+      {% endcache %}
+
+    The key is either a string or a list of its parts, the tags are the
+    cache tags of the data the fragment depends on. Optional third argument
+    overrides PILI_FRAGMENT_CACHE_EXPIRE setting, e.g. {% cache 'x', [], 60 %}
+    """
+
+    tags = {'cache'}
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        args = [parser.parse_expression()]
+        parser.stream.expect('comma')
+        args.append(parser.parse_expression())
+        if parser.stream.skip_if('comma'):
+            args.append(parser.parse_expression())
+        else:
+            args.append(nodes.Const(None))
+        body = parser.parse_statements(['name:endcache'], drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_cache', args), [], [], body
+        ).set_lineno(lineno)
+
+    def _cache(self, key, tags, expire_seconds, caller):
+        return Markup(cached_fragment(key, tags, caller, expire_seconds))
@@ -0,0 +1,175 @@
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from flask import _request_ctx_stack, current_app, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#
+# Constants
+#
+
+PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# placeholder lists of IN clauses vary with the number of values
+IN_PLACEHOLDERS_RE = re.compile(r'IN \((?:\?|%\(\w+\)s)(?:, (?:\?|%\(\w+\)s))*\)')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+#
+# Per-request query statistics
+#
+
+
+class QueryStats:
+    """
+    Number of queries and total time spent on them within a request
+
+    With fingerprints enabled, also counts the queries by their shape and
+    keeps the template or the code line each shape has been queried from
+    first.
+    """
+
+    __slots__ = ('count', 'duration', 'fingerprints', 'contexts')
+
+    def __init__(self, fingerprints: bool = False) -> None:
+        self.count = 0
+        self.duration = 0.0
+        self.fingerprints = None  # type: Optional[Counter]
+        self.contexts = {}  # type: Dict[str, str]
+        if fingerprints:
+            self.fingerprints = Counter()
+
+    def record(self, statement: str, duration: float) -> None:
+        self.count += 1
+        self.duration += duration
+        if self.fingerprints is not None:
+            shape = fingerprint(statement)
+            self.fingerprints[shape] += 1
+            if shape not in self.contexts:
+                self.contexts[shape] = get_query_context()
+
+    def repeated(self, threshold: int) -> List[Tuple[str, int, str]]:
+        """
+        Return shapes queried at least threshold times, N+1 query suspects
+        """
+        if self.fingerprints is None:
+            return []
+        return [
+            (shape, count, self.contexts[shape])
+            for shape, count in self.fingerprints.most_common()
+            if count >= threshold
+        ]
+
+
+def get_query_stats() -> QueryStats:
+    """
+    Return current request's query statistics
+    """
+    # kept on the request context rather than g, which is shared by the
+    # requests within an application context pushed beforehand
+    ctx = _request_ctx_stack.top
+    if not hasattr(ctx, 'query_stats'):
+        ctx.query_stats = QueryStats(
+            fingerprints=current_app.config['PILI_QUERY_FINGERPRINTS']
+        )
+    return ctx.query_stats
+
+
+def fingerprint(statement: str) -> str:
+    """
+    Return the shape of the statement regardless of IN clauses' lengths
+    """
+    statement = WHITESPACE_RE.sub(' ', statement.strip())
+    return IN_PLACEHOLDERS_RE.sub('IN (?)', statement)
+
+
+def get_query_context() -> str:
+    """Return where the query is made from.
+
+    The innermost Jinja template line if the query is made while rendering
+    a template, e.g. accessing a lazy relationship, or the innermost line of
+    the app's code otherwise.
+    """
+    code_line = None
+    frame = sys._getframe(1)
+    while frame is not None:
+        namespace = frame.f_globals
+        # module globals of compiled templates
+        if (
+            'debug_info' in namespace
+            and 'environment' in namespace
+            and namespace.get('name') is not None
+        ):
+            template = namespace['environment'].get_template(namespace['name'])
+            return '{}:{}'.format(
+                template.name, template.get_corresponding_lineno(frame.f_lineno)
+            )
+        filename = frame.f_code.co_filename
+        if (
+            code_line is None
+            and filename.startswith(PACKAGE_DIR)
+            and filename != __file__
+        ):
+            code_line = '{}:{}'.format(
+                os.path.relpath(filename, os.path.dirname(PACKAGE_DIR)), frame.f_lineno
+            )
+        frame = frame.f_back
+    return code_line or '<unknown>'
+
+
+def report_repeated_queries(response):
+    """
+    Log statements repeated within the request, likely N+1 queries
+    """
+    threshold = current_app.config['PILI_REPEATED_QUERY_THRESHOLD']
+    for shape, count, context in get_query_stats().repeated(threshold):
+        current_app.logger.warning(
+            'Repeated query: %s\nCount: %d\nContext: %s\nEndpoint: %s\n'
+            % (shape, count, context, request.endpoint)
+        )
+    return response
+
+
+#
+# Engine events
+#
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # kept on the statement's execution context rather than the pooled
+    # connection, so that nothing is left behind when the statement fails
+    if context is not None:
+        context._query_start_time = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start_time = getattr(context, '_query_start_time', None)
+    if start_time is None or not has_request_context():
+        return
+    duration = time.perf_counter() - start_time
+    get_query_stats().record(statement, duration)
+    if duration >= current_app.config['PILI_SLOW_DB_QUERY_TIME']:
+        current_app.logger.warning(
+            'Slow query: %s\nParameters: %s\nDuration: %fs\nEndpoint: %s\n'
+            % (statement, parameters, duration, request.endpoint)
+        )
+
+
+def register_query_listeners() -> None:
+    """Count queries and their time per request with engine events.
+
+    Unlike SQLALCHEMY_RECORD_QUERIES, neither statements nor parameters are
+    kept in memory, so that the instrumentation is cheap enough for
+    production. Listeners are registered once for all the engines.
+    """
+    for name, listener in (
+        ('before_cursor_execute', _before_cursor_execute),
+        ('after_cursor_execute', _after_cursor_execute),
+    ):
+        if not event.contains(Engine, name, listener):
+            event.listen(Engine, name, listener)
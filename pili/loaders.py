@@ -0,0 +1,170 @@
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+from pili.app import db
+from pili.models import (
+    Category,
+    Comment,
+    Like,
+    Post,
+    Role,
+    Tag,
+    Tagification,
+    Upload,
+    User,
+)
+
+
+class PostView:
+    """Post wrapper carrying data precomputed for the whole page of posts.
+
+    Attributes not computed by the loader are proxied to the underlying
+    Post object, so that templates can use a view as if it was a model.
+    """
+
+    def __init__(self, post: Post, tags: List[Tag], liked: bool) -> None:
+        self.post = post
+        self.tags = tags
+        self.liked = liked
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.post, name)
+
+    def card_cache_tags(self) -> List[str]:
+        """
+        Return cache tags of the data shown on the post's card
+        """
+        tags = ['post:{}'.format(self.post.id)]
+        if self.post.author is not None:
+            tags.append('user:{}'.format(self.post.author.username))
+        if self.post.category is not None:
+            tags.append('category:{}'.format(self.post.category.alias))
+        tags.extend('tag:{}'.format(tag.alias) for tag in self.tags)
+        return tags
+
+    def __repr__(self) -> str:
+        return '<PostView %r>' % self.post
+
+
+def _preload(model, ids: Set[Optional[int]]) -> None:
+    """
+    Load many-to-one targets into the session's identity map at once
+
+    Subsequent lazy loads of post.author or post.category are resolved from
+    the identity map without emitting a query per post.
+    """
+    ids.discard(None)
+    if ids:
+        model.query.filter(model.id.in_(ids)).all()
+
+
+def load_posts(posts: Iterable[Post], user: Any = None) -> List[PostView]:
+    """Return view objects for the list of posts.
+
+    Tags and a like status of the given user are fetched for all the posts
+    in a fixed number of grouped queries instead of several queries per post.
+    Like and comment counters are denormalized columns of the Post itself.
+    """
+    posts = list(posts)
+    if not posts:
+        return []
+    ids = [post.id for post in posts]
+
+    _preload(User, {post.author_id for post in posts})
+    _preload(Category, {post.category_id for post in posts})
+
+    tags = defaultdict(list)  # type: Dict[int, List[Tag]]
+    rows = (
+        db.session.query(Tagification.post_id, Tag)
+        .join(Tag, Tag.id == Tagification.tag_id)
+        .filter(Tagification.post_id.in_(ids))
+        .order_by(Tag.id)
+        .all()
+    )
+    for post_id, tag in rows:
+        tags[post_id].append(tag)
+
+    liked = set()  # type: Set[int]
+    if user is not None and user.is_authenticated:
+        liked = {
+            post_id
+            for post_id, in db.session.query(Like.post_id).filter(
+                Like.post_id.in_(ids), Like.user_id == user.id
+            )
+        }
+
+    return [
+        PostView(post=post, tags=tags[post.id], liked=post.id in liked)
+        for post in posts
+    ]
+
+
+class UserView:
+    """User wrapper carrying counters precomputed for the whole page of users.
+
+    Attributes not computed by the loader are proxied to the underlying
+    User object.
+    """
+
+    def __init__(
+        self,
+        user: User,
+        category_count: int,
+        image_count: int,
+        comment_count: int,
+        reply_count: int,
+    ) -> None:
+        self.user = user
+        self.category_count = category_count
+        self.image_count = image_count
+        self.comment_count = comment_count
+        self.reply_count = reply_count
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.user, name)
+
+    def __repr__(self) -> str:
+        return '<UserView %r>' % self.user
+
+
+def _count_by(column, ids: List[int]) -> Dict[int, int]:
+    """
+    Return the number of rows per value of the column, e.g. per author
+    """
+    return dict(
+        db.session.query(column, db.func.count())
+        .filter(column.in_(ids))
+        .group_by(column)
+        .all()
+    )
+
+
+def load_users(users: Iterable[User]) -> List[UserView]:
+    """Return view objects for the list of users.
+
+    Users' roles and counts of their categories, uploads, comments and
+    received replies are fetched for all the users in a fixed number of
+    grouped queries instead of several queries per user.
+    """
+    users = list(users)
+    if not users:
+        return []
+    ids = [user.id for user in users]
+
+    _preload(Role, {user.role_id for user in users})
+
+    categories = _count_by(Category.author_id, ids)
+    images = _count_by(Upload.owner_id, ids)
+    comments = _count_by(Comment.author_id, ids)
+    replies = _count_by(Comment.recipient_id, ids)
+
+    return [
+        UserView(
+            user=user,
+            category_count=categories.get(user.id, 0),
+            image_count=images.get(user.id, 0),
+            comment_count=comments.get(user.id, 0),
+            reply_count=replies.get(user.id, 0),
+        )
+        for user in users
+    ]
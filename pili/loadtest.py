@@ -0,0 +1,464 @@
+import configparser
+import http.cookiejar
+import itertools
+import json
+import os
+import random
+import re
+import signal
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from pili.benchmark import format_table, percentile
+from pili.seeding import EMAIL, PASSWORD
+
+#
+# Constants
+#
+
+CSRF_TOKEN_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]*)"')
+POST_URL_RE = re.compile(r'href="(/[\w-]+/\d+/[\w-]+)"')
+TAG_URL_RE = re.compile(r'href="(/tag/[\w-]+)"')
+USER_ID_RE = re.compile(r'/api/v1\.0/users/(\d+)')
+
+# sections of etc/uwsgi/pili.ini by workers
+PROFILES = ('solo', 'duet', 'quartet', 'octet', 'choir', 'orchestra')
+
+
+#
+# HTTP client
+#
+
+
+class Stats:
+    """
+    Latencies and failures of the requests by name, shared by the threads
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)  # type: Dict[str, List[float]]
+        self.failures = defaultdict(int)  # type: Dict[str, int]
+
+    def add(self, name: str, latency: float, failed: bool) -> None:
+        with self.lock:
+            self.latencies[name].append(latency)
+            if failed:
+                self.failures[name] += 1
+
+
+class Client:
+    """
+    HTTP client of a virtual user with its own cookies, e.g. session
+    """
+
+    def __init__(self, base_url: str, stats: Stats, timeout: float = 30) -> None:
+        self.base_url = base_url.rstrip('/')
+        self.stats = stats
+        self.timeout = timeout
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar())
+        )
+
+    def request(
+        self,
+        path: str,
+        name: Optional[str] = None,
+        data: Optional[Dict[str, str]] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, bytes]:
+        """
+        Make GET (POST if data is given) request, return status and body
+        """
+        body = urllib.parse.urlencode(data).encode('utf-8') if data else None
+        req = urllib.request.Request(
+            self.base_url + path, data=body, headers=headers or {}
+        )
+        start = time.perf_counter()
+        try:
+            with self.opener.open(req, timeout=self.timeout) as response:
+                status, content = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, content = e.code, e.read()
+        except (urllib.error.URLError, OSError):
+            status, content = 0, b''
+        self.stats.add(
+            name or path, time.perf_counter() - start, not 200 <= status < 400
+        )
+        return status, content
+
+    def get(self, path: str, name: Optional[str] = None) -> Tuple[int, bytes]:
+        return self.request(path, name=name)
+
+    def post_form(
+        self, path: str, data: Dict[str, str], name: Optional[str] = None
+    ) -> Tuple[int, bytes]:
+        """
+        Submit the form on the page with its CSRF token
+        """
+        status, content = self.get(path, name=name)
+        match = CSRF_TOKEN_RE.search(content.decode('utf-8', 'replace'))
+        if match is not None:
+            data = dict(data, csrf_token=match.group(1))
+        return self.request(path, name=name, data=data)
+
+
+#
+# Scenarios
+#
+
+
+class Context(NamedTuple):
+    """
+    URLs and accounts discovered on the site before the test
+    """
+
+    post_urls: List[str]
+    tag_urls: List[str]
+    post_ids: List[int]
+    user_ids: List[int]
+
+
+def discover(base_url: str) -> Context:
+    """
+    Collect post and tag URLs and authors from the home page and the API
+    """
+    client = Client(base_url, Stats())
+    _, html = client.get('/')
+    page = html.decode('utf-8', 'replace')
+    _, api = client.get('/api/v1.0/posts/')
+    try:
+        posts = json.loads(api.decode('utf-8')).get('posts', [])
+    except ValueError:
+        posts = []
+    post_ids = [int(post['url'].rstrip('/').rsplit('/', 1)[1]) for post in posts]
+    user_ids = [int(id) for id in USER_ID_RE.findall(json.dumps(posts))]
+    return Context(
+        post_urls=sorted(set(POST_URL_RE.findall(page))),
+        tag_urls=sorted(set(TAG_URL_RE.findall(page))),
+        post_ids=post_ids,
+        user_ids=sorted(set(user_ids)),
+    )
+
+
+def task(weight: int = 1) -> Callable:
+    """
+    Mark scenario's method as a task picked with the given relative weight
+    """
+
+    def decorator(f):
+        f.task_weight = weight
+        return f
+
+    return decorator
+
+
+class Scenario:
+    """Behaviour of a virtual user, Locust-style.
+
+    Virtual users are spread over the scenarios by their weights. Each one
+    runs on_start() once, then picks the tasks by their weights with think
+    time of `wait_time` seconds range in between.
+    """
+
+    weight = 1
+    wait_time = (0.5, 2.0)
+
+    def __init__(self, client: Client, context: Context, rng: random.Random) -> None:
+        self.client = client
+        self.context = context
+        self.rng = rng
+        self.tasks = [
+            getattr(self, name)
+            for name in dir(self)
+            if hasattr(getattr(self, name), 'task_weight')
+        ]
+        self.weights = [t.task_weight for t in self.tasks]
+
+    def on_start(self) -> None:
+        pass
+
+    def run_task(self) -> None:
+        self.rng.choices(self.tasks, weights=self.weights)[0]()
+
+    def wait(self) -> float:
+        return self.rng.uniform(*self.wait_time)
+
+    def choice(self, items: Sequence[Any], default: Any) -> Any:
+        return self.rng.choice(items) if items else default
+
+
+class AnonymousReader(Scenario):
+    weight = 8
+
+    @task(5)
+    def index(self):
+        self.client.get('/', name='main.index')
+
+    @task(2)
+    def index_page(self):
+        self.client.get('/?page={}'.format(self.rng.randint(2, 10)), name='main.index')
+
+    @task(5)
+    def post(self):
+        self.client.get(self.choice(self.context.post_urls, '/'), name='main.post')
+
+    @task(2)
+    def tag(self):
+        self.client.get(self.choice(self.context.tag_urls, '/'), name='main.tag')
+
+
+class Commenter(Scenario):
+    """
+    Logs in as one of the users generated by the seed command and comments
+    """
+
+    weight = 1
+
+    def on_start(self):
+        user_id = self.choice(self.context.user_ids, 1)
+        self.client.post_form(
+            '/auth/login',
+            {'email': EMAIL.format(user_id), 'password': PASSWORD},
+            name='auth.login',
+        )
+
+    @task(5)
+    def index(self):
+        self.client.get('/', name='main.index [user]')
+
+    @task(5)
+    def post(self):
+        url = self.choice(self.context.post_urls, '/')
+        self.client.get(url, name='main.post [user]')
+
+    @task(1)
+    def comment(self):
+        url = self.choice(self.context.post_urls, None)
+        if url is not None:
+            self.client.post_form(
+                url,
+                {'body': 'Load test comment {}'.format(self.rng.random())},
+                name='main.post [comment]',
+            )
+
+
+class ApiClient(Scenario):
+    weight = 2
+    wait_time = (0.1, 1.0)
+
+    @task(5)
+    def posts(self):
+        self.client.get('/api/v1.0/posts/', name='api.get_posts')
+
+    @task(3)
+    def post(self):
+        id = self.choice(self.context.post_ids, 1)
+        self.client.get('/api/v1.0/posts/{}'.format(id), name='api.get_post')
+
+    @task(2)
+    def comments(self):
+        id = self.choice(self.context.post_ids, 1)
+        self.client.get(
+            '/api/v1.0/posts/{}/comments/'.format(id), name='api.get_post_comments'
+        )
+
+    @task(1)
+    def tags(self):
+        self.client.get('/api/v1.0/tags/', name='api.get_tags')
+
+
+SCENARIOS = (AnonymousReader, Commenter, ApiClient)
+
+
+#
+# Runner
+#
+
+
+class Result(NamedTuple):
+    name: str
+    requests: int
+    failures: int
+    rps: float
+    p50: float
+    p95: float
+    p99: float
+
+
+def run_load(
+    base_url: str,
+    users: int = 20,
+    duration: float = 60,
+    scenarios: Sequence[type] = SCENARIOS,
+    seed: Optional[int] = None,
+) -> List[Result]:
+    """Run virtual users for `duration` seconds, return results by request.
+
+    The last row sums up all the requests. Users are started within the
+    first second to avoid the thundering herd.
+    """
+    context = discover(base_url)
+    stats = Stats()
+    master = random.Random(seed)
+    deadline = time.monotonic() + duration
+
+    def user(scenario_class: type, rng: random.Random, delay: float) -> None:
+        time.sleep(delay)
+        scenario = scenario_class(Client(base_url, stats), context, rng)
+        scenario.on_start()
+        while time.monotonic() < deadline:
+            scenario.run_task()
+            time.sleep(min(scenario.wait(), max(deadline - time.monotonic(), 0)))
+
+    picked = master.choices(scenarios, weights=[s.weight for s in scenarios], k=users)
+    threads = [
+        threading.Thread(
+            target=user,
+            args=(scenario, random.Random(master.random()), i / users),
+            daemon=True,
+        )
+        for i, scenario in enumerate(picked)
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    def result(name: str, latencies: List[float], failures: int) -> Result:
+        return Result(
+            name=name,
+            requests=len(latencies),
+            failures=failures,
+            rps=len(latencies) / elapsed,
+            p50=percentile(latencies, 50),
+            p95=percentile(latencies, 95),
+            p99=percentile(latencies, 99),
+        )
+
+    results = [
+        result(name, latencies, stats.failures[name])
+        for name, latencies in sorted(stats.latencies.items())
+    ]
+    results.append(
+        result(
+            'total',
+            list(itertools.chain.from_iterable(stats.latencies.values())),
+            sum(stats.failures.values()),
+        )
+    )
+    return results
+
+
+def format_results(results: Sequence[Result], first_column: str = 'request') -> str:
+    """
+    Return results as a plain text table, latencies in milliseconds
+    """
+    header = (first_column, 'reqs', 'fails', 'req/s', 'p50', 'p95', 'p99')
+    rows = [
+        (
+            r.name,
+            str(r.requests),
+            str(r.failures),
+            '{:.1f}'.format(r.rps),
+            '{:.1f}'.format(r.p50 * 1000),
+            '{:.1f}'.format(r.p95 * 1000),
+            '{:.1f}'.format(r.p99 * 1000),
+        )
+        for r in results
+    ]
+    return format_table(header, rows)
+
+
+#
+# uWSGI profiles
+#
+
+
+def profile_size(ini: str, section: str) -> Tuple[int, int]:
+    """
+    Return workers and threads of the uWSGI config section
+    """
+    parser = configparser.ConfigParser(interpolation=None, strict=False)
+    parser.read(ini)
+    while True:
+        options = parser[section]
+        if 'workers' in options and 'threads' in options:
+            return int(options['workers']), int(options['threads'])
+        section = options['ini'].lstrip(':')
+
+
+def wait_for_server(base_url: str, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(base_url, timeout=1).close()
+            return
+        except urllib.error.HTTPError:
+            return
+        except (urllib.error.URLError, OSError):
+            time.sleep(0.5)
+    raise RuntimeError('Server {} is not up in {}s'.format(base_url, timeout))
+
+
+def sweep(
+    config_name: str,
+    sections: Sequence[str],
+    ini: str,
+    base_url: str = 'http://127.0.0.1:8080',
+    users: int = 20,
+    duration: float = 60,
+    warmup: float = 5,
+    seed: Optional[int] = None,
+    echo: Callable[[str], Any] = print,
+) -> List[Result]:
+    """Load test the app served by each of the uWSGI sections in turn.
+
+    The app is booted with `pili uwsgi`, so that the database and Redis
+    the app connects to are set by the usual environment variables. Return
+    totals by section, named after the section and its workers and threads.
+    """
+    totals = []
+    for section in sections:
+        workers, threads = profile_size(ini, section)
+        name = '{} ({}x{})'.format(section, workers, threads)
+        echo('---> Booting uWSGI section {}'.format(name))
+        # own process group, as uWSGI is exec'ed by a shell
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                '-m',
+                'pili.entrypoints.commands',
+                '--config',
+                config_name,
+                'uwsgi',
+                '--section',
+                section,
+                '--ini',
+                ini,
+            ],
+            start_new_session=True,
+        )
+        try:
+            wait_for_server(base_url)
+            if warmup:
+                run_load(base_url, users=users, duration=warmup, seed=seed)
+            results = run_load(base_url, users=users, duration=duration, seed=seed)
+            echo(format_results(results))
+            totals.append(results[-1]._replace(name=name))
+        finally:
+            try:
+                os.killpg(process.pid, signal.SIGINT)
+            except ProcessLookupError:
+                pass
+            process.wait()
+    return totals
@@ -1,8 +1,21 @@
 from flask import jsonify, render_template, request
 
+from pili.exceptions import ValidationError
 from pili.main import main
 
 
+@main.app_errorhandler(ValidationError)
+def bad_request(e):
+    if (
+        request.accept_mimetypes.accept_json
+        and not request.accept_mimetypes.accept_html
+    ):
+        response = jsonify({'error': e.message})
+        response.status_code = 400
+        return response
+    return e.message, 400
+
+
 @main.app_errorhandler(403)
 def forbidden(e):
     if (
@@ -10,16 +10,17 @@ from flask import (
     url_for,
 )
 from flask_login import current_user, login_required
-from flask_sqlalchemy import get_debug_queries
 
 from pili.app import db
 from pili.ctrl.forms import CsrfTokenForm
-from pili.decorators import permission_required
+from pili.decorators import cache_anonymous_page, permission_required
+from pili.loaders import load_posts
 from pili.main import main
 from pili.main.forms import CommentForm
 from pili.models import (
     Category,
     Comment,
+    Follow,
     Like,
     Message,
     MessageAck,
@@ -28,24 +29,28 @@ from pili.models import (
     Tag,
     User,
 )
+from pili.pagination import paginate
+from pili.timeline import paginate_followed
 
 
 @main.route('/')
+@cache_anonymous_page(
+    tags=['posts', 'comments', 'likes', 'tags', 'categories'],
+    query=('page', 'cursor', 'count'),
+)
 def index():
-    page = request.args.get('page', 1, type=int)
     show_followed = False
     if current_user.is_authenticated:
         show_followed = bool(request.cookies.get('show_followed', ''))
+    per_page = current_app.config['PILI_POSTS_PER_PAGE']
     if show_followed:
-        query = current_user.followed_posts
+        pagination = paginate_followed(current_user, per_page)
     else:
-        query = Post.query
-    pagination = query.order_by(Post.timestamp.desc()).paginate(
-        page, per_page=current_app.config['PILI_POSTS_PER_PAGE'], error_out=False
-    )
-    posts = pagination.items
-    tags = Tag.query.all()
-    categories = Category.query.all()
+        pagination = paginate(Post.query, Post.timestamp, Post.id, per_page)
+    posts = load_posts(pagination.items, current_user)
+    # queried on rendering only, unless sidebar fragments are cached
+    tags = Tag.query
+    categories = Category.query
     return render_template(
         'main/index.html',
         posts=posts,
@@ -57,6 +62,9 @@ def index():
 
 
 @main.route('/tag/<alias>')
+@cache_anonymous_page(
+    tags=lambda alias: ['posts', 'comments', 'likes', 'tag:{}'.format(alias)]
+)
 def tag(alias):
     tag = Tag.query.filter_by(alias=alias).first_or_404()
     page = request.args.get('page', 1, type=int)
@@ -71,7 +79,7 @@ def tag(alias):
     pagination = query.order_by(Post.timestamp.desc()).paginate(
         page, per_page=current_app.config['PILI_POSTS_PER_PAGE'], error_out=False
     )
-    posts = pagination.items
+    posts = load_posts(pagination.items, current_user)
     return render_template(
         'main/tag.html',
         tag=tag,
@@ -82,13 +90,16 @@ def tag(alias):
 
 
 @main.route('/user/<username>/profile')
+@cache_anonymous_page(
+    tags=lambda username: ['posts', 'comments', 'likes', 'user:{}'.format(username)]
+)
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
     page = request.args.get('page', 1, type=int)
     pagination = user.posts.order_by(Post.timestamp.desc()).paginate(
         page, per_page=current_app.config['PILI_POSTS_PER_PAGE'], error_out=False
     )
-    posts = pagination.items
+    posts = load_posts(pagination.items, current_user)
     return render_template(
         'main/user.html', user=user, posts=posts, pagination=pagination
     )
@@ -98,10 +109,13 @@ def user(username):
 @main.route(
     '/<category>/<int:id>/<alias>/reply/<int:parent_id>', methods=['GET', 'POST']
 )
+@cache_anonymous_page(tags=lambda id, **kwargs: ['likes', 'post:{}'.format(id)])
 def post(category, id, alias, parent_id=None):
     # https://stackoverflow.com/questions/17873820/flask-url-for-with-multiple-parameters
     post = Post.query.get_or_404(id)
-    form = CommentForm()
+    # the form's CSRF token would store a session for anonymous visitors,
+    # keeping the page out of the cache
+    form = CommentForm() if current_user.can(Permission.COMMENT) else None
     recipient = None
     if parent_id:
         parent_comment = Comment.query.get_or_404(parent_id)
@@ -118,7 +132,7 @@ def post(category, id, alias, parent_id=None):
                     page=-1,
                 )
             )
-    if form.validate_on_submit():
+    if form is not None and form.validate_on_submit():
         screened = current_app.config['PILI_COMMENTS_SCREENING']
         comment = Comment(
             body=form.body.data,
@@ -163,11 +177,11 @@ def post(category, id, alias, parent_id=None):
     )
     comments = pagination.items
     # if it's a reply, then prepopulate the form
-    if parent_id:
+    if parent_id and form is not None:
         form.body.data = parent_comment.author.username + ', '
     return render_template(
         'main/post.html',
-        posts=[post],
+        posts=load_posts([post], current_user),
         form=form,
         comments=comments,
         pagination=pagination,
@@ -357,6 +371,9 @@ def reply_mark_read(id):
 
 
 @main.route('/category/<alias>', methods=['GET'])
+@cache_anonymous_page(
+    tags=lambda alias: ['posts', 'comments', 'likes', 'category:{}'.format(alias)]
+)
 def category(alias):
     category = Category.query.filter_by(alias=alias).first_or_404()
     page = request.args.get('page', 1, type=int)
@@ -370,7 +387,7 @@ def category(alias):
     pagination = query.order_by(Post.timestamp.desc()).paginate(
         page, per_page=current_app.config['PILI_POSTS_PER_PAGE'], error_out=False
     )
-    posts = pagination.items
+    posts = load_posts(pagination.items, current_user)
     return render_template(
         'main/category.html',
         category=category,
@@ -399,7 +416,7 @@ def category_tag(cat_alias, tag_alias):
             page, per_page=current_app.config['PILI_POSTS_PER_PAGE'], error_out=False
         )
     )
-    posts = pagination.items
+    posts = load_posts(pagination.items, current_user)
     return render_template(
         'main/category_tag.html',
         category=category,
@@ -448,9 +465,11 @@ def followers(username):
     if user is None:
         flash('Invalid user.', 'warning')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followers.paginate(
-        page, per_page=current_app.config['PILI_FOLLOWERS_PER_PAGE'], error_out=False
+    pagination = paginate(
+        user.followers,
+        Follow.timestamp,
+        Follow.follower_id,
+        current_app.config['PILI_FOLLOWERS_PER_PAGE'],
     )
     follows = [
         {'user': item.follower, 'timestamp': item.timestamp}
@@ -472,9 +491,11 @@ def followed_by(username):
     if user is None:
         flash('Invalid user.', 'warning')
         return redirect(url_for('.index'))
-    page = request.args.get('page', 1, type=int)
-    pagination = user.followed.paginate(
-        page, per_page=current_app.config['PILI_FOLLOWERS_PER_PAGE'], error_out=False
+    pagination = paginate(
+        user.followed,
+        Follow.timestamp,
+        Follow.followed_id,
+        current_app.config['PILI_FOLLOWERS_PER_PAGE'],
     )
     follows = [
         {'user': item.followed, 'timestamp': item.timestamp}
@@ -704,14 +725,3 @@ def server_shutdown():
         abort(500)
     shutdown()
     return 'Shutting down...'
-
-
-@main.after_app_request
-def after_request(response):
-    for query in get_debug_queries():
-        if query.duration >= current_app.config['PILI_SLOW_DB_QUERY_TIME']:
-            current_app.logger.warning(
-                'Slow query: %s\nParameters: %s\nDuration: %fs\nContext: %s\n'
-                % (query.statement, query.parameters, query.duration, query.context)
-            )
-    return response
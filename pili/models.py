@@ -1,16 +1,25 @@
 import hashlib
 from datetime import datetime
 
-import bleach
 from flask import current_app, request, url_for
 from flask_login import AnonymousUserMixin, UserMixin
 from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
-from markdown import markdown
+from redis import RedisError
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.orm.util import identity_key
 from werkzeug.security import check_password_hash, generate_password_hash
 
-from pili.app import db, login_manager
+from pili.app import db, login_manager, redis
 from pili.exceptions import ValidationError
 from pili.filters import generate_password
+from pili.rendering import (
+    digest,
+    render,
+    render_async_required,
+    render_body_async,
+    render_plain,
+)
 
 
 class Permission:
@@ -141,6 +150,14 @@ class Like(db.Model):
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow())
 
+    def cache_tags(self):
+        tags = ['likes']
+        if self.post_id is not None:
+            tags.append('post:{}'.format(self.post_id))
+        if self.comment_id is not None:
+            tags.append('comment:{}'.format(self.comment_id))
+        return tags
+
     def __repr__(self):
         msg_prefix = "<User {user} likes".format(user=self.user_id)
         if self.post_id:
@@ -172,6 +189,7 @@ class Comment(db.Model):
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     recipient_id = db.Column(db.Integer, db.ForeignKey('users.id'))
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'))
+    like_count = db.Column(db.Integer, default=0, server_default='0')
 
     # http://docs.sqlalchemy.org/en/latest/orm/join_conditions.html
     # there several fields in Reply class whose foreign_keys are
@@ -245,12 +263,8 @@ class Comment(db.Model):
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = current_app.config['PILI_ALLOWED_COMMENT_TAGS']
-        target.body_html = bleach.linkify(
-            bleach.clean(
-                markdown(value, output_format='html'), tags=allowed_tags, strip=True
-            )
-        )
+        if value != oldvalue or target.body_html is None:
+            target.body_html = render(value, profile='comment')
 
     def to_json(self):
         json_comment = {
@@ -270,6 +284,13 @@ class Comment(db.Model):
             raise ValidationError('comment does not have a body')
         return Comment(body=body)
 
+    def cache_tags(self):
+        return [
+            'comments',
+            'comment:{}'.format(self.id),
+            'post:{}'.format(self.post_id),
+        ]
+
     def __repr__(self):
         return '<Comment %r>' % self.id
 
@@ -301,16 +322,8 @@ class Message(db.Model):
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = current_app.config['PILI_ALLOWED_TAGS']
-        allowed_attrs = current_app.config['PILI_ALLOWED_ATTRIBUTES']
-        target.body_html = bleach.linkify(
-            bleach.clean(
-                markdown(value, output_format='html'),
-                tags=allowed_tags,
-                attributes=allowed_attrs,
-                strip=True,
-            )
-        )
+        if value != oldvalue or target.body_html is None:
+            target.body_html = render(value, profile='html')
 
     def __repr__(self):
         return '<Message %r by %r>' % (self.id, self.author.username)
@@ -347,6 +360,10 @@ class User(UserMixin, db.Model):
     last_seen = db.Column(db.DateTime(), default=datetime.utcnow)
     invited = db.Column(db.Boolean)
     avatar_hash = db.Column(db.String(32))
+    post_count = db.Column(db.Integer, default=0, server_default='0')
+    # self-follows are counted too
+    follower_count = db.Column(db.Integer, default=0, server_default='0')
+    followed_count = db.Column(db.Integer, default=0, server_default='0')
     posts = db.relationship('Post', backref='author', lazy='dynamic')
     categories = db.relationship('Category', backref='author', lazy='dynamic')
     tags = db.relationship('Tag', backref='author', lazy='dynamic')
@@ -630,7 +647,7 @@ class User(UserMixin, db.Model):
             'member_since': self.member_since,
             'last_seen': self.last_seen,
             'posts': url_for('api.get_user_posts', id=self.id, _external=True),
-            'post_count': self.posts.count(),
+            'post_count': self.post_count,
         }
         return json_user
 
@@ -647,6 +664,9 @@ class User(UserMixin, db.Model):
             return None
         return User.query.get(data['id'])
 
+    def cache_tags(self):
+        return ['user:{}'.format(self.username)]
+
     def __repr__(self):
         return '<User %r>' % self.username
 
@@ -684,6 +704,9 @@ class Tagification(db.Model):
     tag_id = db.Column(db.Integer, db.ForeignKey('tags.id'), primary_key=True)
     post_id = db.Column(db.Integer, db.ForeignKey('posts.id'), primary_key=True)
 
+    def cache_tags(self):
+        return ['tags', 'post:{}'.format(self.post_id)]
+
     def __repr__(self):
         return '<Tagification: post %r contains tag %r>' % (self.post_id, self.tag_id)
 
@@ -691,16 +714,23 @@ class Tagification(db.Model):
 class Post(db.Model):
     __tablename__ = 'posts'
     id = db.Column(db.Integer, primary_key=True)
-    author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    # active history keeps the old value on reassignment for the post counters
+    author_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('users.id')), active_history=True
+    )
     title = db.Column(db.String(128))
     alias = db.Column(db.String(128))
     description = db.Column(db.String(160))
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
     body = db.Column(db.Text)
     body_html = db.Column(db.Text)
+    # body_html holds plain text fallback until async rendering is done
+    body_html_pending = db.Column(db.Boolean, default=False)
     image_id = db.Column(db.Integer, db.ForeignKey('uploads.id'))
     featured = db.Column(db.Boolean, default=False, index=True)
     commenting = db.Column(db.Boolean, index=True)
+    like_count = db.Column(db.Integer, default=0, server_default='0')
+    comment_count = db.Column(db.Integer, default=0, server_default='0')
 
     # 1-to-many Post/Comment
     # https://stackoverflow.com/questions/18677309/flask-sqlalchemy-relationship-error
@@ -720,7 +750,9 @@ class Post(db.Model):
         cascade='all, delete-orphan',
     )
     # 1-to-many relationship Category/Post
-    category_id = db.Column(db.Integer, db.ForeignKey('categories.id'))
+    category_id = db.column_property(
+        db.Column(db.Integer, db.ForeignKey('categories.id')), active_history=True
+    )
     # many-to-many relationship Tag/Post
     tags = db.relationship(
         'Tag',
@@ -753,26 +785,25 @@ class Post(db.Model):
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = current_app.config['PILI_ALLOWED_TAGS']
-        allowed_attrs = current_app.config['PILI_ALLOWED_ATTRIBUTES']
-        target.body_html = bleach.linkify(
-            bleach.clean(
-                markdown(value, output_format='html'),
-                tags=allowed_tags,
-                attributes=allowed_attrs,
-                strip=True,
-            )
-        )
+        if value == oldvalue and target.body_html is not None:
+            return
+        if render_async_required(value):
+            target.body_html = render_plain(value)
+            target.body_html_pending = True
+        else:
+            target.body_html = render(value, profile='html')
+            target.body_html_pending = False
 
     def to_json(self):
         json_post = {
             'url': url_for('api.get_post', id=self.id, _external=True),
             'body': self.body,
             'body_html': self.body_html,
+            'body_html_pending': bool(self.body_html_pending),
             'timestamp': self.timestamp,
             'author': url_for('api.get_user', id=self.author_id, _external=True),
             'comments': url_for('api.get_post_comments', id=self.id, _external=True),
-            'comment_count': self.comments.count(),
+            'comment_count': self.comment_count,
         }
         return json_post
 
@@ -783,6 +814,14 @@ class Post(db.Model):
             raise ValidationError('post does not have a body')
         return Post(body=body)
 
+    def cache_tags(self):
+        tags = ['posts', 'post:{}'.format(self.id)]
+        # categories' post counters change with raw UPDATEs, see _count_post
+        category_history = db.inspect(self).attrs.category_id.history
+        if self.category_id is not None or category_history.deleted:
+            tags.append('categories')
+        return tags
+
     def __repr__(self):
         return '<Post %r>' % self.alias
 
@@ -803,6 +842,7 @@ class Tag(db.Model):
     title = db.Column(db.String(64))
     alias = db.Column(db.String(64), unique=True)
     author_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    post_count = db.Column(db.Integer, default=0, server_default='0')
 
     def to_json(self):
         json_tag = {
@@ -811,10 +851,13 @@ class Tag(db.Model):
             'title': self.title,
             'alias': self.alias,
             'posts': url_for('api.get_tag_posts', alias=self.alias, _external=True),
-            'post_count': self.posts.count(),
+            'post_count': self.post_count,
         }
         return json_tag
 
+    def cache_tags(self):
+        return ['tags', 'tag:{}'.format(self.alias)]
+
     def __repr__(self):
         return '<Tag %r>' % self.alias
 
@@ -834,6 +877,7 @@ class Category(db.Model):
     image_id = db.Column(db.Integer, db.ForeignKey('uploads.id'))
     featured = db.Column(db.Boolean, default=False, index=True)
     timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    post_count = db.Column(db.Integer, default=0, server_default='0')
     posts = db.relationship(
         'Post',
         backref='category',
@@ -844,16 +888,11 @@ class Category(db.Model):
 
     @staticmethod
     def on_changed_body(target, value, oldvalue, initiator):
-        allowed_tags = current_app.config['PILI_ALLOWED_TAGS']
-        allowed_attrs = current_app.config['PILI_ALLOWED_ATTRIBUTES']
-        target.body_html = bleach.linkify(
-            bleach.clean(
-                markdown(value, output_format='html'),
-                tags=allowed_tags,
-                attributes=allowed_attrs,
-                strip=True,
-            )
-        )
+        if value != oldvalue or target.body_html is None:
+            target.body_html = render(value, profile='html')
+
+    def cache_tags(self):
+        return ['categories', 'category:{}'.format(self.alias)]
 
     def __repr__(self):
         return '<Category %r>' % self.alias
@@ -907,3 +946,247 @@ class Upload(db.Model):
 
     def __repr__(self):
         return '<Upload %r>' % self.filename
+
+
+#
+# Denormalized counters
+#
+# Counter columns are updated within the same transaction as the rows they count,
+# so that reads don't need COUNT(*) queries growing with the content.
+# Bulk Query.delete() and Query.update() bypass mapper events: delete counted
+# rows with db.session.delete() or run `pili recount` afterwards.
+#
+
+
+def change_counter(target, connection, model, id, attr, delta, related=None):
+    """Increment counter column of the model's row with given id by delta
+
+    Counter of the instance already loaded into the session is updated too,
+    so that it doesn't go stale until the session is expired. The instance is
+    looked up in the target's related attribute first, as objects inserted
+    within the same flush are not in the identity map yet.
+    """
+    if id is None:
+        return
+    connection.execute(
+        model.__table__.update()
+        .where(model.__table__.c.id == id)
+        .values({attr: getattr(model.__table__.c, attr) + delta})
+    )
+    instance = target.__dict__.get(related) if related else None
+    if instance is None or instance.id != id:
+        session = object_session(target)
+        if session is None:
+            return
+        instance = session.identity_map.get(identity_key(model, id))
+    if instance is not None and attr in instance.__dict__:
+        set_committed_value(instance, attr, (instance.__dict__[attr] or 0) + delta)
+
+
+def _count_like(target, connection, delta):
+    change_counter(
+        target, connection, Post, target.post_id, 'like_count', delta, 'post'
+    )
+    change_counter(
+        target, connection, Comment, target.comment_id, 'like_count', delta, 'comment'
+    )
+
+
+def _count_comment(target, connection, delta):
+    change_counter(
+        target, connection, Post, target.post_id, 'comment_count', delta, 'post'
+    )
+
+
+def _count_tagification(target, connection, delta):
+    change_counter(target, connection, Tag, target.tag_id, 'post_count', delta)
+
+
+def _count_follow(target, connection, delta):
+    change_counter(
+        target,
+        connection,
+        User,
+        target.followed_id,
+        'follower_count',
+        delta,
+        'followed',
+    )
+    change_counter(
+        target,
+        connection,
+        User,
+        target.follower_id,
+        'followed_count',
+        delta,
+        'follower',
+    )
+
+
+def _count_post(target, connection, delta):
+    change_counter(
+        target,
+        connection,
+        Category,
+        target.category_id,
+        'post_count',
+        delta,
+        'category',
+    )
+    change_counter(
+        target, connection, User, target.author_id, 'post_count', delta, 'author'
+    )
+
+
+def _recount_post_owners(mapper, connection, target):
+    """Move post between categories' and authors' counters on reassignment"""
+    state = db.inspect(target)
+    for attr, model, related in (
+        ('category_id', Category, 'category'),
+        ('author_id', User, 'author'),
+    ):
+        history = state.attrs[attr].history
+        if not history.has_changes():
+            continue
+        for old_id in history.deleted:
+            change_counter(target, connection, model, old_id, 'post_count', -1)
+        for new_id in history.added:
+            change_counter(target, connection, model, new_id, 'post_count', 1, related)
+
+
+def _listen_counter(model, count_func):
+    """Register listeners calling count_func on the model's inserts and deletes
+
+    Deletes are counted before the row is gone, while its foreign keys can
+    still be loaded if the instance has been expired.
+    """
+
+    def on_insert(mapper, connection, target):
+        count_func(target, connection, 1)
+
+    def on_delete(mapper, connection, target):
+        count_func(target, connection, -1)
+
+    db.event.listen(model, 'after_insert', on_insert)
+    db.event.listen(model, 'before_delete', on_delete)
+
+
+_listen_counter(Like, _count_like)
+_listen_counter(Comment, _count_comment)
+_listen_counter(Tagification, _count_tagification)
+_listen_counter(Follow, _count_follow)
+_listen_counter(Post, _count_post)
+db.event.listen(Post, 'after_update', _recount_post_owners)
+
+
+def recount_counters():
+    """Recompute all denormalized counters from scratch.
+
+    >>> recount_counters()
+    """
+    counters = [
+        (Post, Post.like_count, Like.post_id),
+        (Post, Post.comment_count, Comment.post_id),
+        (Comment, Comment.like_count, Like.comment_id),
+        (Tag, Tag.post_count, Tagification.tag_id),
+        (Category, Category.post_count, Post.category_id),
+        (User, User.post_count, Post.author_id),
+        (User, User.follower_count, Follow.followed_id),
+        (User, User.followed_count, Follow.follower_id),
+    ]
+    for model, counter, foreign_key in counters:
+        count = (
+            db.select([db.func.count()])
+            .where(foreign_key == model.id)
+            .correlate(model.__table__)
+            .as_scalar()
+        )
+        db.session.query(model).update({counter: count}, synchronize_session=False)
+    db.session.commit()
+
+
+#
+# Async rendering
+#
+
+PENDING_RENDERS = 'pili_pending_renders'
+
+
+def _schedule_render(mapper, connection, target):
+    """Remember the post whose body is to be rendered once committed"""
+    if not target.body_html_pending:
+        return
+    if not db.inspect(target).attrs.body.history.has_changes():
+        return
+    pending = object_session(target).info.setdefault(PENDING_RENDERS, {})
+    pending[target.id] = digest(target.body)
+
+
+def _enqueue_renders(session):
+    """Enqueue rendering tasks for the posts committed in pending state
+
+    Tasks are enqueued after the commit, so that the worker sees the row.
+    Should the broker be unavailable, the post keeps plain text fallback.
+    """
+    pending = session.info.pop(PENDING_RENDERS, {})
+    for id, body_digest in pending.items():
+        try:
+            render_body_async.apply_async(args=['Post', id, body_digest, 'html'])
+        except Exception:
+            current_app.logger.exception(
+                'Failed to enqueue rendering of Post {}'.format(id)
+            )
+
+
+def _discard_renders(session, previous_transaction):
+    session.info.pop(PENDING_RENDERS, None)
+
+
+db.event.listen(Post, 'after_insert', _schedule_render)
+db.event.listen(Post, 'after_update', _schedule_render)
+db.event.listen(db.session, 'after_commit', _enqueue_renders)
+db.event.listen(db.session, 'after_soft_rollback', _discard_renders)
+
+
+#
+# Cache invalidation
+#
+
+CACHE_TAGS = 'pili_cache_tags'
+
+
+def _collect_cache_tags(session, flush_context):
+    """Remember cache tags of the instances inserted, updated or deleted
+
+    New, dirty and deleted collections still hold pre-flush state here,
+    while primary keys of the new instances are already known.
+    """
+    tags = session.info.setdefault(CACHE_TAGS, set())
+    for instance in session.new | session.deleted:
+        if hasattr(instance, 'cache_tags'):
+            tags.update(instance.cache_tags())
+    for instance in session.dirty:
+        if hasattr(instance, 'cache_tags') and session.is_modified(instance):
+            tags.update(instance.cache_tags())
+
+
+def _invalidate_cache_tags(session):
+    """Purge cached entries depending on the committed changes"""
+    tags = session.info.pop(CACHE_TAGS, None)
+    if not tags or current_app.config.get('CACHE_DISABLE'):
+        return
+    try:
+        redis.invalidate_tags(sorted(tags))
+    except RedisError:
+        current_app.logger.exception(
+            'Redis connection failed while invalidating tags: {}'.format(tags)
+        )
+
+
+def _discard_cache_tags(session, previous_transaction):
+    session.info.pop(CACHE_TAGS, None)
+
+
+db.event.listen(db.session, 'after_flush', _collect_cache_tags)
+db.event.listen(db.session, 'after_commit', _invalidate_cache_tags)
+db.event.listen(db.session, 'after_soft_rollback', _discard_cache_tags)
@@ -0,0 +1,195 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from flask import current_app, request, url_for
+from sqlalchemy import and_, or_
+
+from pili.exceptions import ValidationError
+
+#
+# Cursor encoding
+#
+
+NEXT = 'n'
+PREV = 'p'
+
+
+def encode_cursor(timestamp: datetime, id: Any, direction: str = NEXT) -> str:
+    """
+    Return opaque URL-safe cursor pointing to the row with given sort key
+    """
+    payload = json.dumps([direction, timestamp.isoformat(), id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: str) -> Tuple[str, datetime, Any]:
+    """
+    Return direction, timestamp and id encoded in the cursor
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        payload = base64.urlsafe_b64decode((cursor + padding).encode('ascii'))
+        direction, timestamp, id = json.loads(payload.decode('utf-8'))
+        if direction not in (NEXT, PREV):
+            raise ValueError(direction)
+        return direction, datetime.fromisoformat(timestamp), id
+    except (TypeError, ValueError, UnicodeError):
+        raise ValidationError('Invalid pagination cursor')
+
+
+#
+# Pagination
+#
+
+
+class KeysetPagination:
+    """Cursor-based pagination over (timestamp, id) sort key.
+
+    Unlike Query.paginate() there is neither OFFSET, nor COUNT(*) query
+    (unless total is explicitly requested), so that any page costs the same
+    as the first one given an index on the sort key.
+
+    The interface mimics Flask-SQLAlchemy's Pagination as close as possible:
+    items, has_prev, has_next and total are available, while page numbers
+    are replaced with prev_cursor and next_cursor.
+    """
+
+    keyset = True
+
+    def __init__(
+        self,
+        query,
+        timestamp_column,
+        id_column,
+        cursor: Optional[str] = None,
+        per_page: int = 20,
+        descending: bool = True,
+        count: bool = False,
+    ) -> None:
+        self.query = query
+        self.timestamp_column = timestamp_column
+        self.id_column = id_column
+        self.cursor = cursor or None
+        self.per_page = per_page
+        self.descending = descending
+        self.total = query.order_by(None).count() if count else None
+
+        direction, items = NEXT, []  # type: str, List[Any]
+        if self.cursor is None:
+            items = self._fetch(query, forward=True)
+            self.has_prev = False
+            self.has_next = len(items) > per_page
+        else:
+            direction, timestamp, id = decode_cursor(self.cursor)
+            forward = direction == NEXT
+            items = self._fetch(
+                query.filter(self._beyond(timestamp, id, forward)), forward
+            )
+            if forward:
+                self.has_prev = True
+                self.has_next = len(items) > per_page
+            else:
+                self.has_prev = len(items) > per_page
+                self.has_next = True
+
+        items = items[:per_page]
+        if direction == PREV:
+            items.reverse()
+        self.items = items
+
+    def _beyond(self, timestamp: datetime, id: Any, forward: bool):
+        """
+        Return criterion for the rows following the sort key in given direction
+        """
+        ts, pk = self.timestamp_column, self.id_column
+        if forward == self.descending:
+            return or_(ts < timestamp, and_(ts == timestamp, pk < id))
+        return or_(ts > timestamp, and_(ts == timestamp, pk > id))
+
+    def _fetch(self, query, forward: bool) -> List[Any]:
+        ts, pk = self.timestamp_column, self.id_column
+        if forward == self.descending:
+            ordering = (ts.desc(), pk.desc())
+        else:
+            ordering = (ts.asc(), pk.asc())
+        return query.order_by(None).order_by(*ordering).limit(self.per_page + 1).all()
+
+    def _sort_key(self, item) -> Tuple[datetime, Any]:
+        return (
+            getattr(item, self.timestamp_column.key),
+            getattr(item, self.id_column.key),
+        )
+
+    @property
+    def prev_cursor(self) -> Optional[str]:
+        if not self.has_prev or not self.items:
+            return None
+        return encode_cursor(*self._sort_key(self.items[0]), direction=PREV)
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        if not self.has_next or not self.items:
+            return None
+        return encode_cursor(*self._sort_key(self.items[-1]), direction=NEXT)
+
+
+#
+# Helpers
+#
+
+
+def cursor_requested() -> bool:
+    """
+    Return True if the listing should be paginated with cursors
+
+    Cursor mode is opt-in: either by `cursor` query argument (empty for the
+    first page), or for all listings with PILI_CURSOR_PAGINATION setting.
+    """
+    return 'cursor' in request.args or current_app.config.get(
+        'PILI_CURSOR_PAGINATION', False
+    )
+
+
+def paginate(query, timestamp_column, id_column, per_page: int, descending=True):
+    """Return either keyset or page number pagination for the current request.
+
+    The total count is only computed in cursor mode when `count=1` query
+    argument is passed.
+    """
+    if cursor_requested():
+        return KeysetPagination(
+            query,
+            timestamp_column,
+            id_column,
+            cursor=request.args.get('cursor'),
+            per_page=per_page,
+            descending=descending,
+            count=request.args.get('count', 0, type=int) > 0,
+        )
+    page = request.args.get('page', 1, type=int)
+    ordering = timestamp_column.desc() if descending else timestamp_column.asc()
+    return query.order_by(ordering).paginate(page, per_page=per_page, error_out=False)
+
+
+def pagination_urls(
+    pagination, endpoint: str, **kwargs
+) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Return external URLs of the previous and the next pages, if any
+    """
+    if getattr(pagination, 'keyset', False):
+        prev_args = {'cursor': pagination.prev_cursor}
+        next_args = {'cursor': pagination.next_cursor}
+    else:
+        prev_args = {'page': pagination.prev_num}
+        next_args = {'page': pagination.next_num}
+
+    prev = None
+    if pagination.has_prev:
+        prev = url_for(endpoint, _external=True, **prev_args, **kwargs)
+    next = None
+    if pagination.has_next:
+        next = url_for(endpoint, _external=True, **next_args, **kwargs)
+    return prev, next
@@ -0,0 +1,186 @@
+import hashlib
+import html
+import threading
+from typing import Dict, Optional, Tuple
+
+import redis
+from bleach.linkifier import Linker
+from bleach.sanitizer import ALLOWED_ATTRIBUTES, Cleaner
+from flask import current_app
+from markdown import markdown
+
+from pili.app import celery, db, redis as redis_connector
+from pili.connectors.memory import MemoryCache
+
+#
+# Constants
+#
+
+# allowed-tags profiles: names of config settings with allowed tags and attributes
+PROFILES = {
+    'html': ('PILI_ALLOWED_TAGS', 'PILI_ALLOWED_ATTRIBUTES'),
+    'comment': ('PILI_ALLOWED_COMMENT_TAGS', None),
+}
+
+
+#
+# Renderer
+#
+
+
+class Renderer:
+    """Markdown to sanitized HTML renderer for a given allowed-tags profile.
+
+    Cleaner and Linker are built once, rather than on every bleach.clean()
+    and bleach.linkify() call. They are not thread-safe, so that renderers
+    are kept per thread.
+    """
+
+    def __init__(self, tags, attributes) -> None:
+        self.cleaner = Cleaner(tags=tags, attributes=attributes, strip=True)
+        self.linker = Linker()
+
+    def render(self, text: str) -> str:
+        return self.linker.linkify(
+            self.cleaner.clean(markdown(text, output_format='html'))
+        )
+
+
+_local = threading.local()
+_cache = None  # type: Optional[MemoryCache]
+
+
+def get_renderer(profile: str) -> Renderer:
+    """
+    Return current thread's renderer for the profile, build it if needed
+    """
+    renderers = getattr(_local, 'renderers', None)  # type: Optional[Dict]
+    if renderers is None:
+        renderers = _local.renderers = {}
+    key = (current_app.import_name, profile)
+    if key not in renderers:
+        tags_setting, attrs_setting = PROFILES[profile]
+        renderers[key] = Renderer(
+            tags=current_app.config[tags_setting],
+            attributes=(
+                current_app.config[attrs_setting]
+                if attrs_setting
+                else ALLOWED_ATTRIBUTES
+            ),
+        )
+    return renderers[key]
+
+
+def get_cache() -> MemoryCache:
+    global _cache
+    if _cache is None:
+        _cache = MemoryCache(max_entries=current_app.config['PILI_RENDER_CACHE_SIZE'])
+    return _cache
+
+
+def digest(text: str) -> str:
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _cache_key(text: str, profile: str) -> Tuple[str, str]:
+    return profile, digest(text)
+
+
+#
+# Public API
+#
+
+
+def render(text: Optional[str], profile: str = 'html') -> Optional[str]:
+    """Return sanitized HTML rendered from Markdown text.
+
+    Results are cached by the content hash and the allowed-tags profile:
+    in process first, then in Redis shared by all the workers, so that the
+    same body is rendered once no matter how many times it's assigned.
+    """
+    if text is None:
+        return None
+    key = _cache_key(text, profile)
+    cache = get_cache()
+    html = cache.get(key)
+    if html is not None:
+        return html
+
+    use_redis = (
+        not current_app.config.get('CACHE_DISABLE') and redis_connector.available()
+    )
+    redis_key = 'render:{0}:{1}'.format(*key)
+    if use_redis:
+        try:
+            cached = redis_connector.get_key(redis_key)
+            if cached is not None:
+                html = cached.decode('utf-8')
+        except redis.RedisError:
+            current_app.logger.exception(
+                'Redis connection failed while getting key: {}'.format(redis_key)
+            )
+            use_redis = False
+
+    if html is None:
+        html = get_renderer(profile).render(text)
+        if use_redis and redis_connector.available():
+            try:
+                redis_connector.set_key(
+                    redis_key, html, current_app.config['PILI_RENDER_CACHE_EXPIRE']
+                )
+            except redis.RedisError:
+                current_app.logger.exception(
+                    'Redis connection failed while setting key: {}'.format(redis_key)
+                )
+
+    cache.set(key, html)
+    return html
+
+
+def render_plain(text: str) -> str:
+    """
+    Return escaped text split into paragraphs, a cheap stand-in for render()
+    """
+    paragraphs = (paragraph.strip() for paragraph in text.split('\n\n'))
+    return ''.join(
+        '<p>{}</p>'.format(html.escape(paragraph))
+        for paragraph in paragraphs
+        if paragraph
+    )
+
+
+def render_async_required(text: Optional[str]) -> bool:
+    """
+    Return True if the text is too long to be rendered within a request
+    """
+    config = current_app.config
+    return (
+        config['PILI_RENDER_ASYNC']
+        and text is not None
+        and len(text) > config['PILI_RENDER_ASYNC_THRESHOLD']
+    )
+
+
+#
+# Async rendering
+#
+
+
+@celery.task(serializer='json', ignore_result=True)
+def render_body_async(model_name: str, id: int, body_digest: str, profile: str):
+    """Render the body of the model instance and clear its pending flag.
+
+    The task is a no-op if the body has been changed since the task was
+    enqueued, as yet another task for the new body follows.
+    """
+    from pili import models
+
+    model = getattr(models, model_name)
+    target = model.query.get(id)
+    if target is None or not target.body_html_pending:
+        return
+    if target.body is None or digest(target.body) != body_digest:
+        return
+    target.body_html = render(target.body, profile)
+    target.body_html_pending = False
+    db.session.commit()
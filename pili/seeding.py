@@ -0,0 +1,324 @@
+import hashlib
+import itertools
+import random
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from werkzeug.security import generate_password_hash
+
+from pili.app import db
+from pili.filters import sanitize_alias
+from pili.models import (
+    Category,
+    Comment,
+    Follow,
+    Like,
+    Post,
+    Role,
+    Tag,
+    Tagification,
+    User,
+    recount_counters,
+)
+from pili.rendering import render
+
+#
+# Constants
+#
+
+WORDS = (
+    'lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor '
+    'incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud '
+    'exercitation ullamco laboris nisi aliquip ex ea commodo consequat duis aute '
+    'irure in reprehenderit voluptate velit esse cillum fugiat nulla pariatur'
+).split()
+
+# distinct bodies rendered once and shared by the rows
+BODY_POOL_SIZE = 100
+
+# credentials of the generated users, e.g. for load tests
+EMAIL = 'seed{}@example.com'
+USERNAME = 'seed{}'
+PASSWORD = 'password'
+
+
+#
+# Helpers
+#
+
+
+class Skewed:
+    """
+    Random picker of sequence items with Zipf-like popularity
+
+    The item of rank r is picked with the weight 1 / r ** skew, skew=0 picks
+    uniformly. A few users write most of the posts, a few posts get most of
+    the comments and likes, just like in production.
+    """
+
+    def __init__(self, rng: random.Random, items: Sequence, skew: float) -> None:
+        self.rng = rng
+        self.items = items
+        self.cum_weights = list(
+            itertools.accumulate(1 / rank ** skew for rank in range(1, len(items) + 1))
+        )
+
+    def pick(self, k: int = 1) -> List[Any]:
+        return self.rng.choices(self.items, cum_weights=self.cum_weights, k=k)
+
+    def pick_distinct(self, k: int) -> List[Any]:
+        return list(dict.fromkeys(self.pick(k)))
+
+
+def _sentence(rng: random.Random, words: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize()
+
+
+def _text(rng: random.Random, paragraphs: int) -> str:
+    return '\n\n'.join(
+        '. '.join(_sentence(rng, rng.randint(4, 12)) for _ in range(rng.randint(2, 6)))
+        + '.'
+        for _ in range(paragraphs)
+    )
+
+
+def _next_id(model: Any) -> int:
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def _insert(model: Any, rows: Iterable[Dict], batch_size: int) -> int:
+    """
+    Insert the rows in batches bypassing the ORM's unit of work
+    """
+    count = 0
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return count
+        db.session.bulk_insert_mappings(model, batch)
+        db.session.flush()
+        count += len(batch)
+
+
+def _reset_sequences(models: Iterable[Any]) -> None:
+    """
+    Move PostgreSQL sequences past the explicitly inserted primary keys
+    """
+    if db.session.get_bind().dialect.name != 'postgresql':
+        return
+    for model in models:
+        table = model.__tablename__
+        db.session.execute(
+            "SELECT setval(pg_get_serial_sequence('{0}', 'id'), "
+            "(SELECT COALESCE(MAX(id), 1) FROM {0}))".format(table)
+        )
+
+
+#
+# Generator
+#
+
+
+def generate(
+    users: int = 1000,
+    posts: int = 10000,
+    comments: int = 50000,
+    likes: int = 100000,
+    follows: int = 20,
+    tags: int = 200,
+    categories: int = 10,
+    skew: float = 1.0,
+    batch_size: int = 5000,
+    seed: Optional[int] = None,
+) -> Dict[str, int]:
+    """Bulk generate a synthetic dataset, return the numbers of inserted rows.
+
+    Rows are inserted with explicit primary keys via bulk_insert_mappings,
+    so neither ORM events nor per-row queries are involved. Bodies are
+    rendered once per distinct text, denormalized counters are recomputed
+    at the end. `follows` is the average number of users followed by a user,
+    `skew` sets how unevenly posts, comments and likes are spread over
+    users and posts.
+
+    >>> generate(users=100, posts=1000, seed=42)
+    """
+    rng = random.Random(seed)
+    now = datetime.utcnow()
+    role_id = Role.query.filter_by(default=True).first().id
+    password_hash = generate_password_hash(PASSWORD)
+
+    bodies = [_text(rng, rng.randint(1, 5)) for _ in range(BODY_POOL_SIZE)]
+    bodies_html = [render(body) for body in bodies]
+    comment_bodies = [_text(rng, 1) for _ in range(BODY_POOL_SIZE)]
+    comment_bodies_html = [render(body, profile='comment') for body in comment_bodies]
+
+    def body_fields() -> Dict[str, Any]:
+        i = rng.randrange(BODY_POOL_SIZE)
+        return {'body': bodies[i], 'body_html': bodies_html[i]}
+
+    def comment_body_fields() -> Dict[str, Any]:
+        i = rng.randrange(BODY_POOL_SIZE)
+        return {'body': comment_bodies[i], 'body_html': comment_bodies_html[i]}
+
+    def timestamp(days: int = 365) -> datetime:
+        return now - timedelta(seconds=rng.randrange(days * 24 * 3600))
+
+    inserted = {}  # type: Dict[str, int]
+
+    # users with self-follows, as User() does
+    first_user_id = _next_id(User)
+    user_ids = list(range(first_user_id, first_user_id + users))
+
+    def user_rows() -> Iterator[Dict]:
+        for user_id in user_ids:
+            email = EMAIL.format(user_id)
+            yield {
+                'id': user_id,
+                'email': email,
+                'username': USERNAME.format(user_id),
+                'role_id': role_id,
+                'password_hash': password_hash,
+                'confirmed': True,
+                'name': _sentence(rng, 2),
+                'about_me': _sentence(rng, 8),
+                'member_since': timestamp(),
+                'last_seen': timestamp(30),
+                'avatar_hash': hashlib.md5(email.encode('utf-8')).hexdigest(),
+            }
+
+    inserted['users'] = _insert(User, user_rows(), batch_size)
+    popular_users = Skewed(rng, user_ids, skew)
+
+    def follow_rows() -> Iterator[Dict]:
+        for user_id in user_ids:
+            followed = set(popular_users.pick_distinct(rng.randint(0, 2 * follows)))
+            followed.add(user_id)
+            for followed_id in followed:
+                yield {
+                    'follower_id': user_id,
+                    'followed_id': followed_id,
+                    'timestamp': timestamp(),
+                }
+
+    inserted['follows'] = _insert(Follow, follow_rows(), batch_size)
+
+    first_category_id = _next_id(Category)
+    category_ids = list(range(first_category_id, first_category_id + categories))
+    inserted['categories'] = _insert(
+        Category,
+        (
+            dict(
+                id=category_id,
+                title='Category {}'.format(category_id),
+                alias='category-{}'.format(category_id),
+                description=_sentence(rng, 10),
+                author_id=rng.choice(user_ids),
+                timestamp=timestamp(),
+                **body_fields(),
+            )
+            for category_id in category_ids
+        ),
+        batch_size,
+    )
+
+    first_tag_id = _next_id(Tag)
+    tag_ids = list(range(first_tag_id, first_tag_id + tags))
+    inserted['tags'] = _insert(
+        Tag,
+        (
+            {
+                'id': tag_id,
+                'title': 'Tag {}'.format(tag_id),
+                'alias': 'tag-{}'.format(tag_id),
+                'author_id': rng.choice(user_ids),
+            }
+            for tag_id in tag_ids
+        ),
+        batch_size,
+    )
+
+    first_post_id = _next_id(Post)
+    post_ids = list(range(first_post_id, first_post_id + posts))
+    post_authors = dict(zip(post_ids, popular_users.pick(posts)))
+    popular_categories = Skewed(rng, category_ids, skew)
+
+    def post_rows() -> Iterator[Dict]:
+        for post_id in post_ids:
+            title = _sentence(rng, rng.randint(2, 8))
+            yield dict(
+                id=post_id,
+                title=title,
+                alias=sanitize_alias(title),
+                description=_sentence(rng, 10),
+                timestamp=timestamp(),
+                author_id=post_authors[post_id],
+                category_id=popular_categories.pick()[0] if category_ids else None,
+                featured=rng.random() < 0.01,
+                commenting=True,
+                **body_fields(),
+            )
+
+    inserted['posts'] = _insert(Post, post_rows(), batch_size)
+
+    popular_tags = Skewed(rng, tag_ids, skew)
+    inserted['tagifications'] = _insert(
+        Tagification,
+        (
+            {'tag_id': tag_id, 'post_id': post_id}
+            for post_id in post_ids
+            for tag_id in popular_tags.pick_distinct(rng.randint(0, 5) if tags else 0)
+        ),
+        batch_size,
+    )
+
+    # comment trees: every other comment replies to an earlier one of the post
+    first_comment_id = _next_id(Comment)
+    popular_posts = Skewed(rng, post_ids, skew)
+    comment_posts = popular_posts.pick(comments) if post_ids else []
+    comment_authors = popular_users.pick(len(comment_posts))
+    comment_ids = list(range(first_comment_id, first_comment_id + len(comment_posts)))
+
+    def comment_rows() -> Iterator[Dict]:
+        threads = {}  # type: Dict[int, List[tuple]]
+        for comment_id, post_id, author_id in zip(
+            comment_ids, comment_posts, comment_authors
+        ):
+            thread = threads.setdefault(post_id, [])
+            parent_id, recipient_id = None, None
+            if thread and rng.random() < 0.5:
+                parent_id, recipient_id = rng.choice(thread)
+            thread.append((comment_id, author_id))
+            yield dict(
+                id=comment_id,
+                post_id=post_id,
+                parent_id=parent_id,
+                author_id=author_id,
+                recipient_id=recipient_id,
+                timestamp=timestamp(),
+                disabled=False,
+                screened=False,
+                read=rng.random() < 0.5,
+                **comment_body_fields(),
+            )
+
+    inserted['comments'] = _insert(Comment, comment_rows(), batch_size)
+
+    def like_rows() -> Iterator[Dict]:
+        liked = set()
+        for _ in range(likes):
+            user_id = popular_users.pick()[0]
+            if comment_ids and rng.random() < 0.2:
+                key = ('comment_id', rng.choice(comment_ids), user_id)
+            else:
+                key = ('post_id', popular_posts.pick()[0], user_id)
+            if key in liked:
+                continue
+            liked.add(key)
+            yield {key[0]: key[1], 'user_id': user_id, 'timestamp': timestamp()}
+
+    inserted['likes'] = _insert(Like, like_rows() if post_ids else (), batch_size)
+
+    _reset_sequences([User, Category, Tag, Post, Comment])
+    recount_counters()
+    return inserted
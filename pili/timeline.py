@@ -0,0 +1,345 @@
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import redis
+from flask import current_app, request
+from flask_sqlalchemy import Pagination
+from sqlalchemy import select
+
+from pili.app import celery, db, redis as redis_connector
+from pili.models import Follow, Post, User
+from pili.pagination import cursor_requested, paginate
+
+#
+# Constants
+#
+
+TIMELINE_KEY = 'timeline:{}'
+REBUILDING_KEY = 'timeline:{}:rebuilding'
+
+# Every built timeline holds the sentinel with the lowest score, so that an
+# empty timeline is told from a missing one, i.e. the one of a cold user.
+SENTINEL = '0'
+
+# timelines updated by a single script call
+FANOUT_BATCH = 1000
+
+TIMELINE_CHANGES = 'pili_timeline_changes'
+
+ADD_SCRIPT = """
+-- KEYS: timelines, ARGV[1]: max length, ARGV[2..]: score and post id pairs
+-- Missing timelines are left for the rebuild on read, as they would miss
+-- older posts otherwise.
+local length = tonumber(ARGV[1])
+for _, key in ipairs(KEYS) do
+  if redis.call('EXISTS', key) == 1 then
+    for i = 2, #ARGV, 2 do
+      redis.call('ZADD', key, ARGV[i], ARGV[i + 1])
+    end
+    -- keep the sentinel (rank 0) and the latest posts
+    redis.call('ZREMRANGEBYRANK', key, 1, -(length + 1))
+  end
+end
+return 1
+"""
+
+_add_script = None
+
+
+#
+# Storage
+#
+
+
+def timeline_key(user_id: int) -> str:
+    return TIMELINE_KEY.format(user_id)
+
+
+def rebuilding_key(user_id: int) -> str:
+    return REBUILDING_KEY.format(user_id)
+
+
+def _score(timestamp: datetime) -> float:
+    return timestamp.replace(tzinfo=timezone.utc).timestamp()
+
+
+def enabled() -> bool:
+    return current_app.config['PILI_TIMELINE'] and redis_connector.available()
+
+
+def build(user_id: int) -> int:
+    """
+    Rebuild user's timeline from the database, return the number of posts
+    """
+    length = current_app.config['PILI_TIMELINE_LENGTH']
+    rows = db.session.execute(
+        select([Post.id, Post.timestamp])
+        .select_from(Post.__table__.join(Follow, Follow.followed_id == Post.author_id))
+        .where(Follow.follower_id == user_id)
+        .order_by(Post.timestamp.desc())
+        .limit(length)
+    ).fetchall()
+    key = timeline_key(user_id)
+    mapping = {str(id): _score(timestamp) for id, timestamp in rows}
+    mapping[SENTINEL] = float('-inf')
+    pipe = redis_connector.connection.pipeline()
+    pipe.delete(key)
+    pipe.zadd(key, mapping)
+    pipe.expire(key, current_app.config['PILI_TIMELINE_EXPIRE'])
+    with redis_connector.guard():
+        pipe.execute()
+    return len(rows)
+
+
+def add_posts(user_ids: Sequence[int], posts: Iterable[Tuple[int, datetime]]) -> None:
+    """
+    Add the posts to the timelines of the users, if built already
+    """
+    global _add_script
+    if _add_script is None:
+        _add_script = redis_connector.connection.register_script(ADD_SCRIPT)
+    args = [current_app.config['PILI_TIMELINE_LENGTH']]  # type: List
+    for id, timestamp in posts:
+        args.extend([_score(timestamp), str(id)])
+    if len(args) == 1:
+        return
+    for start in range(0, len(user_ids), FANOUT_BATCH):
+        end = start + FANOUT_BATCH
+        keys = [timeline_key(id) for id in user_ids[start:end]]
+        with redis_connector.guard():
+            _add_script(keys=keys, args=args, client=redis_connector.connection)
+
+
+def remove_posts(user_ids: Sequence[int], post_ids: Sequence[int]) -> None:
+    """
+    Remove the posts from the timelines of the users
+    """
+    if not post_ids:
+        return
+    members = [str(id) for id in post_ids]
+    for start in range(0, len(user_ids), FANOUT_BATCH):
+        end = start + FANOUT_BATCH
+        pipe = redis_connector.connection.pipeline(transaction=False)
+        for id in user_ids[start:end]:
+            pipe.zrem(timeline_key(id), *members)
+        with redis_connector.guard():
+            pipe.execute()
+
+
+def read(user_id: int, start: int, stop: int) -> Optional[Tuple[List[int], int]]:
+    """Return post ids of the timeline's slice and the number of posts.
+
+    None if the timeline is not built. Reading extends timeline's lifetime,
+    so that only the timelines of active users are kept.
+    """
+    key = timeline_key(user_id)
+    pipe = redis_connector.connection.pipeline(transaction=False)
+    pipe.zrevrange(key, start, stop)
+    pipe.zcard(key)
+    pipe.expire(key, current_app.config['PILI_TIMELINE_EXPIRE'])
+    with redis_connector.guard():
+        members, size, _ = pipe.execute()
+    if not size:
+        return None
+    ids = [id for id in map(int, members) if id != int(SENTINEL)]
+    return ids, size - 1
+
+
+#
+# Public API
+#
+
+
+def paginate_followed(user: User, per_page: int):
+    """Return the page of posts by the users followed by the user.
+
+    Page number pagination is served from the user's timeline: one slice of
+    the sorted set and a primary key lookup, no matter how many users are
+    followed. Cold users' timelines are rebuilt in background, while their
+    pages, as well as cursor-paginated ones and the ones beyond the stored
+    posts, are queried from the database.
+    """
+    query = user.followed_posts
+    if cursor_requested() or not enabled():
+        return paginate(query, Post.timestamp, Post.id, per_page)
+
+    page = max(request.args.get('page', 1, type=int), 1)
+    start = (page - 1) * per_page
+    try:
+        stored = read(user.id, start, start + per_page - 1)
+    except redis.RedisError:
+        current_app.logger.exception(
+            'Redis connection failed while reading timeline of {}'.format(user.id)
+        )
+        stored = None
+    if stored is None:
+        schedule_rebuild(user.id)
+        return paginate(query, Post.timestamp, Post.id, per_page)
+
+    ids, total = stored
+    full = total >= current_app.config['PILI_TIMELINE_LENGTH']
+    if full and start + per_page > total:
+        return paginate(query, Post.timestamp, Post.id, per_page)
+    posts = {}  # type: Dict[int, Post]
+    if ids:
+        posts = {post.id: post for post in Post.query.filter(Post.id.in_(ids))}
+    # one more post than stored leads to the pages served from the database
+    return Pagination(
+        query,
+        page,
+        per_page,
+        total + 1 if full else total,
+        [posts[id] for id in ids if id in posts],
+    )
+
+
+def schedule_rebuild(user_id: int) -> bool:
+    """Enqueue rebuilding user's timeline, unless it's enqueued already.
+
+    Repeated page loads of a cold user enqueue a single rebuild, as each one
+    replaces the timeline, along with the posts fanned out meanwhile.
+    """
+    try:
+        with redis_connector.guard():
+            scheduled = redis_connector.connection.set(
+                rebuilding_key(user_id),
+                1,
+                nx=True,
+                ex=current_app.config['PILI_TIMELINE_REBUILD_TIMEOUT'],
+            )
+    except redis.RedisError:
+        current_app.logger.exception(
+            'Redis connection failed while scheduling timeline of {}'.format(user_id)
+        )
+        return False
+    if not scheduled:
+        return False
+    try:
+        rebuild_timeline.apply_async(args=[user_id])
+    except Exception:
+        current_app.logger.exception(
+            'Failed to enqueue rebuilding timeline of {}'.format(user_id)
+        )
+        return False
+    return True
+
+
+def backfill(user_ids: Optional[Iterable[int]] = None) -> int:
+    """
+    Build the timelines of the users (all by default), return their number
+    """
+    if user_ids is None:
+        user_ids = [id for id, in db.session.query(User.id).order_by(User.id)]
+    count = 0
+    for user_id in user_ids:
+        build(user_id)
+        count += 1
+    return count
+
+
+@celery.task(serializer='json', ignore_result=True)
+def rebuild_timeline(user_id: int):
+    try:
+        build(user_id)
+    finally:
+        with redis_connector.guard():
+            redis_connector.connection.delete(rebuilding_key(user_id))
+
+
+#
+# Fan-out on write
+#
+
+
+def _followers(session, user_id: int) -> List[int]:
+    return [
+        id
+        for id, in session.execute(
+            select([Follow.follower_id]).where(Follow.followed_id == user_id)
+        )
+    ]
+
+
+def _latest_posts(session, user_id: int) -> List[Tuple[int, datetime]]:
+    return list(
+        session.execute(
+            select([Post.id, Post.timestamp])
+            .where(Post.author_id == user_id)
+            .order_by(Post.timestamp.desc())
+            .limit(current_app.config['PILI_TIMELINE_LENGTH'])
+        )
+    )
+
+
+def _collect_timeline_changes(session, flush_context):
+    """Remember timeline updates for the posts and follows being flushed
+
+    Followers and followed users' posts are queried here, as no SQL can be
+    emitted once committed.
+    """
+    if not enabled():
+        return
+    changes = session.info.setdefault(TIMELINE_CHANGES, [])
+    for instance in session.new:
+        if isinstance(instance, Post) and instance.timestamp is not None:
+            changes.append(
+                (
+                    _followers(session, instance.author_id),
+                    [(instance.id, instance.timestamp)],
+                    [],
+                )
+            )
+        elif isinstance(instance, Follow):
+            changes.append(
+                (
+                    [instance.follower_id],
+                    _latest_posts(session, instance.followed_id),
+                    [],
+                )
+            )
+    for instance in session.deleted:
+        if isinstance(instance, Post):
+            changes.append((_followers(session, instance.author_id), [], [instance.id]))
+        elif isinstance(instance, Follow):
+            posts = _latest_posts(session, instance.followed_id)
+            changes.append(([instance.follower_id], [], [id for id, _ in posts]))
+    for instance in session.dirty:
+        if not isinstance(instance, Post):
+            continue
+        state = db.inspect(instance).attrs
+        author = state.author_id.history
+        if author.has_changes() or state.timestamp.history.has_changes():
+            for old_author_id in author.deleted:
+                if old_author_id is not None:
+                    changes.append(
+                        (_followers(session, old_author_id), [], [instance.id])
+                    )
+            changes.append(
+                (
+                    _followers(session, instance.author_id),
+                    [(instance.id, instance.timestamp)],
+                    [],
+                )
+            )
+
+
+def _apply_timeline_changes(session):
+    """Update the timelines once the changes are committed"""
+    changes = session.info.pop(TIMELINE_CHANGES, None)
+    if not changes:
+        return
+    try:
+        for user_ids, added, removed in changes:
+            remove_posts(user_ids, removed)
+            add_posts(user_ids, added)
+    except redis.RedisError:
+        current_app.logger.exception('Redis connection failed while updating timelines')
+
+
+def _discard_timeline_changes(session, previous_transaction):
+    session.info.pop(TIMELINE_CHANGES, None)
+
+
+db.event.listen(db.session, 'after_flush', _collect_timeline_changes)
+db.event.listen(db.session, 'after_commit', _apply_timeline_changes)
+db.event.listen(db.session, 'after_soft_rollback', _discard_timeline_changes)
@@ -1,11 +1,13 @@
 import os
 import time
+from contextlib import contextmanager
 from unittest.mock import patch
 
 import flask
 import pytest
 
 from pili.app import create_app, db
+from pili.instrumentation import get_query_stats
 from pili.models import Role
 
 
@@ -92,3 +94,48 @@ def nested_transaction_rollback(request, app):
         # Rollback and remove session on teardown allows save time on tables creation/drop
         db.session.rollback()
         db.session.remove()
+
+
+#
+# Query budgets
+#
+
+# maximum number of queries per request to the endpoint, cached pages excluded
+QUERY_BUDGETS = {'api.get_posts': 4, 'ctrl.users': 9, 'main.index': 9, 'main.post': 6}
+
+
+@pytest.fixture
+def query_budget(app):
+    """
+    Assert that requests to the endpoint within the block stay in budget
+
+    Usage:
+      with query_budget('main.index'):
+          client.get('/')
+    """
+
+    @contextmanager
+    def budget(endpoint, max_queries=None):
+        if max_queries is None:
+            max_queries = QUERY_BUDGETS[endpoint]
+        stats = []
+
+        def record(sender, response, **extra):
+            if flask.request.endpoint == endpoint:
+                stats.append(get_query_stats())
+
+        with flask.request_finished.connected_to(record, app):
+            yield
+
+        assert stats, 'No requests to {}'.format(endpoint)
+        threshold = app.config['PILI_REPEATED_QUERY_THRESHOLD']
+        for request_stats in stats:
+            message = '{} made {} queries, budget is {}. Repeated: {}'.format(
+                endpoint,
+                request_stats.count,
+                max_queries,
+                request_stats.repeated(threshold),
+            )
+            assert request_stats.count <= max_queries, message
+
+    return budget
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+from pili.activity import LastSeenBuffer, record_last_seen, write_last_seen
+from pili.app import db
+from pili.models import User
+
+
+def _create_user(name):
+    user = User(email='{}@example.com'.format(name), username=name, password='cat')
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def test_buffer_pop_due():
+    buffer = LastSeenBuffer()
+    now = datetime.utcnow()
+    buffer.add(1, now)
+    assert buffer.pop_due(interval=60) == {}
+    assert buffer.pop_due(interval=0) == {1: now}
+    assert buffer.pop_due(interval=0) == {}
+
+
+def test_record_last_seen_throttled():
+    user = _create_user('throttled')
+    buffer = LastSeenBuffer()
+    with mock.patch('pili.activity.buffer', buffer), mock.patch(
+        'pili.activity.write_last_seen'
+    ) as write:
+        record_last_seen(user, now=user.last_seen + timedelta(seconds=1))
+        assert buffer.pop_due(interval=0) == {}
+
+        later = user.last_seen + timedelta(hours=1)
+        record_last_seen(user, now=later)
+        assert buffer.pop_due(interval=0) == {user.id: later}
+    write.assert_called_with({})
+
+
+def test_write_last_seen():
+    user = _create_user('seen')
+    later = user.last_seen + timedelta(hours=1)
+    connection = db.session.connection()
+
+    write_last_seen({user.id: later}, connection=connection)
+    # never goes backwards
+    write_last_seen({user.id: later - timedelta(minutes=1)}, connection=connection)
+    db.session.expire(user)
+    assert user.last_seen == later
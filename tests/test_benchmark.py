@@ -0,0 +1,27 @@
+from pili.benchmark import format_results, get_targets, percentile, run
+from pili.seeding import generate
+
+
+def test_percentile():
+    values = [0.5, 0.1, 0.4, 0.2, 0.3]
+    assert percentile(values, 50) == 0.3
+    assert percentile(values, 99) == 0.5
+    assert percentile(values, 0) == 0.1
+    assert percentile([], 95) == 0.0
+
+
+def test_run_reports_latency_and_queries(app):
+    generate(users=5, posts=10, comments=10, likes=10, tags=3, seed=1)
+    with app.test_request_context():
+        targets = get_targets()
+    assert ('main.index', '/') in targets
+
+    results = run(app, targets[:2], requests=3, warmup=1)
+
+    assert [result.name for result in results] == ['main.index', 'main.index?page=10']
+    for result in results:
+        assert result.requests == 3
+        assert result.errors == 0
+        assert 0 < result.p50 <= result.p99
+        assert result.queries > 0
+    assert 'main.index' in format_results(results)
@@ -0,0 +1,31 @@
+from pili.app import db
+from pili.models import CACHE_TAGS, Comment, Post, Tag
+
+
+def test_cache_tags_collected_on_flush():
+    post = Post(title='tagged', alias='tagged', body='tagged')
+    tag = Tag(title='Tagged', alias='tagged')
+    db.session.add_all([post, tag])
+    db.session.flush()
+    assert db.session.info[CACHE_TAGS] == {
+        'posts',
+        'post:{}'.format(post.id),
+        'tags',
+        'tag:tagged',
+    }
+
+    db.session.info[CACHE_TAGS].clear()
+    comment = Comment(body='comment', post=post)
+    db.session.add(comment)
+    db.session.flush()
+    assert db.session.info[CACHE_TAGS] >= {
+        'comments',
+        'comment:{}'.format(comment.id),
+        'post:{}'.format(post.id),
+    }
+
+    # unmodified instances are ignored
+    db.session.info[CACHE_TAGS].clear()
+    post.title = post.title
+    db.session.flush()
+    assert db.session.info[CACHE_TAGS] == set()
@@ -2,7 +2,10 @@ import re
 import time
 from unittest.mock import patch
 
-from pili.models import User
+import flask
+
+from pili.app import db, redis
+from pili.models import Category, Post, User
 
 
 def test_home_page(app, client):
@@ -11,6 +14,56 @@ def test_home_page(app, client):
         assert b'Stranger' in response.data
 
 
+def test_home_page_cached_for_anonymous(app, client):
+    with app.test_request_context():
+        response = client.get('/')
+        assert response.cache_control.public
+        assert response.cache_control.max_age == app.config['PILI_PAGE_CACHE_MAX_AGE']
+        assert 'posts' in response.headers['Surrogate-Key'].split()
+
+        response = client.get('/', headers={'If-None-Match': response.headers['ETag']})
+        assert response.status_code == 304
+
+        client.set_cookie('localhost', 'show_followed', '1')
+        response = client.get('/')
+        assert 'Surrogate-Key' not in response.headers
+
+
+def test_post_page_cached_for_anonymous_with_csrf(app, client):
+    author = User(email='susan@example.org', username='susan', password='dog')
+    category = Category(title='News', alias='news')
+    post = Post(
+        title='Cached', alias='cached', body='body', commenting=True, author=author
+    )
+    post.category = category
+    db.session.add_all([author, category, post])
+    db.session.flush()
+
+    store = {}
+    app.config.update(CACHE_DISABLE=False, WTF_CSRF_ENABLED=True)
+    try:
+        with patch.object(redis, 'available', return_value=True), patch.object(
+            redis, 'get_versions', side_effect=lambda tags: [0] * len(tags)
+        ), patch.object(redis, 'get_key', side_effect=store.get), patch.object(
+            redis,
+            'set_key_with_tags',
+            side_effect=lambda key, value, *args: store.update({key: value}),
+        ), patch(
+            'pili.main.views.render_template', wraps=flask.render_template
+        ) as render_template:
+            url = '/news/{}/cached'.format(post.id)
+            first = client.get(url)
+            second = client.get(url)
+    finally:
+        app.config.update(CACHE_DISABLE=True, WTF_CSRF_ENABLED=False)
+
+    # no CSRF token stored in the session for anonymous visitors
+    assert 'Set-Cookie' not in first.headers
+    assert first.cache_control.public
+    assert second.data == first.data
+    assert render_template.call_count == 1
+
+
 def test_register_login_logout(app, client):
     with patch('pili.app.request') as prometheus_mock, patch(
         'pili.auth.views.send_email'
@@ -0,0 +1,77 @@
+from unittest import mock
+
+import pytest
+from prometheus_client import REGISTRY
+
+from pili.app import redis
+from pili.conditional import conditional, conditional_response, versions_etag
+
+
+@pytest.fixture
+def versions(app):
+    app.config.update(CACHE_DISABLE=False)
+    with app.test_request_context('/'), mock.patch.object(
+        redis, 'available', return_value=True
+    ), mock.patch.object(redis, 'get_versions', return_value=[1]) as get_versions:
+        yield get_versions
+    app.config.update(CACHE_DISABLE=True)
+
+
+def test_versions_etag_requires_cache(app):
+    with app.test_request_context('/'):
+        assert versions_etag(['posts']) is None
+
+
+def test_versions_etag_changes_with_version(versions):
+    etag = versions_etag(['posts'], 'main.index')
+    assert etag == versions_etag(['posts'], 'main.index')
+    assert etag != versions_etag(['posts'], 'main.tag')
+    versions.return_value = [2]
+    assert etag != versions_etag(['comments'], 'main.index')
+
+
+def test_conditional_not_modified_skips_view(app, versions):
+    calls = []
+
+    @conditional(tags=['posts'])
+    def view():
+        calls.append(1)
+        return 'page'
+
+    response = view()
+    assert response.status_code == 200
+    etag, _ = response.get_etag()
+
+    with app.test_request_context('/', headers={'If-None-Match': '"%s"' % etag}):
+        assert view().status_code == 304
+    assert calls == [1]
+
+
+def test_conditional_response_adds_etag(app):
+    with app.test_request_context('/'):
+        response = conditional_response(app.response_class('page'))
+        etag = response.headers['ETag']
+    with app.test_request_context('/', headers={'If-None-Match': etag}):
+        response = conditional_response(app.response_class('page'))
+        assert response.status_code == 304
+    with app.test_request_context('/', method='POST', headers={'If-None-Match': etag}):
+        response = conditional_response(app.response_class('page'))
+        assert 'ETag' not in response.headers
+
+
+def test_metrics_labelled_by_rule(app, client):
+    client.get('/tag/unknown-tag')
+    assert (
+        REGISTRY.get_sample_value(
+            'app_request_count_total',
+            {'method': 'GET', 'endpoint': '/tag/<alias>', 'http_status': '404'},
+        )
+        == 1
+    )
+    assert (
+        REGISTRY.get_sample_value(
+            'app_request_count_total',
+            {'method': 'GET', 'endpoint': '/tag/unknown-tag', 'http_status': '404'},
+        )
+        is None
+    )
@@ -0,0 +1,472 @@
+import pickle
+import time
+from unittest import mock
+
+import flask
+import pytest
+from redis import ConnectionError
+
+from pili.app import rate_limit, redis
+from pili.connectors.breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+from pili.connectors.memory import MemoryCache
+from pili.connectors.ratelimit import (
+    SLIDING_WINDOW,
+    TOKEN_BUCKET,
+    LocalRateLimiter,
+    RateLimiter,
+    RateLimitPolicy,
+)
+from pili.connectors.redis import (
+    HealthCheckedConnectionPool,
+    RateLimitExceededError,
+    RedisConnector,
+    cache,
+    cache_flask_view,
+    cache_many,
+)
+
+
+def test_redis_pool_shared_between_app_contexts(app):
+    with app.app_context():
+        client = redis.connection
+    with app.app_context():
+        assert redis.connection is not client
+        assert redis.connection.connection_pool is client.connection_pool
+    assert isinstance(client.connection_pool, HealthCheckedConnectionPool)
+    assert client.connection_pool.max_connections == app.config['REDIS_MAX_CONNECTIONS']
+
+
+def test_redis_pool_recreated_after_fork(app):
+    pool = redis.pool
+    with mock.patch('os.getpid', return_value=-1):
+        assert redis.pool is not pool
+
+
+def test_memory_cache_eviction():
+    cache = MemoryCache(max_entries=2, max_bytes=10)
+    cache.set('a', b'1')
+    cache.set('b', b'2')
+    cache.get('a')
+    cache.set('c', b'3')
+    assert cache.get('a') == b'1'
+    assert cache.get('b') is None
+    assert cache.get('c') == b'3'
+
+    cache.set('d', b'12345678')
+    assert cache.size <= 10
+    assert cache.get('a') is None and cache.get('d') == b'12345678'
+
+    cache.set('huge', b'x' * 11)
+    assert cache.get('huge') is None
+
+
+def test_memory_cache_expiration():
+    cache = MemoryCache()
+    cache.set('key', b'value', expire_seconds=0)
+    assert cache.get('key') is None
+    assert cache.misses == 1 and cache.hits == 0
+
+
+@pytest.fixture
+def local_cache(app):
+    app.config.update(CACHE_DISABLE=False, CACHE_LOCAL_ENABLE=True)
+    yield redis.local
+    redis.local.clear()
+    app.config.update(CACHE_DISABLE=True, CACHE_LOCAL_ENABLE=False)
+
+
+def test_cache_local_tier(local_cache):
+    calls = []
+
+    @cache(expire_seconds=30, connector=redis)
+    def cached_function(x):
+        calls.append(x)
+        return {'x': x}
+
+    with mock.patch.object(
+        redis, 'get_key_with_ttl', return_value=(None, None)
+    ) as get_key, mock.patch.object(redis, 'set_key') as set_key:
+        assert cached_function(1) == {'x': 1}
+        assert cached_function(1) == {'x': 1}
+
+    assert calls == [1]
+    assert get_key.call_count == 1
+    set_key.assert_called_once_with(mock.ANY, b'\xfe\x01\x00{"x":1}', 30)
+
+
+def test_cache_local_ttl_bounded_by_redis(local_cache):
+    @cache(expire_seconds=30, connector=redis)
+    def cached_function():
+        return 'computed'
+
+    with mock.patch.object(
+        redis, 'get_key_with_ttl', return_value=(b'"from redis"', 0)
+    ) as get_key:
+        assert cached_function() == 'from redis'
+        assert cached_function() == 'from redis'
+    # expired in the local tier along with Redis key
+    assert get_key.call_count == 2
+
+
+@pytest.fixture
+def redis_cache(app):
+    app.config.update(CACHE_DISABLE=False)
+    connection = mock.MagicMock()
+    with mock.patch.object(
+        RedisConnector, 'connection', new_callable=mock.PropertyMock
+    ) as prop:
+        prop.return_value = connection
+        yield connection
+    app.config.update(CACHE_DISABLE=True)
+
+
+def test_redis_set_many_per_key_expire(redis_cache):
+    pipe = redis_cache.pipeline.return_value
+    redis.set_many({'a': 1, 'b': 2}, {'a': 10, 'b': 20})
+    pipe.set.assert_has_calls([mock.call('a', 1, ex=10), mock.call('b', 2, ex=20)])
+    pipe.execute.assert_called_once_with()
+
+
+def test_cache_many_computes_misses_only(redis_cache):
+    calls = []
+
+    @cache_many(expire_seconds=30, connector=redis)
+    def get_values(ids):
+        calls.append(ids)
+        return {id: {'id': id} for id in ids if id != 4}
+
+    with mock.patch.object(
+        redis, 'get_many', return_value=[b'{"id":1}', None, None, None]
+    ) as get_many, mock.patch.object(redis, 'set_many') as set_many:
+        assert get_values([1, 2, 3, 4, 2]) == {1: {'id': 1}, 2: {'id': 2}, 3: {'id': 3}}
+
+    assert calls == [[2, 3, 4]]
+    keys = get_many.call_args[0][0]
+    assert len(keys) == 4 and keys[0].endswith(':1')
+    set_many.assert_called_once_with(
+        {keys[1]: b'\xfe\x01\x00{"id":2}', keys[2]: b'\xfe\x01\x00{"id":3}'}, 30
+    )
+
+
+def test_cache_many_all_cached(redis_cache):
+    @cache_many(connector=redis)
+    def get_values(ids):
+        raise AssertionError('should not be called')
+
+    with mock.patch.object(redis, 'get_many', return_value=[b'1', b'2']):
+        assert get_values([1, 2]) == {1: 1, 2: 2}
+
+
+def test_cache_many_local_hits_skip_breaker(local_cache):
+    @cache_many(connector=redis)
+    def get_values(ids):
+        return {id: id for id in ids}
+
+    with mock.patch.object(redis, 'get_many', return_value=[None]), mock.patch.object(
+        redis, 'set_many'
+    ):
+        assert get_values([1]) == {1: 1}
+
+    with mock.patch.object(redis, 'available') as available, mock.patch.object(
+        redis, 'get_many'
+    ) as get_many:
+        assert get_values([1]) == {1: 1}
+    # half-open probe is left for an actual Redis call
+    available.assert_not_called()
+    get_many.assert_not_called()
+
+
+def test_cache_single_flight_waits_for_lock_holder(redis_cache):
+    redis_cache.lock.return_value.acquire.return_value = False
+    calls = []
+
+    @cache(connector=redis, single_flight=True, lock_wait=1)
+    def cached_function():
+        calls.append(1)
+        return 'computed'
+
+    with mock.patch.object(redis, 'get_key', side_effect=[None, b'"by holder"']):
+        assert cached_function() == 'by holder'
+    assert calls == []
+
+
+def test_cache_single_flight_stops_waiting_for_released_lock(redis_cache):
+    lock = redis_cache.lock.return_value
+    lock.acquire.return_value = False
+    lock.locked.return_value = False
+    calls = []
+
+    @cache(connector=redis, single_flight=True, lock_wait=10)
+    def cached_function():
+        calls.append(1)
+        return 'computed'
+
+    started = time.monotonic()
+    with mock.patch.object(redis, 'get_key', return_value=None) as get_key:
+        assert cached_function() == 'computed'
+    assert time.monotonic() - started < 1
+    assert get_key.call_count == 2
+    assert calls == [1]
+
+
+def test_cache_stale_while_revalidate(redis_cache):
+    lock = redis_cache.lock.return_value
+    lock.acquire.return_value = True
+
+    @cache(expire_seconds=60, soft_ttl=40, connector=redis)
+    def cached_function():
+        return 'fresh'
+
+    with mock.patch.object(
+        redis, 'get_key_with_ttl', return_value=(b'"stale"', 10)
+    ), mock.patch.object(redis, 'set_key') as set_key, mock.patch(
+        'pili.connectors.redis._run_in_background', side_effect=lambda func: func()
+    ):
+        assert cached_function() == 'stale'
+    set_key.assert_called_once_with(mock.ANY, b'\xfe\x01\x00"fresh"', 60)
+    lock.release.assert_called_once_with()
+
+
+def test_cache_soft_ttl_validated():
+    with pytest.raises(ValueError):
+        cache(expire_seconds=60, soft_ttl=60, connector=redis)
+
+
+def test_cache_flask_view_replays_response(app, redis_cache):
+    calls = []
+
+    @cache_flask_view(connector=redis)
+    def view():
+        calls.append(1)
+        response = flask.jsonify({'posts': []})
+        response.set_cookie('session', 'secret')
+        return response
+
+    with app.test_request_context('/posts/'), mock.patch.object(
+        redis, 'get_key', return_value=None
+    ), mock.patch.object(redis, 'set_key') as set_key:
+        first = view()
+    stored = set_key.call_args[0][1]
+    assert stored.startswith(b'\xfe\x04')
+    assert b'secret' not in stored
+
+    with app.test_request_context('/posts/'), mock.patch.object(
+        redis, 'get_key', return_value=stored
+    ):
+        second = view()
+    assert calls == [1]
+    assert second.status_code == 200
+    assert second.get_json() == {'posts': []}
+    assert second.headers['ETag'] == first.headers['ETag']
+    assert 'Set-Cookie' not in second.headers
+
+    with app.test_request_context(
+        '/posts/', headers={'If-None-Match': first.headers['ETag']}
+    ), mock.patch.object(redis, 'get_key', return_value=stored):
+        assert view().status_code == 304
+
+
+def test_cache_flask_view_skips_errors_and_pickles(app, redis_cache):
+    @cache_flask_view(connector=redis)
+    def view():
+        return flask.jsonify({'error': 'not found'}), 404
+
+    legacy = pickle.dumps({'not': 'a response'})
+    with app.test_request_context('/posts/'), mock.patch.object(
+        redis, 'get_key', return_value=legacy
+    ), mock.patch.object(redis, 'set_key') as set_key:
+        assert view().status_code == 404
+    set_key.assert_not_called()
+
+
+def test_cache_tags_stored(redis_cache):
+    @cache(connector=redis, tags=lambda id: ['post:{}'.format(id)])
+    def cached_function(id):
+        return id
+
+    with mock.patch.object(redis, 'get_key', return_value=None), mock.patch.object(
+        redis, 'set_key_with_tags'
+    ) as set_key_with_tags:
+        cached_function(5)
+    set_key_with_tags.assert_called_once_with(
+        mock.ANY, b'\xfe\x01\x005', 15 * 60, ['post:5']
+    )
+
+
+def test_invalidate_tags(redis_cache):
+    pipe = redis_cache.pipeline.return_value
+    pipe.execute.return_value = [{b'cache:a', b'cache:b'}, 2]
+
+    assert redis.invalidate_tags(['posts', 'post:1']) == ['cache:a', 'cache:b']
+    pipe.sunion.assert_called_once_with('cache-tag:posts', 'cache-tag:post:1')
+    redis_cache.delete.assert_called_once_with('cache:a', 'cache:b')
+    pipe.incr.assert_has_calls(
+        [mock.call('cache-version:posts'), mock.call('cache-version:post:1')]
+    )
+    # version stamps never expire
+    pipe.expire.assert_not_called()
+
+
+def test_rate_limit_policy_from_config():
+    policy = RateLimitPolicy.from_config(
+        {'algorithm': TOKEN_BUCKET, 'limit': 10, 'period': 60, 'burst': 3}
+    )
+    assert policy.script_args() == (10, 60000, 3)
+    assert policy.per == 'ip'
+
+    with pytest.raises(ValueError):
+        RateLimitPolicy.from_config({'algorithm': 'leaky', 'limit': 1})
+
+
+def test_rate_limit_exceeded(app):
+    @rate_limit(rps=2)
+    def limited():
+        return 'ok'
+
+    with app.test_request_context(), mock.patch.object(
+        RateLimiter, 'hit', side_effect=[(True, 0), (False, 0.2)]
+    ) as hit:
+        assert limited() == 'ok'
+        with pytest.raises(RateLimitExceededError) as excinfo:
+            limited()
+    assert excinfo.value.retry_after == 1
+    key, policy = hit.call_args[0]
+    assert key.endswith(':fixed_window')
+    assert policy == RateLimitPolicy(limit=2, period=1)
+
+
+def test_rate_limit_policy_per_user_from_config(app):
+    @rate_limit(rps=2)
+    def limited():
+        return 'ok'
+
+    app.config['PILI_RATE_LIMITS'] = {
+        'api.get_token': {'algorithm': SLIDING_WINDOW, 'limit': 5, 'per': 'user'}
+    }
+    user = mock.Mock(is_authenticated=True, id=7)
+    try:
+        with app.test_request_context('/api/v1.0/token'), mock.patch.object(
+            RateLimiter, 'hit', return_value=(True, 0)
+        ) as hit:
+            flask.g.current_user = user
+            limited()
+    finally:
+        app.config['PILI_RATE_LIMITS'] = {}
+    key, policy = hit.call_args[0]
+    assert key.endswith(':user:7:sliding_window')
+    assert policy.limit == 5
+
+
+def test_rate_limit_error_retry_after(app):
+    from pili.api_1_0.errors import rate_limit_error
+
+    with app.test_request_context():
+        response = rate_limit_error(RateLimitExceededError(retry_after=7))
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '7'
+
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, recovery_timeout=60)
+    breaker.failure()
+    assert breaker.allow()
+    breaker.failure()
+    assert breaker.state == OPEN and not breaker.allow()
+
+    with mock.patch('time.monotonic', return_value=time.monotonic() + 61):
+        assert breaker.allow()
+        assert breaker.state == HALF_OPEN
+        # single probe at a time
+        assert not breaker.allow()
+        breaker.failure()
+        assert breaker.state == OPEN
+
+    with mock.patch('time.monotonic', return_value=time.monotonic() + 200):
+        assert breaker.allow()
+        breaker.success()
+    assert breaker.state == CLOSED and breaker.allow()
+
+
+def test_local_rate_limiter_shares_limit_between_workers():
+    limiter = LocalRateLimiter(workers=2)
+    policy = RateLimitPolicy(limit=4, period=60)
+    assert [limiter.hit('key', policy)[0] for _ in range(3)] == [True, True, False]
+    allowed, retry_after = limiter.hit('key', policy)
+    assert not allowed and 0 < retry_after <= 30
+
+
+def test_rate_limit_falls_back_to_local_limiter(app):
+    @rate_limit(rps=1)
+    def limited():
+        return 'ok'
+
+    redis.breaker.reset()
+    with app.test_request_context(), mock.patch.object(
+        RateLimiter, 'hit', side_effect=ConnectionError('down')
+    ) as hit:
+        assert limited() == 'ok'
+        with pytest.raises(RateLimitExceededError):
+            limited()
+    assert hit.call_count == 2
+    redis.breaker.reset()
+
+
+def test_rate_limit_skips_redis_when_circuit_open(app):
+    @rate_limit(rps=10)
+    def limited():
+        return 'ok'
+
+    redis.breaker.failure_threshold = 1
+    redis.breaker.failure()
+    try:
+        with app.test_request_context(), mock.patch.object(RateLimiter, 'hit') as hit:
+            assert limited() == 'ok'
+        hit.assert_not_called()
+    finally:
+        redis.breaker.failure_threshold = app.config['REDIS_BREAKER_FAILURES']
+        redis.breaker.reset()
+
+
+def test_guard_reports_to_breaker(app):
+    redis.breaker.reset()
+    with pytest.raises(ConnectionError):
+        with redis.guard():
+            raise ConnectionError('down')
+    assert redis.breaker.failures == 1
+    with redis.guard():
+        pass
+    assert redis.breaker.failures == 0
+
+
+def test_cache_short_circuits_when_unavailable(redis_cache):
+    @cache(connector=redis)
+    def cached_function():
+        return 'computed'
+
+    with mock.patch.object(redis, 'available', return_value=False), mock.patch.object(
+        redis, 'get_key'
+    ) as get_key:
+        assert cached_function() == 'computed'
+    get_key.assert_not_called()
+
+
+def test_request_budget(app):
+    budget = app.config['REDIS_REQUEST_BUDGET']
+    app.config['REDIS_REQUEST_BUDGET'] = 0.01
+    try:
+        with app.test_request_context('/'):
+            assert redis.available()
+            with redis.guard():
+                time.sleep(0.02)
+            assert redis.time_spent >= 0.02
+            assert not redis.available()
+        with app.test_request_context('/'):
+            assert redis.available()
+        # no budget outside of requests, e.g. in Celery worker's app context
+        with app.app_context():
+            with redis.guard():
+                time.sleep(0.02)
+            assert redis.available()
+    finally:
+        app.config['REDIS_REQUEST_BUDGET'] = budget
+        redis.breaker.reset()
@@ -0,0 +1,70 @@
+from pili.app import db
+from pili.models import (
+    Category,
+    Comment,
+    Like,
+    Post,
+    Tag,
+    Tagification,
+    User,
+    recount_counters,
+)
+
+
+def _create_post(name):
+    user = User(email='{}@example.com'.format(name), username=name, password='cat')
+    category = Category(title=name, alias=name)
+    post = Post(title=name, alias=name, body=name, author=user)
+    post.category = category
+    tag = Tag(title=name, alias=name)
+    db.session.add_all([user, category, post, tag])
+    db.session.flush()
+    db.session.add(Tagification(tag_id=tag.id, post_id=post.id))
+    db.session.commit()
+    return user, category, post, tag
+
+
+def test_post_counters():
+    user, category, post, tag = _create_post('counters')
+    assert user.post_count == 1
+    assert category.post_count == 1
+    assert tag.post_count == 1
+
+    comment = Comment(body='comment', post=post, author=user)
+    db.session.add_all([comment, Like(post=post, user=user)])
+    db.session.commit()
+    assert post.comment_count == 1
+    assert post.like_count == 1
+
+    db.session.add(Like(comment=comment, user=user))
+    db.session.commit()
+    assert comment.like_count == 1
+
+    db.session.delete(comment)
+    db.session.commit()
+    assert post.comment_count == 0
+
+
+def test_post_category_change():
+    user, category, post, tag = _create_post('category')
+    other = Category(title='Other', alias='other')
+    db.session.add(other)
+    db.session.commit()
+
+    post.category = other
+    db.session.commit()
+    assert category.post_count == 0
+    assert other.post_count == 1
+
+
+def test_recount_counters():
+    user, category, post, tag = _create_post('recount')
+    db.session.add(Like(post=post, user=user))
+    db.session.commit()
+    db.session.query(Post).update({Post.like_count: 42}, synchronize_session=False)
+    db.session.query(Tag).update({Tag.post_count: 0}, synchronize_session=False)
+
+    recount_counters()
+    assert post.like_count == 1
+    assert tag.post_count == 1
+    assert user.follower_count == 1
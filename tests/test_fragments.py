@@ -0,0 +1,111 @@
+from unittest import mock
+
+import flask
+import pytest
+
+from pili.app import db, redis
+from pili.fragments import cached_fragment
+from pili.models import CACHE_TAGS, Category, Post, _invalidate_cache_tags
+
+TEMPLATE = "{% cache ['card', id], ['post:' ~ id] %}<b>{{ name }}</b>{% endcache %}"
+
+
+@pytest.fixture
+def fragment_cache(app):
+    app.config.update(CACHE_DISABLE=False)
+    with app.app_context(), mock.patch.object(
+        redis, 'get_versions', return_value=[3]
+    ) as get_versions, mock.patch.object(
+        redis, 'get_key', return_value=None
+    ) as get_key, mock.patch.object(
+        redis, 'set_key'
+    ) as set_key:
+        yield get_versions, get_key, set_key
+    app.config.update(CACHE_DISABLE=True)
+
+
+def test_fragment_rendered_and_stored(app, fragment_cache):
+    get_versions, get_key, set_key = fragment_cache
+    template = app.jinja_env.from_string(TEMPLATE)
+    assert template.render(id=5, name='<i>') == '<b>&lt;i&gt;</b>'
+    get_versions.assert_called_once_with(['post:5'])
+    set_key.assert_called_once_with(
+        'fragment:card:5:3',
+        '<b>&lt;i&gt;</b>',
+        app.config['PILI_FRAGMENT_CACHE_EXPIRE'],
+    )
+
+
+def test_fragment_replayed_unescaped(app, fragment_cache):
+    _, get_key, set_key = fragment_cache
+    get_key.return_value = b'<b>cached</b>'
+    template = app.jinja_env.from_string(TEMPLATE)
+    assert template.render(id=5, name='x') == '<b>cached</b>'
+    set_key.assert_not_called()
+
+
+def test_fragment_versions_fetched_once_per_request(app, fragment_cache):
+    get_versions, _, _ = fragment_cache
+    render = mock.Mock(return_value='x')
+    with app.test_request_context('/'):
+        cached_fragment('a', ['posts'], render)
+        cached_fragment('b', ['posts'], render)
+    assert get_versions.call_count == 1
+    # no request context, e.g. Celery worker's application context
+    cached_fragment('c', ['posts'], render)
+    assert get_versions.call_count == 2
+
+
+def test_fragment_not_cached_when_disabled(app):
+    render = mock.Mock(return_value='x')
+    with mock.patch.object(redis, 'get_key') as get_key:
+        assert cached_fragment('a', ['posts'], render) == 'x'
+    get_key.assert_not_called()
+
+
+def test_categories_sidebar_counts_new_posts(app):
+    versions, store = {}, {}
+
+    def set_key(key, value, expire_seconds):
+        store[key] = value.encode('utf-8')
+
+    def invalidate_tags(tags):
+        for tag in tags:
+            versions[tag] = versions.get(tag, 0) + 1
+        return []
+
+    def render_sidebar(categories):
+        with app.test_request_context('/'):
+            return flask.render_template('main/_categories.html', categories=categories)
+
+    category = Category(title='Sidebar', alias='sidebar')
+    db.session.add(category)
+    db.session.flush()
+    db.session.info.pop(CACHE_TAGS, None)
+
+    app.config.update(CACHE_DISABLE=False)
+    try:
+        with mock.patch.object(
+            redis,
+            'get_versions',
+            side_effect=lambda tags: [versions.get(tag, 0) for tag in tags],
+        ), mock.patch.object(
+            redis, 'get_key', side_effect=store.get
+        ), mock.patch.object(
+            redis, 'set_key', side_effect=set_key
+        ), mock.patch.object(
+            redis, 'invalidate_tags', side_effect=invalidate_tags
+        ):
+            assert '<span class="badge">0</span>' in render_sidebar([category])
+
+            db.session.add(
+                Post(title='Counted', alias='counted', body='x', category=category)
+            )
+            db.session.flush()
+            # the tags collected on flush are invalidated on commit
+            _invalidate_cache_tags(db.session)
+            db.session.refresh(category)
+
+            assert '<span class="badge">1</span>' in render_sidebar([category])
+    finally:
+        app.config.update(CACHE_DISABLE=True)
@@ -0,0 +1,88 @@
+from unittest import mock
+
+import pytest
+from jinja2 import DictLoader, Environment
+from prometheus_client import REGISTRY
+from sqlalchemy.exc import DBAPIError
+
+from pili.app import db
+from pili.instrumentation import fingerprint, get_query_stats, report_repeated_queries
+
+
+def test_query_stats_counted_per_request(app):
+    with app.test_request_context('/'):
+        stats = get_query_stats()
+        db.session.execute('SELECT 1')
+        count = stats.count
+        db.session.execute('SELECT 2')
+        assert stats.count == count + 1
+        assert stats.duration > 0
+    with app.test_request_context('/'):
+        assert get_query_stats().count == 0
+
+
+def test_failed_query_leaves_no_start_time(app):
+    connection = db.session.connection()
+    with app.test_request_context('/'):
+        stats = get_query_stats()
+        with pytest.raises(DBAPIError), db.session.begin_nested():
+            db.session.execute('SELECT * FROM no_such_table')
+        count = stats.count
+        db.session.execute('SELECT 1')
+        assert stats.count == count + 1
+    assert 'query_start_time' not in connection.info
+
+
+def test_slow_query_logged_with_endpoint(app):
+    app.config.update(PILI_SLOW_DB_QUERY_TIME=0)
+    try:
+        with app.test_request_context('/'), mock.patch.object(
+            app.logger, 'warning'
+        ) as warning:
+            app.preprocess_request()
+            db.session.execute('SELECT 1')
+    finally:
+        app.config.update(PILI_SLOW_DB_QUERY_TIME=0.5)
+    message = warning.call_args[0][0]
+    assert 'SELECT 1' in message
+    assert 'Endpoint: main.index' in message
+
+
+def test_query_metrics_labelled_by_rule(app, client):
+    labels = {'endpoint': '/tag/<alias>'}
+    before = REGISTRY.get_sample_value('app_db_query_count_count', labels) or 0
+    client.get('/tag/unknown-tag')
+    assert REGISTRY.get_sample_value('app_db_query_count_count', labels) == before + 1
+    assert REGISTRY.get_sample_value('app_db_query_count_sum', labels) > 0
+
+
+def test_fingerprint_ignores_in_clause_length():
+    assert fingerprint('SELECT * FROM posts WHERE id IN (?, ?, ?)') == fingerprint(
+        'SELECT *\n FROM posts WHERE id IN (?)'
+    )
+    assert fingerprint('SELECT * FROM tags WHERE id IN (%(id_1)s, %(id_2)s)') == (
+        'SELECT * FROM tags WHERE id IN (?)'
+    )
+
+
+def test_repeated_queries_reported_with_template_line(app):
+    # lazy relationships accessed in a loop
+    env = Environment(
+        loader=DictLoader(
+            {'page.html': '<ul>\n{% for i in range(n) %}{{ query() }}{% endfor %}'}
+        )
+    )
+    threshold = app.config['PILI_REPEATED_QUERY_THRESHOLD']
+    with app.test_request_context('/'), mock.patch.object(
+        app.logger, 'warning'
+    ) as warning:
+        db.session.execute('SELECT 4')
+        env.get_template('page.html').render(
+            n=threshold, query=lambda: db.session.execute('SELECT 3') and ''
+        )
+        repeated = get_query_stats().repeated(threshold)
+        report_repeated_queries(None)
+
+    assert repeated == [('SELECT 3', threshold, 'page.html:2')]
+    assert 'Repeated query: SELECT 3' in warning.call_args[0][0]
+    assert 'Context: page.html:2' in warning.call_args[0][0]
@@ -0,0 +1,38 @@
+import pytest
+
+from pili.app import vary
+from pili.connectors.keys import MAX_POSTFIX_LENGTH, Vary
+
+
+def test_vary_on_nothing(app):
+    key_func = Vary()
+    with app.test_request_context('/posts/?page=2', headers={'X-Real-Ip': '1.2.3.4'}):
+        assert key_func() == ''
+        assert key_func(id=5) == 'id=5'
+
+
+def test_vary_on_query_and_headers(app):
+    key_func = Vary(query=['page', 'count'], headers=['Accept-Language'])
+    with app.test_request_context(
+        '/posts/?page=2&utm_source=x', headers={'Accept-Language': 'en'}
+    ):
+        assert key_func() == 'q.page=2&h.accept-language=en'
+    with app.test_request_context('/posts/?page=3'):
+        assert key_func() == 'q.page=3'
+
+
+def test_vary_on_user_and_role(app):
+    key_func = vary(user=True, role=True)
+    with app.test_request_context('/posts/'):
+        assert key_func() == 'user=&role='
+
+
+def test_vary_long_postfix_hashed(app):
+    key_func = Vary(query=['q'])
+    with app.test_request_context('/search?q=' + 'x' * MAX_POSTFIX_LENGTH):
+        assert len(key_func()) == 40
+
+
+def test_vary_requires_key_funcs():
+    with pytest.raises(ValueError):
+        Vary(user=True)
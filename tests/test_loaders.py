@@ -0,0 +1,66 @@
+from pili.app import db
+from pili.loaders import load_posts, load_users
+from pili.models import AnonymousUser, Comment, Like, Post, Tag, Tagification, User
+
+
+def _create_posts():
+    u1 = User(email='john@example.com', username='john', password='cat')
+    u2 = User(email='susan@example.org', username='susan', password='dog')
+    db.session.add_all([u1, u2])
+    p1 = Post(title='First', alias='first', body='first', author=u1)
+    p2 = Post(title='Second', alias='second', body='second', author=u2)
+    db.session.add_all([p1, p2])
+    tag = Tag(title='Python', alias='python')
+    db.session.add(tag)
+    db.session.flush()
+
+    db.session.add(Tagification(tag_id=tag.id, post_id=p1.id))
+    db.session.add_all(
+        [Like(post=p1, user=u1), Like(post=p1, user=u2), Like(post=p2, user=u2)]
+    )
+    db.session.add(Comment(body='comment', post=p1, author=u2))
+    db.session.commit()
+    return u1, u2, p1, p2, tag
+
+
+def test_load_posts_counters():
+    u1, u2, p1, p2, tag = _create_posts()
+
+    first, second = load_posts([p1, p2], u1)
+
+    assert first.tags == [tag]
+    assert first.like_count == 2
+    assert first.comment_count == 1
+    assert first.liked is True
+    assert first.title == 'First'
+
+    assert second.tags == []
+    assert second.like_count == 1
+    assert second.comment_count == 0
+    assert second.liked is False
+
+
+def test_load_posts_anonymous():
+    u1, u2, p1, p2, tag = _create_posts()
+
+    views = load_posts([p1, p2], AnonymousUser())
+
+    assert not any(view.liked for view in views)
+
+
+def test_load_posts_empty():
+    assert load_posts([]) == []
+
+
+def test_load_users_counters():
+    u1, u2, p1, p2, tag = _create_posts()
+    db.session.add(Comment(body='reply', post=p1, author=u1, recipient=u2))
+    db.session.flush()
+
+    first, second = load_users([u1, u2])
+
+    assert first.user is u1 and first.username == 'john'
+    assert (first.comment_count, first.reply_count) == (1, 0)
+    assert (second.comment_count, second.reply_count) == (1, 1)
+    assert first.category_count == second.image_count == 0
+    assert load_users([]) == []
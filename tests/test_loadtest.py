@@ -0,0 +1,51 @@
+import os
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+from pili.loadtest import (
+    AnonymousReader,
+    ApiClient,
+    format_results,
+    profile_size,
+    run_load,
+)
+
+INI = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'etc/uwsgi/pili.ini')
+
+
+@pytest.mark.parametrize(
+    'section, size',
+    [('solo', (1, 1)), ('octet', (8, 4)), ('testing', (1, 1)), ('production', (4, 2))],
+)
+def test_profile_size(section, size):
+    assert profile_size(INI, section) == size
+
+
+@pytest.fixture
+def server(app):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    server_name = app.config['SERVER_NAME']
+    app.config['SERVER_NAME'] = '127.0.0.1:{}'.format(server.server_port)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://{}'.format(app.config['SERVER_NAME'])
+    server.shutdown()
+    app.config['SERVER_NAME'] = server_name
+
+
+def test_run_load(server):
+    # the server's threads do not see the data of the test's transaction
+    results = run_load(
+        server, users=4, duration=1, scenarios=(AnonymousReader, ApiClient), seed=1
+    )
+
+    by_name = {result.name: result for result in results}
+    assert by_name['main.index'].failures == 0
+    total = results[-1]
+    assert total.name == 'total'
+    assert total.requests == sum(r.requests for r in results[:-1]) > 0
+    assert total.rps > 0
+    assert 0 < total.p50 <= total.p99
+    assert 'total' in format_results(results)
@@ -0,0 +1,65 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from pili.app import db
+from pili.exceptions import ValidationError
+from pili.models import Post
+from pili.pagination import PREV, KeysetPagination, decode_cursor, encode_cursor
+
+
+def test_cursor_roundtrip():
+    timestamp = datetime(2019, 6, 1, 12, 30, 15, 1234)
+    cursor = encode_cursor(timestamp, 42, direction=PREV)
+    assert decode_cursor(cursor) == (PREV, timestamp, 42)
+
+
+@pytest.mark.parametrize(
+    'cursor', ['', 'garbage', encode_cursor(datetime.now(), 1)[:-3]]
+)
+def test_invalid_cursor(cursor):
+    with pytest.raises(ValidationError):
+        decode_cursor(cursor)
+
+
+def test_keyset_pagination():
+    start = datetime(2019, 1, 1)
+    # posts with the same timestamp are ordered by id
+    posts = [
+        Post(title=str(i), alias='keyset', timestamp=start + timedelta(days=i // 2))
+        for i in range(7)
+    ]
+    db.session.add_all(posts)
+    db.session.commit()
+    query = Post.query.filter(Post.alias == 'keyset')
+    expected = sorted(posts, key=lambda p: (p.timestamp, p.id), reverse=True)
+
+    first = KeysetPagination(query, Post.timestamp, Post.id, per_page=3)
+    assert first.items == expected[:3]
+    assert not first.has_prev and first.has_next
+    assert first.total is None
+
+    second = KeysetPagination(
+        query, Post.timestamp, Post.id, cursor=first.next_cursor, per_page=3
+    )
+    assert second.items == expected[3:6]
+    assert second.has_prev and second.has_next
+
+    last = KeysetPagination(
+        query, Post.timestamp, Post.id, cursor=second.next_cursor, per_page=3
+    )
+    assert last.items == expected[6:]
+    assert not last.has_next
+    assert last.next_cursor is None
+
+    back = KeysetPagination(
+        query,
+        Post.timestamp,
+        Post.id,
+        cursor=second.prev_cursor,
+        per_page=3,
+        count=True,
+    )
+    assert back.items == expected[:3]
+    assert not back.has_prev and back.has_next
+    assert back.total == 7
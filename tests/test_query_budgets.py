@@ -0,0 +1,88 @@
+import pytest
+
+from pili.app import db
+from pili.models import Category, Comment, Like, Post, Role, Tag, Tagification, User
+
+
+@pytest.fixture
+def posts():
+    """
+    Create a page of posts by different authors with tags, comments and likes
+
+    Requests to the pages below would grow with the number of posts, authors
+    or comments if per-row queries were made.
+    """
+    admin_role = Role.query.filter_by(name='Administrator').first()
+    admin = User(
+        email='admin@example.com',
+        username='admin',
+        password='cat',
+        confirmed=True,
+        role=admin_role,
+    )
+    users = [
+        User(
+            email='user{}@example.com'.format(i),
+            username='user{}'.format(i),
+            password='cat',
+            confirmed=True,
+        )
+        for i in range(5)
+    ]
+    category = Category(title='News', alias='news')
+    tags = [Tag(title='Tag {}'.format(i), alias='tag-{}'.format(i)) for i in range(3)]
+    db.session.add_all([admin, category] + users + tags)
+    posts = [
+        Post(
+            title='Post {}'.format(i),
+            alias='post-{}'.format(i),
+            body='Body {}'.format(i),
+            author=users[i % len(users)],
+            category=category,
+        )
+        for i in range(10)
+    ]
+    db.session.add_all(posts)
+    db.session.flush()
+    for i, post in enumerate(posts):
+        db.session.add_all(Tagification(tag_id=tag.id, post_id=post.id) for tag in tags)
+        db.session.add_all(
+            Comment(body='Comment {}'.format(j), post=post, author=user)
+            for j, user in enumerate(users)
+        )
+        db.session.add_all(Like(post=post, user=user) for user in users[: i % 3])
+    db.session.commit()
+    return admin, posts
+
+
+def _login(client, user):
+    response = client.post('/auth/login', data={'email': user.email, 'password': 'cat'})
+    assert response.status_code == 302
+
+
+def test_main_index_budget(client, posts, query_budget):
+    with query_budget('main.index'):
+        assert client.get('/').status_code == 200
+
+
+def test_main_post_budget(client, posts, query_budget):
+    admin, posts = posts
+    with query_budget('main.post'):
+        assert client.get('/news/{}/post-0'.format(posts[0].id)).status_code == 200
+
+
+def test_api_get_posts_budget(client, posts, query_budget):
+    with query_budget('api.get_posts'):
+        assert client.get('/api/v1.0/posts/').status_code == 200
+
+
+def test_ctrl_users_budget(app, client, posts, query_budget):
+    admin, posts = posts
+    _login(client, admin)
+    # ctrl templates render CSRF tokens
+    app.config.update(WTF_CSRF_ENABLED=True)
+    try:
+        with query_budget('ctrl.users'):
+            assert client.get('/ctrl/users').status_code == 200
+    finally:
+        app.config.update(WTF_CSRF_ENABLED=False)
@@ -0,0 +1,76 @@
+from unittest import mock
+
+import pytest
+
+from pili.app import db
+from pili.models import PENDING_RENDERS, Comment, Post, _enqueue_renders
+from pili.rendering import Renderer, digest, get_cache, render, render_body_async
+
+
+def test_render_profiles():
+    text = '# Title\n\n<div class="x">box</div>\n\n**bold** http://example.com'
+    html = render(text, profile='html')
+    comment = render(text, profile='comment')
+
+    assert '<h1>' in html and '<div class="x">' in html
+    assert 'rel="nofollow"' in html
+    assert '<h1>' not in comment and '<div' not in comment
+    assert '<strong>bold</strong>' in comment
+    assert render(None) is None
+
+
+def test_render_cached_by_content():
+    get_cache().clear()
+    with mock.patch.object(Renderer, 'render', return_value='<p>x</p>') as renderer:
+        assert render('cached body') == '<p>x</p>'
+        assert render('cached body') == '<p>x</p>'
+        render('cached body', profile='comment')
+    assert renderer.call_count == 2
+
+
+def test_unchanged_body_not_rendered():
+    post = Post(body='**same**')
+    comment = Comment(body='**same**')
+    assert post.body_html == '<p><strong>same</strong></p>'
+
+    with mock.patch('pili.models.render') as renderer:
+        post.body = '**same**'
+        comment.body = '**same**'
+    renderer.assert_not_called()
+
+
+@pytest.fixture
+def render_async(app):
+    app.config.update(PILI_RENDER_ASYNC=True, PILI_RENDER_ASYNC_THRESHOLD=10)
+    yield
+    app.config.update(PILI_RENDER_ASYNC=False)
+
+
+def test_render_async(render_async):
+    post = Post(title='async', alias='async', body='**long** <enough>\n\nbody')
+    assert post.body_html == '<p>**long** &lt;enough&gt;</p><p>body</p>'
+    assert post.body_html_pending is True
+
+    db.session.add(post)
+    db.session.flush()
+    body_digest = digest(post.body)
+    assert db.session.info[PENDING_RENDERS] == {post.id: body_digest}
+
+    with mock.patch.object(render_body_async, 'apply_async') as apply_async:
+        _enqueue_renders(db.session)
+    apply_async.assert_called_once_with(args=['Post', post.id, body_digest, 'html'])
+    assert PENDING_RENDERS not in db.session.info
+
+    # task for an outdated body does nothing
+    render_body_async('Post', post.id, digest('outdated'), 'html')
+    assert post.body_html_pending is True
+
+    render_body_async('Post', post.id, body_digest, 'html')
+    assert post.body_html == '<p><strong>long</strong> </p>\n<p>body</p>'
+    assert post.body_html_pending is False
+
+
+def test_render_short_body_sync(render_async):
+    post = Post(body='short')
+    assert post.body_html == '<p>short</p>'
+    assert not post.body_html_pending
@@ -0,0 +1,25 @@
+from pili.models import Comment, Follow, Like, Post, Tag, User
+from pili.seeding import generate
+
+
+def test_generate_counts_and_counters():
+    inserted = generate(
+        users=10, posts=30, comments=50, likes=80, follows=3, tags=5, seed=1
+    )
+
+    assert inserted['users'] == 10
+    assert inserted['posts'] == 30
+    assert inserted['comments'] == 50
+    assert Post.query.count() == 30
+    assert Like.query.count() == inserted['likes']
+    assert Follow.query.count() == inserted['follows']
+    # self-follows, as User() does
+    assert all(user.is_following(user) for user in User.query)
+    # replies are addressed to the parent comment's author
+    reply = Comment.query.filter(Comment.parent_id.isnot(None)).first()
+    assert reply.recipient_id == reply.parent.author_id
+    # denormalized counters are recomputed
+    post = Post.query.order_by(Post.comment_count.desc()).first()
+    assert post.comment_count == post.comments.count() > 0
+    tag = Tag.query.order_by(Tag.post_count.desc()).first()
+    assert tag.post_count == tag.posts.count()
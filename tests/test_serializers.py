@@ -0,0 +1,60 @@
+import pickle
+
+import pytest
+
+from pili.connectors.serializers import HEADER_MARKER, CachedResponse, Codec, get_codec
+
+
+def test_codec_roundtrip_with_header():
+    codec = get_codec('json')
+    data = codec.dumps({'a': [1, 2]})
+    assert data.startswith(HEADER_MARKER)
+    assert codec.loads(data) == {'a': [1, 2]}
+
+
+def test_codec_compresses_above_threshold():
+    codec = get_codec('json', compression='zlib', threshold=64)
+    small, large = {'a': 'x'}, {'a': 'x' * 1000}
+    assert codec.dumps(small)[2] == 0
+    data = codec.dumps(large)
+    assert data[2] != 0 and len(data) < 100
+    assert codec.loads(data) == large
+
+
+def test_codecs_load_each_others_values():
+    value = {'posts': [{'id': 1}]}
+    data = get_codec('json', compression='zlib').dumps(value)
+    assert get_codec('pickle').loads(data) == value
+    data = get_codec('pickle', compression='zlib').dumps(value)
+    assert get_codec('pickle').loads(data) == value
+    with pytest.raises(ValueError):
+        get_codec('json').loads(data)
+
+
+def test_codec_loads_headerless_values():
+    codec = get_codec('json')
+    assert codec.loads(b'{"a":1}') == {'a': 1}
+    with pytest.raises(ValueError):
+        codec.loads(pickle.dumps({'a': 1}))
+    assert get_codec('pickle').loads(pickle.dumps({'a': 1})) == {'a': 1}
+
+
+def test_codec_unknown_serializer():
+    with pytest.raises(ValueError):
+        Codec('unknown')
+    with pytest.raises(ValueError):
+        get_codec('json').loads(HEADER_MARKER + b'\xff\x00{}')
+
+
+def test_response_codec_keeps_body_bytes():
+    response = CachedResponse(200, [('Content-Type', 'image/png')], b'\x89PNG\n\x00')
+    codec = get_codec('response')
+    assert codec.loads(codec.dumps(response)) == response
+
+
+def test_codec_strict_loads():
+    codec = get_codec('response')
+    with pytest.raises(ValueError):
+        codec.loads(get_codec('json').dumps([200, []]), strict=True)
+    with pytest.raises(ValueError):
+        codec.loads(b'{}', strict=True)
@@ -0,0 +1,162 @@
+from datetime import datetime, timedelta
+from unittest import mock
+
+import pytest
+
+from pili import timeline
+from pili.app import db, redis as redis_connector
+from pili.connectors.redis import RedisConnector
+from pili.models import Post, User
+from pili.timeline import TIMELINE_CHANGES
+
+
+@pytest.fixture
+def enabled(app):
+    app.config.update(PILI_TIMELINE=True)
+    with mock.patch.object(redis_connector, 'available', return_value=True):
+        yield
+    app.config.update(PILI_TIMELINE=False)
+
+
+@pytest.fixture
+def connection(enabled):
+    connection = mock.MagicMock()
+    with mock.patch.object(
+        RedisConnector, 'connection', new_callable=mock.PropertyMock
+    ) as prop:
+        prop.return_value = connection
+        yield connection
+
+
+def _create_users():
+    john = User(email='john@example.com', username='john', password='cat')
+    susan = User(email='susan@example.org', username='susan', password='dog')
+    db.session.add_all([john, susan])
+    db.session.flush()
+    return john, susan
+
+
+def test_timeline_changes_collected_on_flush(enabled):
+    john, susan = _create_users()
+    db.session.info.pop(TIMELINE_CHANGES, None)
+
+    post = Post(title='First', alias='first', body='first', author=john)
+    db.session.add(post)
+    susan.follow(john)
+    db.session.flush()
+    changes = db.session.info.pop(TIMELINE_CHANGES)
+    # new post fans out to author's followers (self-follow included),
+    # new follower gets followed user's latest posts
+    assert (sorted(changes[0][0]), changes[0][1]) == (
+        sorted([john.id, susan.id]),
+        [(post.id, post.timestamp)],
+    )
+    assert changes[1] == ([susan.id], [(post.id, post.timestamp)], [])
+
+    post.timestamp -= timedelta(days=1)
+    db.session.flush()
+    # rescored in the timelines
+    ((user_ids, added, removed),) = db.session.info.pop(TIMELINE_CHANGES)
+    assert added == [(post.id, post.timestamp)]
+
+    susan.unfollow(john)
+    db.session.flush()
+    assert db.session.info.pop(TIMELINE_CHANGES) == [([susan.id], [], [post.id])]
+
+    db.session.delete(post)
+    db.session.flush()
+    assert db.session.info.pop(TIMELINE_CHANGES) == [([john.id], [], [post.id])]
+
+
+def test_timeline_changes_ignored_if_disabled():
+    john, susan = _create_users()
+    db.session.add(Post(title='First', alias='first', body='first', author=john))
+    db.session.flush()
+    assert not db.session.info.get(TIMELINE_CHANGES)
+
+
+def test_timeline_changes_applied_on_commit(enabled):
+    added = [(1, datetime(2019, 1, 1))]
+    db.session.info[TIMELINE_CHANGES] = [([1, 2], added, []), ([2], [], [3])]
+    with mock.patch.object(timeline, 'add_posts') as add_posts, mock.patch.object(
+        timeline, 'remove_posts'
+    ) as remove_posts:
+        timeline._apply_timeline_changes(db.session)
+    add_posts.assert_has_calls([mock.call([1, 2], added), mock.call([2], [])])
+    remove_posts.assert_has_calls([mock.call([1, 2], []), mock.call([2], [3])])
+    assert TIMELINE_CHANGES not in db.session.info
+
+
+def test_schedule_rebuild_once(app, connection):
+    connection.set.side_effect = [True, None]
+    with mock.patch.object(timeline.rebuild_timeline, 'apply_async') as rebuild:
+        assert timeline.schedule_rebuild(1)
+        assert not timeline.schedule_rebuild(1)
+    rebuild.assert_called_once_with(args=[1])
+
+
+def test_rebuild_timeline_clears_marker(app, connection):
+    with mock.patch.object(timeline, 'build') as build:
+        timeline.rebuild_timeline(1)
+    build.assert_called_once_with(1)
+    connection.delete.assert_called_once_with('timeline:1:rebuilding')
+
+
+def test_build_keeps_sentinel(connection):
+    john, susan = _create_users()
+    post = Post(title='First', alias='first', body='first', author=john)
+    db.session.add(post)
+    db.session.flush()
+    pipe = connection.pipeline.return_value
+
+    assert timeline.build(john.id) == 1
+
+    pipe.delete.assert_called_once_with('timeline:{}'.format(john.id))
+    mapping = pipe.zadd.call_args[0][1]
+    assert mapping == {
+        str(post.id): timeline._score(post.timestamp),
+        '0': float('-inf'),
+    }
+
+
+def test_read_skips_sentinel(connection):
+    pipe = connection.pipeline.return_value
+    pipe.execute.return_value = [[b'5', b'4', b'0'], 3, True]
+    assert timeline.read(1, 0, 9) == ([5, 4], 2)
+    pipe.execute.return_value = [[], 0, False]
+    assert timeline.read(1, 0, 9) is None
+
+
+def test_paginate_followed_from_timeline(app, enabled):
+    john, susan = _create_users()
+    posts = [
+        Post(title=str(i), alias=str(i), body=str(i), author=john) for i in range(3)
+    ]
+    db.session.add_all(posts)
+    db.session.flush()
+
+    with app.test_request_context('/?page=2'), mock.patch.object(
+        timeline, 'read', return_value=([posts[2].id, posts[0].id], 5)
+    ) as read:
+        pagination = timeline.paginate_followed(john, per_page=2)
+    read.assert_called_once_with(john.id, 2, 3)
+    assert pagination.items == [posts[2], posts[0]]
+    assert pagination.total == 5
+    assert pagination.has_prev and pagination.has_next
+
+
+def test_paginate_followed_cold_user_from_db(app, connection):
+    john, susan = _create_users()
+    post = Post(title='First', alias='first', body='first', author=john)
+    db.session.add(post)
+    db.session.flush()
+
+    with app.test_request_context('/'), mock.patch.object(
+        timeline, 'read', return_value=None
+    ), mock.patch.object(timeline.rebuild_timeline, 'apply_async') as rebuild:
+        pagination = timeline.paginate_followed(john, per_page=2)
+    rebuild.assert_called_once_with(args=[john.id])
+    connection.set.assert_called_once_with(
+        'timeline:{}:rebuilding'.format(john.id), 1, nx=True, ex=60
+    )
+    assert pagination.items == [post]
@@ -204,3 +204,23 @@ def test_follows():
     db.session.delete(u2)
     db.session.commit()
     assert Follow.query.count() == 1
+
+
+def test_follow_counters():
+    u1 = User(email='david@example.net', password='cat')
+    u2 = User(email='mary@example.net', password='dog')
+    db.session.add(u1)
+    db.session.add(u2)
+    db.session.commit()
+    assert u1.followed_count == 1
+    assert u2.follower_count == 1
+
+    u1.follow(u2)
+    db.session.commit()
+    assert u1.followed_count == 2
+    assert u2.follower_count == 2
+
+    u1.unfollow(u2)
+    db.session.commit()
+    assert u1.followed_count == 1
+    assert u2.follower_count == 1